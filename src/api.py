@@ -1,13 +1,24 @@
 import os, time, json, requests, uuid
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
-from threading import Thread
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from src.convo.engine import ConversationEngine
 from src.convo.summarizer import ConversationSummarizer
+from src.convo.summary_jobs import SummaryJobManager
+from src.convo.memory_snapshot import MemorySnapshotter
+from src.convo.log_reader import iter_records_reverse
+from src.convo.llm_logger import LEGACY_LLM_LOG_PATHS, migrate_legacy
+from src.convo.log_writer import flush_all as flush_log_writers, writer_stats
+from src.convo.log_lifecycle import LogLifecycleManager
+from src.convo.session_logger import get_stage_policy
+from src.convo.prompt_store import get_prompt_store, register_templates, reconstruct as reconstruct_llm_record
 from src.sync.conversation_sync import ConversationSync
+from src.sync.sync_scheduler import SyncScheduler
+from src.sync.gateway_stream import GatewayStream
+from src.storage.parquet_export import ParquetExporter
 
 APP_PORT = int(os.getenv("APP_PORT", "8080"))
 app = FastAPI(title="KLAR RAG API", version="1.0-clean")
@@ -22,24 +33,51 @@ app.add_middleware(
 
 engine = ConversationEngine()
 summarizer = ConversationSummarizer()
+summary_jobs = SummaryJobManager(summarizer)
 sync_service = ConversationSync()
+memory_snapshots = MemorySnapshotter(
+    engine.memstore,
+    interval=float(os.getenv("MEMORY_SNAPSHOT_INTERVAL", "900")),
+)
 
-def periodic_sync():
-    while True:
-        try:
-            print("[SYNC] Starting periodic sync...")
-            result = sync_service.sync_all()
-            print(f"[SYNC] Complete: {result['synced_count']} conversations in {result['duration']}s")
-        except Exception as e:
-            print(f"[SYNC] Error: {e}")
-        
-        time.sleep(60)
+sync_scheduler = SyncScheduler(sync_service)
+gateway_stream = GatewayStream(sync_service, on_state_change=sync_scheduler.set_push_connected)
+GATEWAY_STREAM_ENABLED = os.getenv("GATEWAY_STREAM_ENABLED", "false").lower() in ("1", "true", "yes")
+parquet_exporter = ParquetExporter(sync_service.db)
+log_lifecycle = LogLifecycleManager()
+
+def export_parquet_after_sync(result: Dict[str, Any]):
+    exported = parquet_exporter.export()
+    if exported["rows"]:
+        print(f"[EXPORT] {exported['rows']} messages -> {exported['files']} parquet file(s) in {exported['duration']}s")
+
+if os.getenv("PARQUET_EXPORT_ENABLED", "true").lower() in ("1", "true", "yes"):
+    sync_scheduler.after_sync.append(export_parquet_after_sync)
 
 @app.on_event("startup")
 async def startup_event():
-    sync_thread = Thread(target=periodic_sync, daemon=True)
-    sync_thread.start()
-    print("[SYNC] Background sync started (every 60s)")
+    for legacy_path in LEGACY_LLM_LOG_PATHS:
+        moved = migrate_legacy(legacy_path)
+        if moved:
+            print(f"[LLM LOG] Migrated {moved} records from legacy {legacy_path}")
+    print(f"[LLM LOG] Registered {register_templates()} prompt templates")
+    sync_scheduler.start()
+    print(f"[SYNC] Background sync started (adaptive {int(sync_scheduler.min_interval)}-{int(sync_scheduler.max_interval)}s)")
+    if GATEWAY_STREAM_ENABLED:
+        gateway_stream.start()
+        print(f"[STREAM] Push channel to {gateway_stream.url} started; polling reconciles every {int(sync_scheduler.reconcile_interval)}s while connected")
+    memory_snapshots.start()
+    print(f"[SNAPSHOT] Background memory snapshots started (every {int(memory_snapshots.interval)}s)")
+    log_lifecycle.start()
+    print(f"[LOGS] Log lifecycle started (keep {log_lifecycle.retention_days} days, max {log_lifecycle.max_total_bytes // (1024 * 1024)}MB)")
+
+@app.on_event("shutdown")
+def shutdown_event():
+    flush_log_writers()
+    print("[LOG] Log writers flushed")
+    sync_service.db.close()
+    summarizer.cache.flush()
+    summarizer.sync_service.db.close()
 
 class ChatIn(BaseModel):
     user_id: str
@@ -66,6 +104,22 @@ class SummarizeIn(BaseModel):
     messages: Optional[List[Dict[str, Any]]] = None
     use_local_logs: bool = False
     send_to_node: bool = False
+    incremental: bool = True
+    force: bool = False
+
+class SummarizeJobIn(BaseModel):
+    session_id: Optional[str] = None
+    since: Optional[str] = None
+    use_local_logs: bool = False
+    callback: bool = False
+    incremental: bool = True
+    force: bool = False
+
+class LogLevelsIn(BaseModel):
+    level: Optional[str] = None
+    stages: Optional[Dict[str, Optional[str]]] = None
+    sample_rates: Optional[Dict[str, Optional[float]]] = None
+    reset: bool = False
 
 class SummarizeOut(BaseModel):
     success: bool
@@ -85,6 +139,11 @@ def health():
 
 @app.post("/chat", response_model=ChatOut)
 def chat(payload: ChatIn):
+    # Background summary jobs hold off while live chat requests are in flight
+    with summary_jobs.live_request():
+        return _chat(payload)
+
+def _chat(payload: ChatIn):
     start = time.time()
     try:
         if not payload.text.strip():
@@ -247,25 +306,42 @@ def feedback(payload: FeedbackIn):
 @app.get("/admin/logs")
 def admin_logs(
     limit: int = Query(200, ge=1, le=2000),
+    cursor: Optional[str] = None,
+    jid: Optional[str] = None,
+    dir: Optional[str] = None,
+    stage: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
 ):
-    folder = "data/storage/logs"
-    files = sorted(
-        [f for f in os.listdir(folder) if f.startswith("wa-") and f.endswith(".jsonl")],
-        reverse=True,
+    """Newest-first NDJSON stream of wa-* log records. The last line is
+    ``{"next_cursor": ..., "count": ...}``; pass next_cursor back to page
+    further into the past."""
+    records = iter_records_reverse(
+        prefix="wa",
+        cursor=cursor,
+        jid=jid,
+        dirs=dir.split(",") if dir else None,
+        stages=stage.split(",") if stage else None,
+        since=since,
+        until=until,
     )
-    if not files:
-        return {"ok": True, "items": []}
-
-    path = os.path.join(folder, files[0])
-    rows = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                rows.append(json.loads(line.strip()))
-            except Exception:
-                continue
-    rows = rows[-limit:]
-    return {"ok": True, "count": len(rows), "items": rows}
+
+    def stream():
+        count = 0
+        next_cursor = None
+        try:
+            for record, record_cursor in records:
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+                count += 1
+                if count >= limit:
+                    next_cursor = record_cursor
+                    break
+        except ValueError as e:
+            print(f"[ERROR] admin_logs: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+        yield json.dumps({"next_cursor": next_cursor, "count": count}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @app.post("/summarize", response_model=SummarizeOut)
 def summarize(payload: SummarizeIn):
@@ -275,21 +351,60 @@ def summarize(payload: SummarizeIn):
             messages=payload.messages,
             use_local_logs=payload.use_local_logs,
             send_to_node=payload.send_to_node,
-            auto_update=True
+            auto_update=True,
+            incremental=payload.incremental,
+            force=payload.force
         )
         return result
     except Exception as e:
         print(f"[ERROR] summarize: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/summarize/jobs")
+def create_summarize_job(payload: SummarizeJobIn):
+    if payload.since:
+        try:
+            job = summary_jobs.submit_batch(
+                payload.since,
+                callback=payload.callback,
+                incremental=payload.incremental,
+                force=payload.force
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="since must be an ISO timestamp or epoch")
+    elif payload.session_id:
+        job = summary_jobs.submit(
+            payload.session_id,
+            use_local_logs=payload.use_local_logs,
+            callback=payload.callback,
+            incremental=payload.incremental,
+            force=payload.force
+        )
+    else:
+        raise HTTPException(status_code=400, detail="session_id or since is required")
+    return {"ok": True, "job_id": job["job_id"], "status": job["status"], "progress": job["progress"]}
+
+@app.get("/summarize/jobs")
+def list_summarize_jobs(limit: int = Query(50, ge=1, le=200)):
+    return {"ok": True, "jobs": summary_jobs.list_jobs(limit)}
+
+@app.get("/summarize/jobs/{job_id}")
+def get_summarize_job(job_id: str, include_results: bool = True):
+    job = summary_jobs.get(job_id, include_results=include_results)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"ok": True, **job}
+
 @app.post("/sync/now")
 def sync_now():
     try:
-        result = sync_service.sync_all()
-        return result
+        result = sync_scheduler.run_once(trigger="manual")
     except Exception as e:
         print(f"[ERROR] sync_now: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    if result.get("skipped"):
+        raise HTTPException(status_code=409, detail=result["error"])
+    return result
 
 @app.get("/sync/status")
 def sync_status():
@@ -299,7 +414,9 @@ def sync_status():
             "last_sync": sync_service.db.get_last_sync_time(),
             "conversation_count": len(sync_service.db.get_all_phone_numbers()),
             "total_messages": sync_service.db.get_total_message_count(),
-            "phone_numbers": sync_service.db.get_all_phone_numbers()
+            "phone_numbers": sync_service.db.get_all_phone_numbers(),
+            "scheduler": sync_scheduler.status(),
+            "stream": gateway_stream.status() if GATEWAY_STREAM_ENABLED else None
         }
     except Exception as e:
         print(f"[ERROR] sync_status: {e}")
@@ -323,8 +440,108 @@ def admin_reset_memory(user_id: str, secret: str = Query(...)):
         print(f"[ERROR] admin_reset_memory: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/admin/log-stats")
+def admin_log_stats(secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    return {"ok": True, "writers": writer_stats()}
+
+@app.get("/admin/log-levels")
+def admin_log_levels(secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    return {"ok": True, **get_stage_policy().status()}
+
+@app.post("/admin/log-levels")
+def admin_set_log_levels(payload: LogLevelsIn, secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    try:
+        status = get_stage_policy().configure(
+            level=payload.level,
+            stages=payload.stages,
+            sample_rates=payload.sample_rates,
+            reset=payload.reset,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"[LOG] Stage log policy updated: level={status['level']}")
+    return {"ok": True, **status}
+
+@app.get("/admin/prompts/{digest}")
+def admin_prompt(digest: str, secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    text = get_prompt_store().get(digest)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Unknown prompt digest")
+    return {"ok": True, "digest": digest, "text": text}
+
+@app.post("/admin/prompts/reconstruct")
+def admin_prompt_reconstruct(record: Dict[str, Any], secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    return {"ok": True, "record": reconstruct_llm_record(record)}
+
+@app.get("/admin/logs/manifest")
+def admin_logs_manifest(secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    return {"ok": True, "manifest": log_lifecycle.manifest(), "last_run": log_lifecycle.last_result}
+
+@app.post("/admin/logs/compact")
+def admin_logs_compact(secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    return log_lifecycle.run()
+
+@app.get("/admin/summary-cache")
+def admin_summary_cache(secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    return {"ok": True, "stats": summarizer.cache.stats()}
+
+@app.post("/admin/summary-cache/evict")
+def admin_summary_cache_evict(secret: str = Query(...), session_id: Optional[str] = None):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    evicted = summarizer.cache.evict(session_id)
+    return {"ok": True, "evicted": evicted, "stats": summarizer.cache.stats()}
+
 @app.get("/admin/memory-stats")
-def admin_memory_stats(secret: str = Query(...)):
+def admin_memory_stats(
+    secret: str = Query(...),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    state: Optional[str] = None,
+):
     ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
     
     if secret != ADMIN_SECRET:
@@ -332,17 +549,39 @@ def admin_memory_stats(secret: str = Query(...)):
     
     try:
         stats = engine.memstore.stats()
-        all_users = list(engine.memstore._records.keys())
+        page = engine.memstore.list_users(cursor=cursor, limit=limit, state=state)
         return {
             "ok": True,
             "stats": stats,
-            "user_ids": all_users,
-            "total_users": len(all_users)
+            "user_ids": page["user_ids"],
+            "next_cursor": page["next_cursor"],
+            "total_users": stats["total_users"]
         }
     except Exception as e:
         print(f"[ERROR] admin_memory_stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/admin/memory-search")
+def admin_memory_search(
+    q: str,
+    secret: str = Query(...),
+    mode: str = Query("and", pattern="^(and|or)$"),
+    prefix: bool = False,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+
+    try:
+        result = engine.memstore.query(q, mode=mode, prefix=prefix, offset=offset, limit=limit)
+        return {"ok": True, "query": q, **result}
+    except Exception as e:
+        print(f"[ERROR] admin_memory_search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/admin/spam-status")
 def admin_spam_status(user_id: str, secret: str = Query(...)):
     ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
@@ -357,7 +596,7 @@ def admin_spam_status(user_id: str, secret: str = Query(...)):
         spam_history = engine.memstore.get_flag(user_id, "spam_history") or []
         spam_total = engine.memstore.get_flag(user_id, "spam_total") or 0
         spam_user = engine.memstore.get_flag(user_id, "spam_user") or False
-        blocked_until = engine.memstore.get_flag(user_id, "spam_blocked_until")
+        blocked_until = block_status.get("blocked_until")
         
         return {
             "ok": True,
@@ -386,6 +625,7 @@ def admin_clear_spam(user_id: str, secret: str = Query(...)):
         engine.memstore.clear_flag(user_id, "spam_history")
         engine.memstore.clear_flag(user_id, "spam_total")
         engine.memstore.clear_flag(user_id, "spam_user")
+        engine.memstore.clear_flag(user_id, "spam_blocked")
         engine.memstore.clear_flag(user_id, "spam_blocked_until")
         
         return {
@@ -397,6 +637,43 @@ def admin_clear_spam(user_id: str, secret: str = Query(...)):
         print(f"[ERROR] admin_clear_spam: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/admin/memory-snapshot")
+def admin_memory_snapshot(secret: str = Query(...)):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    try:
+        result = memory_snapshots.snapshot()
+        result["snapshots"] = [s["id"] for s in memory_snapshots.list_snapshots()]
+        return result
+    except Exception as e:
+        print(f"[ERROR] admin_memory_snapshot: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/memory-restore")
+def admin_memory_restore(
+    secret: str = Query(...),
+    at: Optional[str] = None,
+    user_id: Optional[str] = None,
+):
+    ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
+    
+    if secret != ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    try:
+        result = memory_snapshots.restore(at=at, user_id=user_id)
+        if not result["ok"]:
+            raise HTTPException(status_code=404, detail=result["error"])
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[ERROR] admin_memory_restore: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/admin/reset-conversations")
 def admin_reset_conversations(secret: str = Query(...)):
     ADMIN_SECRET = os.getenv("ADMIN_SECRET_KEY", "dev_reset_2024")
@@ -405,28 +682,18 @@ def admin_reset_conversations(secret: str = Query(...)):
         raise HTTPException(status_code=403, detail="Invalid secret key")
     
     try:
-        conversations_path = "data/storage/conversations.json"
         backup_dir = "data/storage/backups"
         
         os.makedirs(backup_dir, exist_ok=True)
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = os.path.join(backup_dir, f"conversations_{timestamp}.json")
-        
-        if os.path.exists(conversations_path):
-            with open(conversations_path, "r", encoding="utf-8") as src:
-                data = json.load(src)
-                conversation_count = len(data) if isinstance(data, list) else 0
-            
-            with open(backup_path, "w", encoding="utf-8") as dst:
-                json.dump(data, dst, ensure_ascii=False, indent=2)
-        else:
-            conversation_count = 0
+        ext = os.path.splitext(sync_service.db.db_path)[1] or ".json"
+        backup_path = os.path.join(backup_dir, f"conversations_{timestamp}{ext}")
         
-        with open(conversations_path, "w", encoding="utf-8") as f:
-            json.dump([], f)
+        sync_service.db.backup(backup_path)
+        conversation_count = sync_service.db.reset()
         
-        print(f"[ADMIN] Reset conversations.json: {conversation_count} conversations backed up to {backup_path}")
+        print(f"[ADMIN] Reset conversations: {conversation_count} conversations backed up to {backup_path}")
         
         return {
             "ok": True,
@@ -1,26 +1,50 @@
 import os
 import json
 import threading
-from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .log_reader import open_segment, segment_size
+from .log_writer import BatchedLogWriter
 
 class ChatLogger:
     def __init__(self):
         self._lock = threading.Lock()
         self.log_dir = os.path.join("data", "storage", "logs")
         os.makedirs(self.log_dir, exist_ok=True)
+        # date -> [idx bytes consumed, {user_id: [(offset, length), ...]}]
+        self._index_cache: Dict[str, List[Any]] = {}
+        self._index_lock = threading.Lock()
+        # Background writer keeps the day's file and its .idx sidecar open
+        self._writer = BatchedLogWriter("chat", self._get_log_path, index=True)
     
-    def _get_log_path(self) -> str:
-        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        return os.path.join(self.log_dir, f"chat-{today}.jsonl")
+    def _get_log_path(self, date: Optional[str] = None) -> str:
+        day = date or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        return os.path.join(self.log_dir, f"chat-{day}.jsonl")
+    
+    def _existing_log_path(self, date: str) -> Optional[str]:
+        """The day's log as it is on disk: plain, or gzipped by the lifecycle manager."""
+        path = self._get_log_path(date)
+        for candidate in (path, path + ".gz"):
+            if os.path.exists(candidate):
+                return candidate
+        return None
+    
+    @staticmethod
+    def _index_path(log_path: str) -> str:
+        if log_path.endswith(".gz"):
+            log_path = log_path[:-len(".gz")]
+        return log_path[:-len(".jsonl")] + ".idx"
     
     def _write_log(self, record: Dict[str, Any]) -> None:
-        path = self._get_log_path()
-        line = json.dumps(record, ensure_ascii=False)
-        
-        with self._lock:
-            with open(path, "a", encoding="utf-8") as f:
-                f.write(line + "\n")
+        # Sidecar index: one "user_id<TAB>offset<TAB>length" line per record
+        self._writer.write(record, key=str(record.get("user_id", "")))
+    
+    def flush(self) -> None:
+        self._writer.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        return self._writer.stats()
     
     def log_incoming(
         self,
@@ -55,6 +79,140 @@ class ChatLogger:
             "metadata": metadata or {}
         }
         self._write_log(record)
+    
+    # Index reading
+    def rebuild_index(self, date: str) -> int:
+        """Build the sidecar index for a log written before indexing existed.
+
+        The writer is paused meanwhile, so no record lands between reading the
+        log and swapping the .idx, and it reopens the new .idx afterwards.
+        """
+        count = 0
+        with self._lock, self._writer.paused():
+            path = self._existing_log_path(date)
+            if path is None:
+                return 0
+            tmp = self._index_path(path) + ".tmp"
+            with open_segment(path) as src, open(tmp, "w", encoding="utf-8") as out:
+                offset = 0
+                for line in src:
+                    try:
+                        user_id = str(json.loads(line).get("user_id", ""))
+                    except ValueError:
+                        user_id = ""
+                    out.write(f"{user_id}\t{offset}\t{len(line)}\n")
+                    offset += len(line)
+                    count += 1
+            os.replace(tmp, self._index_path(path))
+        with self._index_lock:
+            self._index_cache.pop(date, None)
+        return count
+    
+    @staticmethod
+    def _index_is_current(log_path: str, idx_path: str) -> bool:
+        """False when the .idx is missing or does not cover the whole log: the
+        writer opens a fresh .idx next to a log from before indexing, so its
+        first entry starts past 0 (or it has none) while the data goes on."""
+        try:
+            data_size = segment_size(log_path)
+            idx_size = os.path.getsize(idx_path)
+        except OSError:
+            return False
+        end = 0
+        if idx_size:
+            with open(idx_path, "rb") as f:
+                first = f.readline()
+                try:
+                    if int(first.decode("utf-8").rsplit("\t", 2)[1]) != 0:
+                        return False
+                except (UnicodeDecodeError, ValueError, IndexError):
+                    return False
+                f.seek(max(0, idx_size - 4096))
+                tail = f.read()
+            lines = tail[:tail.rfind(b"\n") + 1].splitlines()
+            if lines:
+                try:
+                    _, offset, length = lines[-1].decode("utf-8").rsplit("\t", 2)
+                    end = int(offset) + int(length)
+                except (UnicodeDecodeError, ValueError):
+                    return False
+        if log_path.endswith(".gz"):
+            # The gzip trailer only keeps the size mod 2**32
+            end %= 1 << 32
+        return end >= data_size
+
+    def _load_index(self, date: str) -> Dict[str, List[Tuple[int, int]]]:
+        if date == datetime.now(timezone.utc).strftime("%Y-%m-%d"):
+            # Make records still queued in the writer visible to this lookup
+            self._writer.flush()
+        log_path = self._existing_log_path(date)
+        if log_path is None:
+            return {}
+        idx_path = self._index_path(log_path)
+        if not self._index_is_current(log_path, idx_path):
+            self.rebuild_index(date)
+
+        with self._index_lock:
+            consumed, users = self._index_cache.get(date) or [0, {}]
+            size = os.path.getsize(idx_path)
+            if size < consumed:
+                consumed, users = 0, {}
+            if size > consumed:
+                # Only parse index lines appended since the last lookup
+                with open(idx_path, "rb") as f:
+                    f.seek(consumed)
+                    chunk = f.read(size - consumed)
+                complete = chunk.rfind(b"\n") + 1
+                for line in chunk[:complete].decode("utf-8").splitlines():
+                    user_id, offset, length = line.rsplit("\t", 2)
+                    users.setdefault(user_id, []).append((int(offset), int(length)))
+                consumed += complete
+            self._index_cache[date] = [consumed, users]
+            return users
+    
+    def iter_user_records(
+        self,
+        user_id: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield one user's records from ``start_date`` to ``end_date``
+        (inclusive, ``YYYY-MM-DD``, default today) by seeking to indexed offsets."""
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        day = datetime.strptime(start_date or today, "%Y-%m-%d").date()
+        last = datetime.strptime(end_date or start_date or today, "%Y-%m-%d").date()
+        while day <= last:
+            date = day.isoformat()
+            entries = list(self._load_index(date).get(user_id, []))
+            path = self._existing_log_path(date) if entries else None
+            if path and path.endswith(".gz"):
+                yield from self._scan_compressed(path, entries)
+            elif path:
+                with open(path, "rb") as f:
+                    for offset, length in entries:
+                        f.seek(offset)
+                        try:
+                            yield json.loads(f.read(length))
+                        except ValueError:
+                            continue
+            day += timedelta(days=1)
+    
+    @staticmethod
+    def _scan_compressed(path: str, entries: List[Tuple[int, int]]) -> Iterator[Dict[str, Any]]:
+        # gzip cannot seek cheaply, so stream once and pick the indexed offsets
+        wanted = {offset for offset, _ in entries}
+        last = max(wanted)
+        offset = 0
+        with open_segment(path) as f:
+            for line in f:
+                if offset in wanted:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        pass
+                if offset >= last:
+                    return
+                offset += len(line)
 
 _CHAT_LOGGER_SINGLETON: Optional[ChatLogger] = None
 
@@ -4,8 +4,10 @@ import os
 from typing import Dict, Any, Optional, Literal
 from datetime import datetime, timezone
 
+from .llm_logger import get_llm_logger
+from .prompt_store import PromptTemplate
+
 BASE = os.path.dirname(os.path.dirname(__file__))
-LLM_LOG_PATH = os.path.join(BASE, "convo", "llm_log", "llm_log.json")
 
 class DataCollector:
     
@@ -39,36 +41,27 @@ class DataCollector:
         prompt: str,
         response: Any,
         meta: Optional[Dict[str, Any]] = None,
+        prompt_template: Optional[PromptTemplate] = None,
+        prompt_vars: Optional[Dict[str, Any]] = None,
+        system_template: Optional[PromptTemplate] = None,
+        system_vars: Optional[Dict[str, Any]] = None,
     ) -> None:
         try:
-            os.makedirs(os.path.dirname(LLM_LOG_PATH), exist_ok=True)
-
-            record = {
-                "ts": datetime.now(timezone.utc).isoformat(),
-                "func": func,
-                "user_id": user_id,
-                "call_type": call_type,
-                "system": system,
-                "prompt": prompt,
-                "response": response,
-                "meta": meta or {},
-            }
-
-            existing: list[Any] = []
-            if os.path.exists(LLM_LOG_PATH):
-                try:
-                    with open(LLM_LOG_PATH, "r", encoding="utf-8") as f:
-                        existing = json.load(f)
-                        if not isinstance(existing, list):
-                            existing = []
-                except Exception:
-                    existing = []
-
-            existing.append(record)
-
-            with open(LLM_LOG_PATH, "w", encoding="utf-8") as f:
-                json.dump(existing, f, ensure_ascii=False, indent=2)
+            get_llm_logger().log(
+                func=func,
+                user_id=user_id,
+                call_type=call_type,
+                system=system,
+                prompt=prompt,
+                response=response,
+                meta=meta,
+                prompt_template=prompt_template,
+                prompt_vars=prompt_vars,
+                system_template=system_template,
+                system_vars=system_vars,
+            )
         except Exception:
+            # Audit logging must never break a chat turn
             pass
         
     def get_collection_state(self, user_id: str) -> Dict[str, Any]:
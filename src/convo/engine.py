@@ -1,5 +1,5 @@
 from __future__ import annotations
-import json, os, sys, random
+import json, os, sys, random, time
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta, timezone
 
@@ -8,21 +8,30 @@ if os.path.join(BASE, "src") not in sys.path:
     sys.path.insert(0, os.path.join(BASE, "src"))
 
 RAG_LOG_PATH = os.path.join(BASE, "src", "retriever", "rag_query_log.json")
-LLM_LOG_PATH = os.path.join(BASE, "data", "storage", "logs", "llm_log.json")
 
 from .memory_store import MemoryStore as MemoryStoreBackend
 from .session_logger import get_wa_logger
 from .chat_logger import get_chat_logger
+from .llm_logger import get_llm_logger
+from .prompt_store import PromptTemplate
+from .prompts import ASK_SYSTEM_PROMPT, INTENT_PROMPT, NATURALIZE_PROMPT
 from .ollama_client import OllamaClient
 from .data_collector import DataCollector
 from .text_normalizer import TextNormalizer
 
 def short_log(logger, jid: str, stage: str, info_or_msg: Any):
     try:
+        # Decide before building anything so disabled/sampled-out stages cost one dict lookup
+        policy = getattr(logger, "stage_policy", None)
+        rate = policy.admit(stage) if policy is not None else 1.0
+        if rate is None:
+            return
+        if callable(info_or_msg):
+            info_or_msg = info_or_msg()
         if isinstance(info_or_msg, dict):
-            logger.log_stage(jid=jid, stage=stage, info=info_or_msg, response="")
+            logger.log_stage(jid=jid, stage=stage, info=info_or_msg, response="", sample_rate=rate)
         else:
-            logger.log_stage(jid=jid, stage=stage, info={}, response=str(info_or_msg))
+            logger.log_stage(jid=jid, stage=stage, info={}, response=str(info_or_msg), sample_rate=rate)
     except Exception:
         pass
 
@@ -80,36 +89,27 @@ class ConversationEngine:
         prompt: str,
         response: Any,
         meta: Optional[Dict[str, Any]] = None,
+        prompt_template: Optional[PromptTemplate] = None,
+        prompt_vars: Optional[Dict[str, Any]] = None,
+        system_template: Optional[PromptTemplate] = None,
+        system_vars: Optional[Dict[str, Any]] = None,
     ) -> None:
         try:
-            os.makedirs(os.path.dirname(LLM_LOG_PATH), exist_ok=True)
-
-            record = {
-                "ts": datetime.now(timezone.utc).isoformat(),
-                "func": func,
-                "user_id": user_id,
-                "call_type": call_type,
-                "system": system,
-                "prompt": prompt,
-                "response": response,
-                "meta": meta or {},
-            }
-
-            existing: list[Any] = []
-            if os.path.exists(LLM_LOG_PATH):
-                try:
-                    with open(LLM_LOG_PATH, "r", encoding="utf-8") as f:
-                        existing = json.load(f)
-                        if not isinstance(existing, list):
-                            existing = []
-                except Exception:
-                    existing = []
-
-            existing.append(record)
-
-            with open(LLM_LOG_PATH, "w", encoding="utf-8") as f:
-                json.dump(existing, f, ensure_ascii=False, indent=2)
+            get_llm_logger().log(
+                func=func,
+                user_id=user_id,
+                call_type=call_type,
+                system=system,
+                prompt=prompt,
+                response=response,
+                meta=meta,
+                prompt_template=prompt_template,
+                prompt_vars=prompt_vars,
+                system_template=system_template,
+                system_vars=system_vars,
+            )
         except Exception:
+            # Audit logging must never break a chat turn
             pass
 
     def _user_context_header(self, user_id: str) -> str:
@@ -166,159 +166,15 @@ class ConversationEngine:
             "Jawab HANYA JSON VALID. DILARANG menambah field."
         )
 
-        prompt = f"""
-        {self._user_context_header(user_id)}
-
-        Riwayat percakapan hari ini:
-        {history_block}
-
-        Pesan pelanggan:
-        \"{message}\"
-
-        Active intent saat ini: {active_intent or "none"}
-
-        Daftar intent valid:
-        {", ".join(sop_intents)}
-        
-        PRODUK HONEYWELL:
-        - EAC (Electronic Air Cleaner) / Air Purifier / Pembersih Udara
-        - Water Heater / Pemanas Air
-        - Produk lainnya
-        
-        MAPPING KELUHAN KE INTENT:
-        
-        Intent "mati":
-        - Tidak menyala, tidak hidup, mati total, padam, off, tidak berfungsi
-        - Tidak panas (untuk water heater)
-        - Tidak ada respon sama sekali
-        - Mati, tidak nyala, gak nyala, ga menyala
-        - Tidak beroperasi, tidak jalan, gak jalan
-        - Tidak ada daya, tidak ada listrik
-        
-        Intent "bau":
-        - Bau tidak sedap, bau aneh, bau menyengat
-        - Aroma tidak enak, aroma aneh
-        - Berbau, bau busuk, bau apek
-        - Ada bau, muncul bau
-        
-        Intent "bunyi":
-        - Bunyi aneh, berisik, suara berisik
-        - Bunyi kretek-kretek, bunyi berdengung, bunyi brebet
-        - Noise, berisik, ribut
-        - Berbunyi, mengeluarkan bunyi, ada bunyi
-        - Suara aneh, suara mengganggu, suara berisik
-        - Berisik banget, noise terus
-
-        LOGIC PRIORITAS:
-        
-        1. Jika active_intent SUDAH ADA (bukan "none"):
-           a) Intent TETAP = active_intent (JANGAN ubah!)
-           b) DETEKSI keluhan TAMBAHAN (additional_complaint):
-              ⚠️ PENTING: Hanya deteksi jika pesan JELAS dan EKSPLISIT menyebut keluhan baru.
-              JANGAN deteksi jika substring kebetulan ada dalam kata lain.
-              
-              - Jika JELAS menyebut masalah bau → additional_complaint="bau"
-                Contoh: "juga bau", "bau menyengat", "ada bau aneh"
-              
-              - Jika JELAS menyebut masalah bunyi → additional_complaint="bunyi"
-                Contoh: "juga berisik", "mengeluarkan bunyi aneh", "suara berisik"
-              
-              - Jika JELAS menyebut masalah mati/tidak nyala/tidak panas → additional_complaint="mati"
-                Contoh: "EAC juga mati", "tidak menyala", "padam total"
-              
-              - Jika hanya chitchat/terima kasih/sapaan tanpa keluhan → additional_complaint="none"
-                Contoh: "terimakasih", "ok siap", "baik", "halo"
-           
-           c) is_new_complaint = false (SELALU, kecuali keluhan SAMA yang berulang dengan kata "lagi"/"kembali")
-        
-        2. Jika active_intent BELUM ADA (masih "none"):
-           a) Deteksi intent dari keluhan (mati / bau / bunyi / none)
-           b) additional_complaint = "none" (tidak relevan jika belum ada active)
-           c) is_new_complaint = true (jika ada keluhan perangkat), false (jika hanya greeting/chitchat)
-
-        Jika active_step tersedia:
-        {json.dumps(active_step_json, ensure_ascii=False, indent=2) if active_step_json else "(Tidak ada step aktif)"}
-
-        CONTOH KASUS - SAAT ACTIVE_INTENT ADA:
-        
-        Contoh 1:
-        active_intent = "mati"
-        message = "eh iya EAC nya juga bunyi aneh lho"
-        →  intent = "mati" (TETAP)
-        →  additional_complaint = "bunyi" (DETECTED - karena jelas mention bunyi EAC)
-        →  is_new_complaint = false
-        
-        Contoh 2:
-        active_intent = "bunyi"
-        message = "iya dan juga bau nya menyengat"
-        →  intent = "bunyi" (TETAP)
-        →  additional_complaint = "bau" (DETECTED - karena jelas mention bau)
-        →  is_new_complaint = false
-        
-        Contoh 3:
-        active_intent = "mati"
-        message = "tidak nyala"
-        →  intent = "mati" (TETAP)
-        →  additional_complaint = "none" (tidak mention keluhan lain)
-        →  is_new_complaint = false
-        
-        Contoh 4 (PENTING):
-        active_intent = "bau"
-        message = "terimakasih"
-        →  intent = "bau" (TETAP)
-        →  additional_complaint = "none" (hanya ucapan terima kasih, BUKAN keluhan)
-        →  is_new_complaint = false
-
-        Kembalikan hanya JSON:
-        {{
-        "has_greeting": true/false,
-        "greeting_part": "<string>",
-        "issue_part": "<string>",
-        "intent": "<mati/bau/bunyi/none>",
-        "category": "domain/chitchat/nonsense",
-        "is_new_complaint": true/false,
-        "additional_complaint": "<mati/bau/bunyi/none>"
-        }}
-        
-        CONTOH DETEKSI INTENT (FIRST MESSAGE):
-        
-        Contoh Intent "mati":
-        - "EAC saya mati nih" → intent="mati"
-        - "alat tidak menyala" → intent="mati"
-        - "unit padam total" → intent="mati"
-        - "tidak hidup sama sekali" → intent="mati"
-        - "mati total kak" → intent="mati"
-        - "tidak berfungsi" → intent="mati"
-        - "tidak ada respon" → intent="mati"
-        - "water heater tidak panas" → intent="mati"
-        - "pemanas air mati" → intent="mati"
-        
-        Contoh Intent "bunyi":
-        - "alat saya berbunyi aneh" → intent="bunyi"
-        - "EAC bunyi kretek kretek" → intent="bunyi"
-        - "suara berisik" → intent="bunyi"
-        - "bunyi brebet" → intent="bunyi"
-        - "mengeluarkan bunyi" → intent="bunyi"
-        - "ada bunyi aneh" → intent="bunyi"
-        - "berisik banget" → intent="bunyi"
-        - "noise terus" → intent="bunyi"
-        - "berbunyi terus" → intent="bunyi"
-        - "suara mengganggu" → intent="bunyi"
-        
-        Contoh Intent "bau":
-        - "bau tidak sedap" → intent="bau"
-        - "ada bau aneh" → intent="bau"
-        - "bau menyengat" → intent="bau"
-        - "aroma tidak enak" → intent="bau"
-        - "berbau" → intent="bau"
-        
-        Contoh Intent "none" (chitchat/greeting):
-        - "halo" → intent="none"
-        - "terima kasih" → intent="none"
-        - "baik" → intent="none"
-        - "oke siap" → intent="none"
-        - "gimana caranya?" → intent="none" (pertanyaan umum tanpa keluhan)
-        """
+        prompt_vars = {
+            "user_context": self._user_context_header(user_id),
+            "history_block": history_block,
+            "message": message,
+            "active_intent": active_intent or "none",
+            "intents": ", ".join(sop_intents),
+            "active_step": json.dumps(active_step_json, ensure_ascii=False, indent=2) if active_step_json else "(Tidak ada step aktif)",
+        }
+        prompt = INTENT_PROMPT.render(**prompt_vars)
 
         out = self.ollama.generate_json(system=system_msg, prompt=prompt) or {}
 
@@ -328,6 +184,8 @@ class ConversationEngine:
             call_type="generate_json",
             system=system_msg,
             prompt=prompt,
+            prompt_template=INTENT_PROMPT,
+            prompt_vars=prompt_vars,
             response=out,
             meta={
                 "active_intent": active_intent,
@@ -358,7 +216,7 @@ class ConversationEngine:
             
             if any(word in msg_lower for word in intensity_words):
                 intensity_detected = True
-                short_log(self.logger, user_id, "intensity_detected", f"Bunyi dengan intensity: {message[:50]}")
+                short_log(self.logger, user_id, "intensity_detected", lambda: f"Bunyi dengan intensity: {message[:50]}")
         
         out["intensity_detected"] = intensity_detected
 
@@ -666,7 +524,7 @@ class ConversationEngine:
         else:
             ask_prompt = "Tanyakan nomor/serial produk. Jelaskan singkat bahwa jika belum pegang tidak apa-apa."
 
-        system_msg_ask = f"Asisten CS pengumpul data. {persona}"
+        system_msg_ask = ASK_SYSTEM_PROMPT.render(persona=persona)
         reply = self.ollama.generate(
             system=system_msg_ask,
             prompt=ask_prompt,
@@ -680,6 +538,8 @@ class ConversationEngine:
             prompt=ask_prompt,
             response=reply,
             meta={"missing_field": missing_field},
+            system_template=ASK_SYSTEM_PROMPT,
+            system_vars={"persona": persona},
         )
 
         if "anda" in reply.lower():
@@ -1612,18 +1472,18 @@ class ConversationEngine:
         
         if structure["is_structurally_complete"]:
             short_log(self.logger, user_id, "smart_wait_complete", 
-                     f"Structurally complete (score: {structure['completeness_ratio']:.2f}): '{message[:50]}'")
+                     lambda: f"Structurally complete (score: {structure['completeness_ratio']:.2f}): '{message[:50]}'")
             return False
         
         if not structure["has_verb"] and not structure["has_subject"]:
             short_log(self.logger, user_id, "smart_wait_incomplete_no_verb_subject", 
-                     f"No verb + no subject: '{message[:50]}'")
+                     lambda: f"No verb + no subject: '{message[:50]}'")
             return True
         
         if structure["has_subject"] and not structure["has_verb"]:
             if structure["word_count"] <= 3:
                 short_log(self.logger, user_id, "smart_wait_incomplete_fragment", 
-                         f"Subject only, no verb: '{message[:50]}'")
+                         lambda: f"Subject only, no verb: '{message[:50]}'")
                 return True
         
         greeting_only = ['halo', 'hai', 'hi', 'pagi', 'siang', 'sore', 'malam', 'selamat']
@@ -1631,12 +1491,12 @@ class ConversationEngine:
             complaint_keywords = ['mati', 'bunyi', 'bau', 'rusak', 'error', 'masalah', 'kendala', 'eac', 'water heater']
             if not any(kw in msg_lower for kw in complaint_keywords):
                 short_log(self.logger, user_id, "smart_wait_greeting_only", 
-                         f"Greeting without complaint: '{message[:50]}'")
+                         lambda: f"Greeting without complaint: '{message[:50]}'")
                 return True
         
         if structure["completeness_ratio"] < 0.4 and structure["word_count"] <= 4:
             short_log(self.logger, user_id, "smart_wait_low_score", 
-                     f"Low completeness ({structure['completeness_ratio']:.2f}): '{message[:50]}'")
+                     lambda: f"Low completeness ({structure['completeness_ratio']:.2f}): '{message[:50]}'")
             return True
         
         vague_phrases = [
@@ -1665,26 +1525,33 @@ class ConversationEngine:
         
         if has_vague and not has_complaint:
             short_log(self.logger, user_id, "smart_wait_vague_no_complaint", 
-                     f"Vague phrase without specific complaint: '{message[:50]}'")
+                     lambda: f"Vague phrase without specific complaint: '{message[:50]}'")
             return True
         
         if len(words) <= 2 and not has_complaint:
             short_log(self.logger, user_id, "smart_wait_too_short", 
-                     f"Too short without complaint: '{message[:50]}'")
+                     lambda: f"Too short without complaint: '{message[:50]}'")
             return True
         
         short_log(self.logger, user_id, "smart_wait_complete_fallback", 
-                 f"Passed all checks (score: {structure['completeness_ratio']:.2f}): '{message[:50]}'")
+                 lambda: f"Passed all checks (score: {structure['completeness_ratio']:.2f}): '{message[:50]}'")
         return False
     
     def _should_wait_for_more_input(self, user_id: str, is_incomplete: bool) -> dict:
-        now = datetime.now(timezone.utc)
+        now = time.time()
         last_incomplete_ts = self.memstore.get_flag(user_id, "last_incomplete_ts")
         
         WAIT_WINDOW_SECONDS = 3
-        
+
+        if isinstance(last_incomplete_ts, str):
+            # Legacy flag stored as an ISO string before TTL flags
+            try:
+                last_incomplete_ts = datetime.fromisoformat(last_incomplete_ts.replace('Z', '+00:00')).timestamp()
+            except ValueError:
+                last_incomplete_ts = None
+
         if is_incomplete:
-            self.memstore.set_flag(user_id, "last_incomplete_ts", now.isoformat())
+            self.memstore.set_flag(user_id, "last_incomplete_ts", now, ttl=WAIT_WINDOW_SECONDS)
             self.memstore.set_flag(user_id, "incomplete_count", 
                                   (self.memstore.get_flag(user_id, "incomplete_count") or 0) + 1)
             
@@ -1695,8 +1562,7 @@ class ConversationEngine:
             }
         
         if last_incomplete_ts:
-            last_ts = datetime.fromisoformat(last_incomplete_ts.replace('Z', '+00:00'))
-            elapsed = (now - last_ts).total_seconds()
+            elapsed = now - last_incomplete_ts
             
             if elapsed <= WAIT_WINDOW_SECONDS:
                 self.memstore.clear_flag(user_id, "last_incomplete_ts")
@@ -1716,13 +1582,15 @@ class ConversationEngine:
             "reason": "normal_flow"
         }
     
+    MESSAGE_BUFFER_TTL = 300
+
     def _init_message_buffer(self, user_id: str) -> None:
         buffer = {
             "messages": [],
-            "start_ts": datetime.now(timezone.utc).isoformat(),
+            "start_ts": time.time(),
             "count": 0
         }
-        self.memstore.set_flag(user_id, "message_buffer", buffer)
+        self.memstore.set_flag(user_id, "message_buffer", buffer, ttl=self.MESSAGE_BUFFER_TTL)
     
     def _add_to_buffer(self, user_id: str, message: str) -> dict:
         buffer = self.memstore.get_flag(user_id, "message_buffer")
@@ -1733,11 +1601,11 @@ class ConversationEngine:
         
         buffer["messages"].append({
             "text": message,
-            "ts": datetime.now(timezone.utc).isoformat()
+            "ts": time.time()
         })
         buffer["count"] = len(buffer["messages"])
         
-        self.memstore.set_flag(user_id, "message_buffer", buffer)
+        self.memstore.set_flag(user_id, "message_buffer", buffer, ttl=self.MESSAGE_BUFFER_TTL)
         return buffer
     
     def _get_buffer_age(self, user_id: str) -> float:
@@ -1745,9 +1613,10 @@ class ConversationEngine:
         if not buffer or "start_ts" not in buffer:
             return 0.0
         
-        start_ts = datetime.fromisoformat(buffer["start_ts"].replace('Z', '+00:00'))
-        now = datetime.now(timezone.utc)
-        return (now - start_ts).total_seconds()
+        start_ts = buffer["start_ts"]
+        if isinstance(start_ts, str):
+            start_ts = datetime.fromisoformat(start_ts.replace('Z', '+00:00')).timestamp()
+        return time.time() - start_ts
     
     def _should_flush_buffer(self, user_id: str, current_message: str, is_incomplete: bool) -> dict:
         CONTEXT_WINDOW_SECONDS = 5
@@ -1838,16 +1707,18 @@ class ConversationEngine:
             "is_profanity": is_profanity
         }
     
+    SPAM_WINDOW_SECONDS = 300
+    SPAM_BLOCK_SECONDS = 3600
+
     def _track_spam_event(self, user_id: str) -> None:
-        now = datetime.now(timezone.utc)
+        now = time.time()
         spam_history = self.memstore.get_flag(user_id, "spam_history") or []
         
-        spam_history.append(now.isoformat())
-        
-        cutoff_5min = (now - timedelta(minutes=5)).isoformat()
-        spam_history = [ts for ts in spam_history if ts > cutoff_5min]
+        cutoff = now - self.SPAM_WINDOW_SECONDS
+        spam_history = [ts for ts in spam_history if isinstance(ts, (int, float)) and ts > cutoff]
+        spam_history.append(now)
         
-        self.memstore.set_flag(user_id, "spam_history", spam_history)
+        self.memstore.set_flag(user_id, "spam_history", spam_history, ttl=self.SPAM_WINDOW_SECONDS)
         
         total_spam = self.memstore.get_flag(user_id, "spam_total") or 0
         self.memstore.set_flag(user_id, "spam_total", total_spam + 1)
@@ -1856,7 +1727,8 @@ class ConversationEngine:
         spam_history = self.memstore.get_flag(user_id, "spam_history") or []
         spam_total = self.memstore.get_flag(user_id, "spam_total") or 0
         
-        recent_count = len(spam_history)
+        cutoff = time.time() - self.SPAM_WINDOW_SECONDS
+        recent_count = sum(1 for ts in spam_history if isinstance(ts, (int, float)) and ts > cutoff)
         
         if spam_total >= 10:
             return {"level": "hard", "count": spam_total, "recent": recent_count}
@@ -1868,23 +1740,16 @@ class ConversationEngine:
             return {"level": "none", "count": spam_total, "recent": recent_count}
     
     def _is_spam_blocked(self, user_id: str) -> dict:
-        blocked_until = self.memstore.get_flag(user_id, "spam_blocked_until")
-        if not blocked_until:
+        remaining_seconds = self.memstore.flag_ttl(user_id, "spam_blocked")
+        if remaining_seconds is None:
             return {"blocked": False}
         
-        now = datetime.now(timezone.utc)
-        blocked_time = datetime.fromisoformat(blocked_until.replace('Z', '+00:00'))
-        
-        if now < blocked_time:
-            remaining = int((blocked_time - now).total_seconds() / 60)
-            return {
-                "blocked": True, 
-                "remaining_minutes": remaining,
-                "blocked_until": blocked_until
-            }
-        else:
-            self.memstore.clear_flag(user_id, "spam_blocked_until")
-            return {"blocked": False}
+        blocked_until = datetime.fromtimestamp(time.time() + remaining_seconds, timezone.utc).isoformat()
+        return {
+            "blocked": True, 
+            "remaining_minutes": int(remaining_seconds / 60),
+            "blocked_until": blocked_until
+        }
 
     def _parse_user_answer(self, message: str, expected_result: list) -> str:
         """Parse user answer dengan Python rule-based (TIDAK pakai LLM)"""
@@ -2143,7 +2008,7 @@ class ConversationEngine:
             user_answer = self._parse_user_answer(message, ["yes", "no"])
             
             if user_answer != "unclear":
-                short_log(self.logger, user_id, "tier1_confirm", f"Answer: {user_answer}")
+                short_log(self.logger, user_id, "tier1_confirm", lambda: f"Answer: {user_answer}")
                 
                 branch = confirm_data.get("branch", {})
                 
@@ -2180,7 +2045,7 @@ class ConversationEngine:
                 inferred = self._infer_from_ambiguous(message, ["yes", "no"])
                 if inferred["confidence"] in ["high", "medium"]:
                     short_log(self.logger, user_id, "tier2_infer_confirm", 
-                             f"Inferred: {inferred['answer']} ({inferred['confidence']})")
+                             lambda: f"Inferred: {inferred['answer']} ({inferred['confidence']})")
                     
                     user_answer = inferred["answer"]
                     branch = confirm_data.get("branch", {})
@@ -2211,7 +2076,7 @@ class ConversationEngine:
             
             # Rule-based clear answer
             if user_answer != "unclear":
-                short_log(self.logger, user_id, "tier1_parsed", f"Answer: {user_answer}")
+                short_log(self.logger, user_id, "tier1_parsed", lambda: f"Answer: {user_answer}")
                 
                 logic_key = f"on_answer_{user_answer}"
                 logic = step_def.get("logic", {}).get(logic_key, {})
@@ -2232,7 +2097,7 @@ class ConversationEngine:
             
             if inferred["confidence"] in ["high", "medium"]:
                 short_log(self.logger, user_id, "tier2_infer", 
-                         f"Inferred: {inferred['answer']} (confidence: {inferred['confidence']}, method: {inferred['method']})")
+                         lambda: f"Inferred: {inferred['answer']} (confidence: {inferred['confidence']}, method: {inferred['method']})")
                 
                 user_answer = inferred["answer"]
                 logic_key = f"on_answer_{user_answer}"
@@ -2272,7 +2137,7 @@ class ConversationEngine:
             
             # Default: ESCALATE to pending (safer than clarify)
             short_log(self.logger, user_id, "tier3_auto_pending", 
-                     f"Unclear after inference, escalate (clarify_count={clarify_count})")
+                     lambda: f"Unclear after inference, escalate (clarify_count={clarify_count})")
             
             return {
                 "action": "pending",
@@ -2363,7 +2228,7 @@ class ConversationEngine:
                 simple_transform = re.sub(r'\bmohon\b', 'tolong', simple_transform, flags=re.IGNORECASE)
                 simple_transform = re.sub(r'^Apakah\s+', 'Kak, ', simple_transform)
                 simple_transform = re.sub(r'\bKak\b', customer_greeting, simple_transform)
-                short_log(self.logger, user_id, "skip_naturalize", f"Template sudah sederhana: {template_text[:50]}")
+                short_log(self.logger, user_id, "skip_naturalize", lambda: f"Template sudah sederhana: {template_text[:50]}")
                 return simple_transform
         
         history = self.memstore.get_history(user_id)
@@ -2375,78 +2240,12 @@ class ConversationEngine:
         
         system_msg = "Kamu adalah CS Honeywell yang ramah, sopan, dan profesional. Gunakan bahasa Indonesia yang baik dan benar."
         
-        prompt = f"""Tugas: Ubah template SOP menjadi lebih natural dan conversational TANPA mengubah makna atau informasi yang ada.
-
-        Pesan terakhir customer: "{last_user_msg}"
-
-        Template SOP: "{template_text}"
-
-        Aturan WAJIB:
-        1. PERTAHANKAN semua informasi dari template - jangan tambah, kurang, atau ubah
-        2. PERTAHANKAN struktur pertanyaan, instruksi, dan kondisi if-then
-        3. Tetap profesional dan sopan sebagai customer service
-        4. Gunakan bahasa Indonesia yang baik dan benar - JANGAN gunakan bahasa asing
-        5. DILARANG gunakan bahasa gaul: "dong", "aja", "gitu", "sih", "gimana", "ngga", "nggak", "gak", "ga"
-        6. DILARANG gunakan kata serapan salah: "teknisian" (gunakan "teknisi")
-        7. Gunakan "{customer_greeting}" untuk sapaan (ganti semua "kak" dengan ini)
-        8. Tidak gunakan kata "Anda"
-        9. Hindari tanda kutip
-        10. Jangan bertele-tele tapi jangan hilangkan informasi penting
-        11. JANGAN mengarang atau mengubah konteks - ikuti template dengan ketat
-        12. Gunakan kata pengantar natural seperti "sepertinya", "mungkin" untuk membuat lebih conversational
-        13. Hindari pembuka kalimat yang terlalu formal atau kaku
-        14. HINDARI kata formal: "silakan", "harap", "mohon", "jika" (di awal kalimat), "apabila", "bisa dicek"
-        15. GUNAKAN alternatif natural: "coba", "boleh", "kalau", "bisa dicoba", "bisa bantu"
-        16. JANGAN ubah pertanyaan menjadi pernyataan
-        17. JANGAN hilangkan instruksi atau follow-up action
-
-        PENTING untuk pertanyaan:
-        - Pertanyaan harus tetap jelas dan spesifik
-        - Jangan ubah "apakah X atau Y?" menjadi pernyataan
-        - Contoh SALAH: "Kak, sepertinya alatnya berisik sering banget. Coba periksa kalau bisa?" ❌
-        - Contoh BENAR: "Kak, bunyinya sering terjadi atau hanya sesekali saja?" ✅
-
-        PENTING untuk instruksi:
-        - Pertahankan urutan: kondisi → aksi → expected result → follow up
-        - Jangan potong instruksi multi-step
-        - Jangan hilangkan kondisi "jika/kalau"
-
-        Transformasi kata formal ke natural:
-        - "silakan" → "coba" atau "bisa"
-        - "jika" (awal kalimat) → "kalau"
-        - "jika" (tengah kalimat) → tetap "jika" atau "kalau"
-        - "bisa dicek" → "boleh dicek" atau "coba cek"
-        - "apabila" → "kalau"
-        - "Mohon" → "Tolong" atau "Boleh"
-        - "nggak/gak/ga" → "belum" atau "tidak"
-
-        Contoh konversi yang BENAR:
-        Template: "Baik kak, saya teruskan ke teknisi ya."
-        Natural: "Baik kak, saya bantu teruskan ke teknisi ya."
-
-        Template: "Kak, bisa dicek posisi MCB-nya apakah sedang di posisi ON?"
-        Natural: "Kak, boleh dicek apakah MCB-nya sudah dalam posisi ON?"
-        
-        Template: "Kak, bunyinya sering atau jarang?"
-        Natural: "Kak, bunyinya sering terjadi atau hanya sesekali saja?"
-        
-        Template: "Silakan tekan tombol Low Mode di remote. Jika lampu kuning menyala, unit sudah normal."
-        Natural: "Coba tekan tombol Low Mode di remote ya kak. Kalau lampu kuning menyala, berarti unit sudah normal."
-        
-        Template: "Silakan hubungi kami lagi jika masih ada kendala."
-        Natural: "Kalau masih ada kendala, chat kami lagi ya kak."
-
-        Contoh konversi yang SALAH (jangan seperti ini):
-        Template: "Kak, bunyinya sering atau jarang?"
-        SALAH: "Kak, sepertinya alatnya berisik. Coba periksa?" ❌ (mengubah pertanyaan jadi pernyataan)
-        
-        Template: "Baik kak, saya teruskan ke teknisi ya."
-        SALAH: "Teruskan dong ke teknisi ya..." ❌ (bahasa gaul)
-        
-        Template: "Jika belum menyala, coba tekan tombol LOW."
-        SALAH: "Coba tekan tombol LOW." ❌ (hilangkan kondisi "jika belum menyala")
-
-        Ubah template di atas menjadi lebih natural dalam BAHASA INDONESIA:"""
+        prompt_vars = {
+            "last_user_msg": last_user_msg,
+            "template_text": template_text,
+            "customer_greeting": customer_greeting,
+        }
+        prompt = NATURALIZE_PROMPT.render(**prompt_vars)
         
         reply = self.ollama.generate(system=system_msg, prompt=prompt).strip()
         
@@ -2471,6 +2270,8 @@ class ConversationEngine:
             call_type="generate",
             system=system_msg,
             prompt=prompt,
+            prompt_template=NATURALIZE_PROMPT,
+            prompt_vars=prompt_vars,
             response=reply,
             meta={"template_text": template_text, "action_type": action_type}
         )
@@ -2559,7 +2360,7 @@ class ConversationEngine:
             clarify_count += 1
             self.memstore.set_flag(user_id, f"{intent}_clarify_count", clarify_count)
             
-            short_log(self.logger, user_id, "clarify_count", f"Intent: {intent}, Count: {clarify_count}/2")
+            short_log(self.logger, user_id, "clarify_count", lambda: f"Intent: {intent}, Count: {clarify_count}/2")
             
             if clarify_count >= 2:
                 self.memstore.set_flag(user_id, f"{intent}_clarify_count", 0)
@@ -2767,7 +2568,7 @@ class ConversationEngine:
             is_new_complaint = False
         
         short_log(self.logger, user_id, "lock_intent_check", 
-                 f"additional={additional_complaint}, curr_active={current_active_intent}, match={current_active_intent != additional_complaint}")
+                 lambda: f"additional={additional_complaint}, curr_active={current_active_intent}, match={current_active_intent != additional_complaint}")
         
         if additional_complaint and additional_complaint != "none" and current_active_intent and current_active_intent != additional_complaint:
             short_log(self.logger, user_id, "lock_intent_triggered", 
@@ -3050,7 +2851,7 @@ class ConversationEngine:
             clarify_count += 1
             self.memstore.set_flag(user_id, f"{intent}_clarify_count", clarify_count)
             
-            short_log(self.logger, user_id, "clarify_count_exploration", f"Intent: {intent}, Count: {clarify_count}/2")
+            short_log(self.logger, user_id, "clarify_count_exploration", lambda: f"Intent: {intent}, Count: {clarify_count}/2")
             
             if clarify_count >= 2:
                 self.memstore.set_flag(user_id, f"{intent}_clarify_count", 0)
@@ -3307,7 +3108,7 @@ class ConversationEngine:
             spam_level = self._get_spam_level(user_id)
             
             short_log(self.logger, user_id, "spam_level", 
-                     f"Level: {spam_level['level']}, Recent: {spam_level['recent']}, Total: {spam_level['count']}")
+                     lambda: f"Level: {spam_level['level']}, Recent: {spam_level['recent']}, Total: {spam_level['count']}")
             
             if spam_level["level"] == "hard":
                 self.memstore.set_flag(user_id, "spam_user", True)
@@ -3321,9 +3122,7 @@ class ConversationEngine:
                 }, {"context": "spam_hard_limit"})
             
             elif spam_level["level"] == "medium":
-                now = datetime.now(timezone.utc)
-                block_until = (now + timedelta(hours=1)).isoformat()
-                self.memstore.set_flag(user_id, "spam_blocked_until", block_until)
+                self.memstore.set_flag(user_id, "spam_blocked", True, ttl=self.SPAM_BLOCK_SECONDS)
                 
                 short_log(self.logger, user_id, "spam_medium_limit", "User blocked for 1 hour")
                 return self._log_and_return(user_id, {
@@ -3389,7 +3188,7 @@ class ConversationEngine:
         
         if should_skip_llm:
             short_log(self.logger, user_id, "skip_llm_incomplete", 
-                     f"Skip LLM for obviously incomplete: '{msg[:50]}'")
+                     lambda: f"Skip LLM for obviously incomplete: '{msg[:50]}'")
             
             self._add_to_buffer(user_id, msg)
             buffer_info = self.memstore.get_flag(user_id, "message_buffer")
@@ -3427,7 +3226,7 @@ class ConversationEngine:
             
             if not flush_decision["should_flush"]:
                 short_log(self.logger, user_id, "buffer_accumulating", 
-                         f"Buffering message {flush_decision.get('count', 0)}/{flush_decision.get('age', 0):.1f}s - {flush_decision['reason']}")
+                         lambda: f"Buffering message {flush_decision.get('count', 0)}/{flush_decision.get('age', 0):.1f}s - {flush_decision['reason']}")
                 
                 wait_responses = [
                     "...",
@@ -3448,13 +3247,13 @@ class ConversationEngine:
                 })
             
             short_log(self.logger, user_id, "buffer_flush", 
-                     f"Flushing buffer - {flush_decision['reason']}, age: {flush_decision.get('age', 0):.1f}s")
+                     lambda: f"Flushing buffer - {flush_decision['reason']}, age: {flush_decision.get('age', 0):.1f}s")
             
             combined_message = self._combine_buffered_messages(user_id)
             self._clear_message_buffer(user_id)
             
             if combined_message and combined_message != msg:
-                short_log(self.logger, user_id, "combined_context", f"Original: '{msg[:50]}' | Combined: '{combined_message[:100]}'")
+                short_log(self.logger, user_id, "combined_context", lambda: f"Original: '{msg[:50]}' | Combined: '{combined_message[:100]}'")
                 
                 msg_for_processing = combined_message
                 
@@ -3472,7 +3271,7 @@ class ConversationEngine:
                          f"Intent: {sop_intent}, Category: {category}, Combined from {flush_decision.get('age', 0):.1f}s window")
         else:
             short_log(self.logger, user_id, "skip_buffering", 
-                     f"Active flow detected - active_intent:{active_intent}, pending:{sop_pending_for_check}")
+                     lambda: f"Active flow detected - active_intent:{active_intent}, pending:{sop_pending_for_check}")
             self._clear_message_buffer(user_id)
         
         rapid_switch_detected = False
@@ -3727,7 +3526,7 @@ class ConversationEngine:
             session_type = session_detection.get("type", "follow_up")
             
             short_log(self.logger, user_id, "session_detection", 
-                     f"Type: {session_type}, Reason: {session_detection.get('reason', '')}")
+                     lambda: f"Type: {session_type}, Reason: {session_detection.get('reason', '')}")
             
             if session_type == "new_session":
                 short_log(self.logger, user_id, "conversation_reset", 
@@ -0,0 +1,149 @@
+import os
+import gzip
+import json
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from .log_writer import BatchedLogWriter
+from .prompt_store import PromptTemplate
+
+LLM_LOG_DIR = os.path.join("data", "storage", "logs")
+
+def legacy_llm_log_paths(log_dir: str = LLM_LOG_DIR) -> List[str]:
+    """Array-format files written by the old per-module _log_llm_call.
+
+    One sat in the log directory; the other next to this module, which only
+    belongs to the default log directory of this checkout.
+    """
+    paths = [os.path.join(log_dir, "llm_log.json")]
+    if os.path.abspath(log_dir) == os.path.abspath(LLM_LOG_DIR):
+        paths.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_log", "llm_log.json"))
+    return paths
+
+LEGACY_LLM_LOG_PATHS = legacy_llm_log_paths()
+
+class LLMAuditLogger:
+    """Append-only JSONL audit log of LLM calls.
+
+    ``log()`` only enqueues; a BatchedLogWriter appends queued records to
+    ``llm-YYYY-MM-DD.jsonl`` and rotates to ``-archived-`` files past
+    ``max_bytes``, matching SessionLogger's naming. When the queue is full the
+    record is dropped and counted rather than blocking a chat turn.
+
+    Only PromptTemplate texts go to the PromptStore: a prompt or system
+    message built from one is logged as ``prompt_ref`` + ``prompt_vars`` /
+    ``system_ref`` + ``system_vars`` (see ``prompt_store.reconstruct``);
+    any other text is logged inline.
+    """
+
+    def __init__(self, log_dir: str = LLM_LOG_DIR, max_bytes: Optional[int] = None, queue_size: Optional[int] = None):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes or int(os.getenv("LLM_LOG_MAX_BYTES", str(20_000_000)))
+        self._writer = BatchedLogWriter("llm", self._path, max_bytes=self.max_bytes, queue_size=queue_size)
+
+    def _path(self) -> str:
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        return os.path.join(self.log_dir, f"llm-{day}.jsonl")
+
+    def log(
+        self,
+        *,
+        func: str,
+        user_id: str,
+        call_type: str,
+        system: str,
+        prompt: str,
+        response: Any,
+        meta: Optional[Dict[str, Any]] = None,
+        prompt_template: Optional[PromptTemplate] = None,
+        prompt_vars: Optional[Dict[str, Any]] = None,
+        system_template: Optional[PromptTemplate] = None,
+        system_vars: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        record = {
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "func": func,
+            "user_id": user_id,
+            "call_type": call_type,
+        }
+        if system_template is not None:
+            record["system_ref"] = system_template.digest
+            if system_vars:
+                record["system_vars"] = system_vars
+        else:
+            record["system"] = system
+        if prompt_template is not None:
+            record["prompt_ref"] = prompt_template.digest
+            record["prompt_vars"] = prompt_vars or {}
+        else:
+            record["prompt"] = prompt
+        record["response"] = response
+        record["meta"] = meta or {}
+        self._writer.write(record)
+
+    def flush(self) -> None:
+        self._writer.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._writer.stats()
+
+def iter_llm_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield records from a JSONL segment (plain or ``.gz``) or a legacy JSON-array file."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        f.seek(0)
+        if head == "[":
+            try:
+                records = json.load(f)
+            except ValueError as e:
+                print(f"[LLM LOG] Unreadable legacy log {path}: {e}")
+                return
+            for record in records if isinstance(records, list) else []:
+                if isinstance(record, dict):
+                    yield record
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+def migrate_legacy(path: str, log_dir: str = LLM_LOG_DIR) -> int:
+    """Convert a legacy array log into ``llm-legacy-<name>.jsonl`` and rename
+    the original to ``.migrated``. Returns the number of records moved."""
+    if not os.path.exists(path):
+        return 0
+    os.makedirs(log_dir, exist_ok=True)
+    tag = os.path.basename(os.path.dirname(os.path.abspath(path))).replace("_", "-")
+    dest = os.path.join(log_dir, f"llm-legacy-{tag}.jsonl")
+    count = 0
+    with open(dest, "a", encoding="utf-8") as out:
+        for record in iter_llm_records(path):
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            count += 1
+    os.replace(path, f"{path}.migrated")
+    return count
+
+_LLM_LOGGER_SINGLETON: Optional[LLMAuditLogger] = None
+_SINGLETON_LOCK = threading.Lock()
+
+def get_llm_logger() -> LLMAuditLogger:
+    global _LLM_LOGGER_SINGLETON
+    if _LLM_LOGGER_SINGLETON is None:
+        with _SINGLETON_LOCK:
+            if _LLM_LOGGER_SINGLETON is None:
+                _LLM_LOGGER_SINGLETON = LLMAuditLogger()
+    return _LLM_LOGGER_SINGLETON
+
+if __name__ == "__main__":
+    for legacy in LEGACY_LLM_LOG_PATHS:
+        moved = migrate_legacy(legacy)
+        if moved:
+            print(f"[LLM LOG] Migrated {moved} records from {legacy}")
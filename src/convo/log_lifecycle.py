@@ -0,0 +1,216 @@
+import os, json, gzip, time, shutil, threading
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from .log_reader import LOG_DIR, _SEGMENT_RE, segment_size
+from .log_writer import writer_stats
+
+class LogLifecycleManager:
+    """Compression and retention for ``data/storage/logs``.
+
+    Segments (``wa-``, ``chat-``, ``llm-`` ... ``-YYYY-MM-DD[-archived-X].jsonl``)
+    from before the current UTC day are gzipped in place. Days older than
+    ``retention_days`` are deleted, then the oldest segments go until the
+    directory fits ``max_total_bytes``; today's files and any file a log
+    writer still has open are never touched. ``manifest.json`` lists what is left.
+
+    With ``standalone=True`` (the ``__main__`` CLI) open writers in the server
+    process are not visible, so each log's newest live-named segment is treated
+    as the current day's file and left alone too.
+    """
+
+    def __init__(
+        self,
+        log_dir: str = LOG_DIR,
+        retention_days: Optional[int] = None,
+        max_total_bytes: Optional[int] = None,
+        interval: Optional[float] = None,
+        min_age: float = 300.0,
+        standalone: bool = False,
+    ):
+        self.log_dir = log_dir
+        self.retention_days = retention_days or int(os.getenv("LOG_RETENTION_DAYS", "30"))
+        self.max_total_bytes = max_total_bytes or int(os.getenv("LOG_MAX_TOTAL_MB", "2048")) * 1024 * 1024
+        self.interval = interval or float(os.getenv("LOG_LIFECYCLE_INTERVAL", "3600"))
+        # Leave files alone for a few minutes after their last write (day rollover)
+        self.min_age = min_age
+        self.standalone = standalone
+        self.manifest_path = os.path.join(log_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    def _scan(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.log_dir):
+            return []
+        names = set(os.listdir(self.log_dir))
+        segments = []
+        for name in names:
+            m = _SEGMENT_RE.match(name)
+            if not m:
+                continue
+            if m.group("gz") and name[:-3] in names:
+                # Leftover from an interrupted compression; the plain file wins
+                os.remove(os.path.join(self.log_dir, name))
+                continue
+            seg = {
+                "name": name,
+                "prefix": m.group("prefix"),
+                "day": m.group("day"),
+                "archived": m.group("archived"),
+                "compressed": bool(m.group("gz")),
+                "bytes": os.path.getsize(os.path.join(self.log_dir, name)),
+            }
+            idx = self._index_path(seg)
+            seg["index_bytes"] = os.path.getsize(idx) if idx else 0
+            segments.append(seg)
+        # Oldest first: per day the archived rotations, then the live file
+        segments.sort(key=lambda s: (s["day"], s["archived"] is None, s["archived"] or "", s["prefix"]))
+        return segments
+
+    def _index_path(self, seg: Dict[str, Any]) -> Optional[str]:
+        if seg["archived"]:
+            return None
+        path = os.path.join(self.log_dir, f"{seg['prefix']}-{seg['day']}.idx")
+        return path if os.path.exists(path) else None
+
+    def _live_paths(self, segments: List[Dict[str, Any]]) -> set:
+        """Files currently held open by a BatchedLogWriter in this process."""
+        live = {os.path.abspath(s["path"]) for s in writer_stats().values() if s.get("path")}
+        if self.standalone:
+            # Another process may be writing: its current file is the newest
+            # non-archived segment of each prefix, whatever its day
+            newest: Dict[str, Dict[str, Any]] = {}
+            for seg in segments:
+                if seg["archived"] is None and seg["day"] >= newest.get(seg["prefix"], {}).get("day", ""):
+                    newest[seg["prefix"]] = seg
+            live.update(os.path.abspath(os.path.join(self.log_dir, seg["name"])) for seg in newest.values())
+        return live
+
+    def _is_live(self, seg: Dict[str, Any], live: set) -> bool:
+        return os.path.abspath(os.path.join(self.log_dir, seg["name"])) in live
+
+    def compress(self, name: str) -> int:
+        """Gzip one segment next to itself and remove the original. Returns bytes saved."""
+        src = os.path.join(self.log_dir, name)
+        dst = f"{src}.gz"
+        tmp = f"{dst}.tmp"
+        with open(src, "rb") as f_in, gzip.open(tmp, "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        st = os.stat(src)
+        os.utime(tmp, (st.st_atime, st.st_mtime))
+        os.replace(tmp, dst)
+        os.remove(src)
+        return st.st_size - os.path.getsize(dst)
+
+    def _delete(self, seg: Dict[str, Any]) -> int:
+        idx = self._index_path(seg)
+        if idx:
+            os.remove(idx)
+        os.remove(os.path.join(self.log_dir, seg["name"]))
+        return seg["bytes"] + seg["index_bytes"]
+
+    def run(self) -> Dict[str, Any]:
+        with self._lock:
+            start = time.time()
+            today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+            compressed = saved = deleted = freed = 0
+            segments = self._scan()
+            live = self._live_paths(segments)
+
+            for seg in segments:
+                if seg["compressed"] or seg["day"] >= today or self._is_live(seg, live):
+                    continue
+                if start - os.path.getmtime(os.path.join(self.log_dir, seg["name"])) < self.min_age:
+                    continue
+                try:
+                    saved += self.compress(seg["name"])
+                    compressed += 1
+                except OSError as e:
+                    print(f"[LOGS] Failed to compress {seg['name']}: {e}")
+
+            segments = self._scan()
+            kept = []
+            for seg in segments:
+                if seg["day"] < cutoff and not self._is_live(seg, live):
+                    freed += self._delete(seg)
+                    deleted += 1
+                else:
+                    kept.append(seg)
+
+            total = sum(s["bytes"] + s["index_bytes"] for s in kept)
+            if total > self.max_total_bytes:
+                # Oldest first, skipping open files; today's segments sort last
+                remaining = []
+                for seg in kept:
+                    if total > self.max_total_bytes and seg["day"] < today and not self._is_live(seg, live):
+                        size = self._delete(seg)
+                        total -= size
+                        freed += size
+                        deleted += 1
+                    else:
+                        remaining.append(seg)
+                kept = remaining
+
+            manifest = self._write_manifest(kept, total)
+            self.last_result = {
+                "ok": True,
+                "compressed": compressed,
+                "bytes_saved": saved,
+                "deleted": deleted,
+                "bytes_freed": freed,
+                "segments": len(manifest["segments"]),
+                "total_bytes": total,
+                "duration": round(time.time() - start, 3),
+            }
+            return self.last_result
+
+    def _write_manifest(self, segments: List[Dict[str, Any]], total: int) -> Dict[str, Any]:
+        for seg in segments:
+            seg["raw_bytes"] = segment_size(os.path.join(self.log_dir, seg["name"])) if seg["compressed"] else seg["bytes"]
+        manifest = {
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "retention_days": self.retention_days,
+            "max_total_bytes": self.max_total_bytes,
+            "total_bytes": total,
+            "segments": segments,
+        }
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(f"{self.manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+        return manifest
+
+    def manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"segments": [], "total_bytes": 0}
+
+    # Background scheduling
+    def _run(self):
+        while True:
+            try:
+                result = self.run()
+                if result["compressed"] or result["deleted"]:
+                    print(f"[LOGS] Compressed {result['compressed']}, deleted {result['deleted']} segment(s); {result['total_bytes']} bytes on disk")
+            except Exception as e:
+                print(f"[LOGS] Lifecycle error: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+if __name__ == "__main__":
+    print(json.dumps(LogLifecycleManager(standalone=True).run(), indent=2))
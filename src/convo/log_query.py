@@ -0,0 +1,270 @@
+import os, sys, json, math, heapq, fnmatch
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .log_reader import LOG_DIR, _SEGMENT_RE, _parse_ts, list_segments, open_segment
+from .llm_logger import iter_llm_records, legacy_llm_log_paths
+
+FAMILIES = ("wa", "chat", "llm")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _normalize(family: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Common view over the three schemas: wa uses ``jid``/``dir``/``stage``,
+    chat ``user_id``/``direction``/``status``, llm ``user_id``/``func``."""
+    if family == "wa":
+        kind = record.get("dir")
+        return {"who": record.get("jid"), "kind": kind, "group": record.get("stage") or kind,
+                "status": None, "func": None}
+    if family == "chat":
+        kind = record.get("direction")
+        return {"who": record.get("user_id"), "kind": kind, "group": kind,
+                "status": record.get("status"), "func": None}
+    return {"who": record.get("user_id"), "kind": "llm", "group": record.get("func"),
+            "status": None, "func": record.get("func")}
+
+def _segment_paths(family: str, log_dir: str, since_day: Optional[str], until_day: Optional[str]) -> Iterator[str]:
+    if family == "llm":
+        # Undated legacy logs first; they predate the daily segments
+        for path in legacy_llm_log_paths(log_dir):
+            if os.path.exists(path):
+                yield path
+        for name in sorted(os.listdir(log_dir)) if os.path.isdir(log_dir) else []:
+            if name.startswith("llm-legacy-") and (name.endswith(".jsonl") or name.endswith(".jsonl.gz")):
+                yield os.path.join(log_dir, name)
+    # list_segments is newest first; queries stream oldest first
+    for name in reversed(list_segments(family, log_dir)):
+        day = _SEGMENT_RE.match(name).group("day")
+        if (since_day and day < since_day) or (until_day and day > until_day):
+            continue
+        yield os.path.join(log_dir, name)
+
+def _read_segment(path: str, needle: Optional[bytes]) -> Iterator[Dict[str, Any]]:
+    if path.endswith(".json"):
+        # Legacy JSON array (only until it is migrated on startup)
+        yield from iter_llm_records(path)
+        return
+    with open_segment(path) as f:
+        for line in f:
+            if needle and needle not in line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+def iter_family(
+    family: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    needle: Optional[str] = None,
+    log_dir: str = LOG_DIR,
+) -> Iterator[Tuple[datetime, str, Dict[str, Any]]]:
+    """Yield ``(ts, family, record)`` oldest first from live, archived and
+    ``.gz`` segments of one log family, one line in memory at a time."""
+    since_day = since.strftime("%Y-%m-%d") if since else None
+    until_day = until.strftime("%Y-%m-%d") if until else None
+    raw = needle.encode("utf-8") if needle else None
+    for path in _segment_paths(family, log_dir, since_day, until_day):
+        for record in _read_segment(path, raw):
+            if not isinstance(record, dict):
+                continue
+            ts = _parse_ts(record.get("ts")) or _EPOCH
+            if (since and ts < since) or (until and ts > until):
+                continue
+            yield ts, family, record
+
+def query(
+    families: Iterable[str] = FAMILIES,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    who: Optional[str] = None,
+    stages: Optional[List[str]] = None,
+    kinds: Optional[List[str]] = None,
+    statuses: Optional[List[str]] = None,
+    funcs: Optional[List[str]] = None,
+    grep: Optional[str] = None,
+    log_dir: str = LOG_DIR,
+) -> Iterator[Tuple[str, Dict[str, Any], Dict[str, Any]]]:
+    """Merge the selected families by timestamp and yield matching
+    ``(family, record, normalized view)``. Glob patterns are accepted for
+    stages and funcs."""
+    if until and len(until) == 10:
+        # A bare date includes that whole day
+        until = f"{until}T23:59:59.999999"
+    since_dt, until_dt = _parse_ts(since), _parse_ts(until)
+    # Only one needle can be used for the raw-line prefilter; who is the most selective
+    needle = who or grep
+    streams = [iter_family(family, since_dt, until_dt, needle, log_dir) for family in families]
+    for _, family, record in heapq.merge(*streams, key=lambda item: item[0]):
+        view = _normalize(family, record)
+        if who and view["who"] != who:
+            continue
+        if grep and grep not in json.dumps(record, ensure_ascii=False, default=str):
+            continue
+        if stages and not any(fnmatch.fnmatchcase(str(view["group"]), pattern) for pattern in stages):
+            continue
+        if kinds and view["kind"] not in kinds:
+            continue
+        if statuses and view["status"] not in statuses:
+            continue
+        if funcs and not any(fnmatch.fnmatchcase(str(view["func"]), pattern) for pattern in funcs):
+            continue
+        yield family, record, view
+
+class LatencyHistogram:
+    """Fixed-memory latency summary: log-spaced buckets (~5% wide), so
+    percentiles are approximate but memory does not grow with the count."""
+
+    GROWTH = 1.05
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float):
+        if ms < 0:
+            return
+        index = int(math.log(ms, self.GROWTH)) if ms >= 1 else 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p: float) -> float:
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, self.GROWTH ** (index + 1))
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        out = {"count": self.count, "mean_ms": round(self.total / self.count, 1)}
+        for p in (50, 90, 95, 99):
+            out[f"p{p}_ms"] = round(self.percentile(p), 1)
+        out["max_ms"] = round(self.max, 1)
+        return out
+
+def _lookup_path(record: Dict[str, Any], path: str) -> Any:
+    value: Any = record
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def aggregate(
+    results: Iterable[Tuple[str, Dict[str, Any], Dict[str, Any]]],
+    latency_field: Optional[str] = None,
+    field_scale: float = 1.0,
+) -> Dict[str, Any]:
+    """Counts per family/group/status plus latency percentiles.
+
+    Turn latency pairs each incoming record (wa ``in`` / chat ``incoming``)
+    with the next outgoing one for the same jid/user_id; only users with an
+    open turn are held in memory. ``latency_field`` (dotted path, e.g.
+    ``metadata.took_ms``) adds a per-group histogram of that field, multiplied
+    by ``field_scale`` to get milliseconds.
+    """
+    counts: Dict[str, Dict[str, int]] = {}
+    statuses: Dict[str, int] = {}
+    turn: Dict[str, LatencyHistogram] = {}
+    fields: Dict[str, LatencyHistogram] = {}
+    open_turns: Dict[Tuple[str, Any], datetime] = {}
+    first = last = None
+    total = 0
+
+    for family, record, view in results:
+        total += 1
+        group = str(view["group"])
+        family_counts = counts.setdefault(family, {})
+        family_counts[group] = family_counts.get(group, 0) + 1
+        if view["status"]:
+            statuses[view["status"]] = statuses.get(view["status"], 0) + 1
+
+        ts = _parse_ts(record.get("ts"))
+        if ts:
+            first = first or ts
+            last = ts
+            key = (family, view["who"])
+            if view["kind"] in ("in", "incoming"):
+                open_turns.setdefault(key, ts)
+            elif view["kind"] in ("out", "outgoing") and key in open_turns:
+                started = open_turns.pop(key)
+                turn.setdefault(family, LatencyHistogram()).add((ts - started).total_seconds() * 1000)
+
+        if latency_field:
+            value = _lookup_path(record, latency_field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                fields.setdefault(f"{family}:{group}", LatencyHistogram()).add(value * field_scale)
+
+    return {
+        "records": total,
+        "first_ts": first.isoformat() if first else None,
+        "last_ts": last.isoformat() if last else None,
+        "counts": {family: dict(sorted(groups.items(), key=lambda kv: -kv[1])) for family, groups in counts.items()},
+        "statuses": statuses,
+        "turn_latency": {family: hist.summary() for family, hist in turn.items()},
+        "field_latency": {key: hist.summary() for key, hist in sorted(fields.items())} if latency_field else None,
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query wa-*, chat-* and llm logs (live, archived and .gz segments)")
+    parser.add_argument("--log-dir", default=LOG_DIR)
+    parser.add_argument("--family", action="append", choices=FAMILIES, help="Log family (repeatable, default all)")
+    parser.add_argument("--since", help="ISO timestamp or YYYY-MM-DD (UTC)")
+    parser.add_argument("--until", help="ISO timestamp or YYYY-MM-DD (UTC)")
+    parser.add_argument("--who", help="jid / user_id")
+    parser.add_argument("--stage", action="append", help="wa stage (or dir), chat direction, llm func; glob allowed")
+    parser.add_argument("--kind", action="append", help="wa dir / chat direction, e.g. in, out, stage, incoming")
+    parser.add_argument("--status", action="append", help="chat outgoing status")
+    parser.add_argument("--func", action="append", help="llm call site; glob allowed")
+    parser.add_argument("--grep", help="Substring that must appear in the raw record")
+    parser.add_argument("--limit", type=int, help="Stop after N matching records")
+    parser.add_argument("--agg", action="store_true", help="Print counts and latency percentiles instead of records")
+    parser.add_argument("--latency-field", help="Dotted numeric field to summarize per group with --agg")
+    parser.add_argument("--field-scale", type=float, default=1.0, help="Multiplier to turn --latency-field into ms")
+    parser.add_argument("--reconstruct", action="store_true", help="Expand llm prompt_ref/system_ref to full text")
+    args = parser.parse_args(argv)
+
+    results = query(
+        families=args.family or FAMILIES,
+        since=args.since,
+        until=args.until,
+        who=args.who,
+        stages=args.stage,
+        kinds=args.kind,
+        statuses=args.status,
+        funcs=args.func,
+        grep=args.grep,
+        log_dir=args.log_dir,
+    )
+    if args.limit:
+        results = (item for i, item in zip(range(args.limit), results))
+
+    if args.agg:
+        print(json.dumps(aggregate(results, args.latency_field, args.field_scale), ensure_ascii=False, indent=2))
+        return 0
+
+    if args.reconstruct:
+        from .prompt_store import reconstruct
+    out = sys.stdout
+    try:
+        for family, record, _ in results:
+            if args.reconstruct and family == "llm":
+                record = reconstruct(record)
+            out.write(json.dumps({"family": family, **record}, ensure_ascii=False, default=str) + "\n")
+    except BrokenPipeError:
+        # Piped into head/less that exited early
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import os
+import re
+import gzip
+import json
+import atexit
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+LOG_DIR = os.path.join("data", "storage", "logs")
+
+_SEGMENT_RE = re.compile(r"^(?P<prefix>[a-z]+)-(?P<day>\d{4}-\d{2}-\d{2})(?:-archived-(?P<archived>.+?))?\.jsonl(?P<gz>\.gz)?$")
+
+def open_segment(path: str):
+    """Open a log segment for binary reading; ``.gz`` segments are decompressed on the fly."""
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+def segment_size(path: str) -> int:
+    """Uncompressed size of a segment (gzip stores it mod 2**32 in the trailer)."""
+    if not path.endswith(".gz"):
+        return os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), "little")
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def list_segments(prefix: str, log_dir: str = LOG_DIR) -> List[str]:
+    """Log files for ``prefix``, newest first: per day the live file, then
+    its ``-archived-`` rotations from newest to oldest."""
+    if not os.path.isdir(log_dir):
+        return []
+    keyed = []
+    names = set(os.listdir(log_dir))
+    for name in names:
+        m = _SEGMENT_RE.match(name)
+        if not m or m.group("prefix") != prefix:
+            continue
+        if m.group("gz") and name[:-3] in names:
+            # Compression in progress; the plain file is still authoritative
+            continue
+        archived = m.group("archived")
+        keyed.append(((m.group("day"), archived is None, archived or ""), name))
+    keyed.sort(reverse=True)
+    return [name for _, name in keyed]
+
+# Inflated copies of recently read .gz segments: (path, mtime_ns, size) -> spool file
+_SPOOL_LIMIT = int(os.getenv("LOG_GZ_SPOOL_CACHE", "4"))
+_spools: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_spool_lock = threading.Lock()
+_spool_dir: Optional[str] = None
+
+def _open_inflated(path: str, block: int):
+    """Open an inflated copy of a .gz segment. Compressed segments never
+    change, so the copy is reused by the next pages until it is evicted."""
+    global _spool_dir
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _spool_lock:
+        spool = _spools.get(key)
+        if spool is not None and os.path.exists(spool):
+            _spools.move_to_end(key)
+            return open(spool, "rb")
+        if _spool_dir is None:
+            _spool_dir = tempfile.mkdtemp(prefix="log-spool-")
+            atexit.register(shutil.rmtree, _spool_dir, True)
+        fd, spool = tempfile.mkstemp(dir=_spool_dir, suffix=".jsonl")
+        with os.fdopen(fd, "wb") as out, gzip.open(path, "rb") as src:
+            shutil.copyfileobj(src, out, block)
+        _spools[key] = spool
+        while len(_spools) > _SPOOL_LIMIT:
+            _, old = _spools.popitem(last=False)
+            try:
+                # Readers that still have it open keep their handle
+                os.remove(old)
+            except OSError:
+                pass
+        return open(spool, "rb")
+
+def reverse_lines(path: str, end: Optional[int] = None, block: int = 65536) -> Iterator[Tuple[int, bytes]]:
+    """Yield ``(start_offset, line)`` from ``end`` (default EOF) back to the
+    start of the file, reading fixed-size blocks from the tail. Gzipped
+    segments are read from a cached inflated copy so offsets stay in
+    uncompressed bytes."""
+    with (_open_inflated(path, block) if path.endswith(".gz") else open(path, "rb")) as f:
+        yield from _reverse_lines(f, end, block)
+
+def _reverse_lines(f, end: Optional[int], block: int) -> Iterator[Tuple[int, bytes]]:
+    if end is None:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+    pos = end
+    tail = b""
+    while pos > 0:
+        size = min(block, pos)
+        pos -= size
+        f.seek(pos)
+        buf = f.read(size) + tail
+        lines = buf.split(b"\n")
+        tail = lines[0]
+        line_end = pos + len(buf)
+        for line in reversed(lines[1:]):
+            start = line_end - len(line)
+            if line:
+                yield start, line
+            line_end = start - 1
+    if tail:
+        yield 0, tail
+
+def _resolve_cursor(cursor: Optional[str], segments: List[str], log_dir: str) -> Tuple[int, Optional[int]]:
+    """Cursor is ``<file name>:<byte offset>``; returns (segment index, end offset)."""
+    if not cursor:
+        return 0, None
+    name, _, offset = cursor.rpartition(":")
+    end = int(offset)
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for candidate in (name, f"{name}.gz"):
+        # Cursors issued before a segment was compressed keep working
+        if candidate in segments:
+            return segments.index(candidate), end
+    # The live file was rotated to an -archived- name since the cursor was issued
+    m = _SEGMENT_RE.match(name)
+    if m:
+        for i, seg in enumerate(segments):
+            sm = _SEGMENT_RE.match(seg)
+            if sm and sm.group("day") == m.group("day") and sm.group("archived") \
+                    and segment_size(os.path.join(log_dir, seg)) >= end:
+                return i, end
+    return len(segments), None
+
+def iter_records_reverse(
+    prefix: str = "wa",
+    cursor: Optional[str] = None,
+    jid: Optional[str] = None,
+    dirs: Optional[Iterable[str]] = None,
+    stages: Optional[Iterable[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    log_dir: str = LOG_DIR,
+) -> Iterator[Tuple[Dict[str, Any], str]]:
+    """Stream matching records newest-first across live, archived and
+    previous-day files. Each record comes with the cursor that resumes
+    right after it (i.e. continues with older records)."""
+    segments = list_segments(prefix, log_dir)
+    index, end = _resolve_cursor(cursor, segments, log_dir)
+    dirs = set(dirs) if dirs else None
+    stages = set(stages) if stages else None
+    since_dt, until_dt = _parse_ts(since), _parse_ts(until)
+    since_day = since_dt.strftime("%Y-%m-%d") if since_dt else None
+    jid_bytes = jid.encode("utf-8") if jid else None
+
+    for name in segments[index:]:
+        day = _SEGMENT_RE.match(name).group("day")
+        if since_day and day < since_day:
+            return
+        if until_dt and day > until_dt.strftime("%Y-%m-%d"):
+            end = None
+            continue
+        path = os.path.join(log_dir, name)
+        for start, line in reverse_lines(path, end):
+            if jid_bytes and jid_bytes not in line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if since_dt or until_dt:
+                ts = _parse_ts(record.get("ts"))
+                if ts is not None:
+                    if until_dt and ts > until_dt:
+                        continue
+                    if since_dt and ts < since_dt:
+                        # Files are append-only, so everything further back is older
+                        return
+            if jid and record.get("jid") != jid:
+                continue
+            if dirs and record.get("dir") not in dirs:
+                continue
+            if stages and record.get("stage") not in stages:
+                continue
+            yield record, f"{name}:{start}"
+        end = None
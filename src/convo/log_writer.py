@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class BatchedLogWriter:
+    """One background writer per JSONL log stream.
+
+    ``write()`` only enqueues the record (serialization happens on the
+    writer thread). The thread drains the bounded queue in batches into a
+    file handle that stays open until the day's path changes or the file is
+    rotated past ``max_bytes`` to an ``-archived-`` name. Buffers are flushed
+    every ``flush_interval`` seconds and at shutdown. With ``index=True`` a
+    ``<name>.idx`` sidecar gets ``key<TAB>offset<TAB>length`` per record.
+
+    Only the writer thread touches the files, so records land in ``write()``
+    order; ``flush()`` queues a marker and waits for the thread to reach it.
+    Dict records are copied shallowly on ``write()``: callers may reuse the
+    dict, but must not mutate nested values afterwards.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path_fn: Callable[[], str],
+        max_bytes: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        index: bool = False,
+        batch_size: int = 500,
+    ):
+        self.name = name
+        self.path_fn = path_fn
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval or float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+        self.index = index
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Tuple[Any, Optional[str]]]" = queue.Queue(
+            maxsize=queue_size or int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+        )
+        self._io_lock = threading.Lock()
+        self._fh = None
+        self._idx = None
+        self._path: Optional[str] = None
+        self._last_flush = time.monotonic()
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"log-writer-{name}", daemon=True)
+        self._thread.start()
+        _WRITERS.append(self)
+
+    # Hot path
+    def write(self, record: Any, key: Optional[str] = None) -> bool:
+        if isinstance(record, dict):
+            record = dict(record)
+        try:
+            self._queue.put_nowait((record, key))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    # Writer thread
+    @staticmethod
+    def _index_path(path: str) -> str:
+        return path[:-len(".jsonl")] + ".idx" if path.endswith(".jsonl") else path + ".idx"
+
+    def _close_files(self):
+        for fh in (self._fh, self._idx):
+            if fh is not None:
+                try:
+                    fh.close()
+                except Exception:
+                    pass
+        self._fh = self._idx = None
+        self._path = None
+
+    def _ensure_open(self, incoming: int):
+        path = self.path_fn()
+        if path != self._path:
+            self._close_files()
+        if self._fh is not None and self.max_bytes and self._fh.tell() + incoming > self.max_bytes and self._fh.tell() > 0:
+            self._close_files()
+            # No ":" so archived names stay valid on every filesystem
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+            os.rename(path, path.replace(".jsonl", f"-archived-{stamp}.jsonl"))
+            if self.index and os.path.exists(self._index_path(path)):
+                os.remove(self._index_path(path))
+        if self._fh is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._fh = open(path, "ab")
+            self._fh.seek(0, os.SEEK_END)
+            if self.index:
+                self._idx = open(self._index_path(path), "a", encoding="utf-8")
+            self._path = path
+
+    def _write_batch(self, batch: List[Tuple[Any, Optional[str]]]):
+        encoded = []
+        for record, key in batch:
+            try:
+                line = record if isinstance(record, str) else json.dumps(record, ensure_ascii=False, default=str)
+                encoded.append(((line + "\n").encode("utf-8"), key))
+            except Exception as e:
+                self.errors += 1
+                print(f"[LOG] {self.name}: unserializable record dropped: {e}")
+        if not encoded:
+            return
+        with self._io_lock:
+            self._ensure_open(sum(len(data) for data, _ in encoded))
+            offset = self._fh.tell()
+            self._fh.write(b"".join(data for data, _ in encoded))
+            if self._idx is not None:
+                entries = []
+                for data, key in encoded:
+                    clean = str(key or "").replace("\t", " ").replace("\n", " ")
+                    entries.append(f"{clean}\t{offset}\t{len(data)}\n")
+                    offset += len(data)
+                self._idx.write("".join(entries))
+            self.written += len(encoded)
+            self.batches += 1
+
+    def _flush_files(self):
+        with self._io_lock:
+            # Data before index so an index entry never points past the data
+            if self._fh is not None:
+                self._fh.flush()
+            if self._idx is not None:
+                self._idx.flush()
+            self._last_flush = time.monotonic()
+
+    def _drain_once(self, timeout: Optional[float]) -> bool:
+        try:
+            first = self._queue.get(timeout=timeout) if timeout is not None else self._queue.get_nowait()
+        except queue.Empty:
+            return False
+        self.max_depth = max(self.max_depth, self._queue.qsize() + 1)
+        batch = []
+        waiter = None
+        item = first
+        while True:
+            if item[1] is _FLUSH:
+                # Everything queued before the marker is in this batch
+                waiter = item[0]
+                break
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            if batch:
+                self._write_batch(batch)
+        except Exception as e:
+            self.errors += 1
+            print(f"[LOG] {self.name}: write failed: {e}")
+            self._close_files()
+        if waiter is not None:
+            try:
+                self._flush_files()
+            except Exception as e:
+                self.errors += 1
+                print(f"[LOG] {self.name}: flush failed: {e}")
+            waiter.set()
+        return True
+
+    def _close_if_rolled_over(self):
+        """Release yesterday's file at day rollover instead of on the next write,
+        so the lifecycle manager can compress it."""
+        with self._io_lock:
+            if self._path is not None and self.path_fn() != self._path:
+                self._close_files()
+
+    def _run(self):
+        while not self._stop.is_set():
+            wrote = self._drain_once(self.flush_interval)
+            if not wrote or time.monotonic() - self._last_flush >= self.flush_interval:
+                try:
+                    self._flush_files()
+                    self._close_if_rolled_over()
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[LOG] {self.name}: flush failed: {e}")
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until everything queued so far is written and flushed to the OS."""
+        if not self._thread.is_alive():
+            # Nothing else drains the queue any more
+            while self._drain_once(None):
+                pass
+            self._flush_files()
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put((done, _FLUSH), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    @contextmanager
+    def paused(self):
+        """Hold off the writer with its files flushed and closed, e.g. while a
+        sidecar index is replaced; the next batch reopens them by path."""
+        with self._io_lock:
+            self._close_files()
+            yield
+
+    def close(self):
+        self.flush()
+        self._stop.set()
+        self._thread.join(self.flush_interval + 1)
+        self.flush()
+        with self._io_lock:
+            self._close_files()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "path": self._path,
+        }
+
+# Queue key of a flush() marker; the record slot holds the Event to set
+_FLUSH = object()
+
+_WRITERS: List[BatchedLogWriter] = []
+
+def flush_all():
+    for writer in list(_WRITERS):
+        try:
+            writer.flush()
+        except Exception as e:
+            print(f"[LOG] {writer.name}: final flush failed: {e}")
+
+def writer_stats() -> Dict[str, Dict[str, Any]]:
+    return {writer.name: writer.stats() for writer in _WRITERS}
+
+atexit.register(flush_all)
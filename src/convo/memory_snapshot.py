@@ -0,0 +1,226 @@
+import os, json, gzip, time, hashlib, threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .memory_store import MemoryStore
+
+def _stamp(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+def _parse_at(at: Any) -> float:
+    if at is None:
+        return time.time()
+    if isinstance(at, (int, float)):
+        return float(at)
+    dt = datetime.fromisoformat(str(at).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+class MemorySnapshotter:
+    """Incremental point-in-time snapshots of a MemoryStore.
+
+    Each user record is stored once per distinct content as a gzipped object
+    named by its sha256. A snapshot is a small manifest mapping user ids to
+    object hashes, so a snapshot only writes the records that changed since
+    the previous one.
+    """
+
+    def __init__(self, store: MemoryStore, root: Optional[str] = None, interval: float = 900.0, keep: int = 96):
+        self.store = store
+        self.root = root or os.path.join(os.path.dirname(store.path), "backups", "snapshots")
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.manifests_dir = os.path.join(self.root, "manifests")
+        self.interval = interval
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+        latest = self.list_snapshots()
+        if latest:
+            manifest = self._read_manifest(latest[-1]["id"])
+            self._current: Dict[str, str] = manifest["records"]
+            # Only users changed since the last snapshot need new objects
+            store.mark_snapshot_dirty(since=manifest.get("created_at"), known=self._current)
+        else:
+            self._current = {}
+            store.mark_snapshot_dirty()
+
+    # Object store
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.json.gz")
+
+    def _put_object(self, record: Dict[str, Any]) -> str:
+        payload = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(payload).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(gzip.compress(payload, compresslevel=6))
+            os.replace(tmp, path)
+        return digest
+
+    def _get_object(self, digest: str) -> Dict[str, Any]:
+        with open(self._object_path(digest), "rb") as f:
+            return json.loads(gzip.decompress(f.read()).decode("utf-8"))
+
+    # Manifests
+    def _read_manifest(self, snapshot_id: str) -> Dict[str, Any]:
+        with open(os.path.join(self.manifests_dir, f"{snapshot_id}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def list_snapshots(self) -> List[Dict[str, Any]]:
+        out = []
+        for name in sorted(os.listdir(self.manifests_dir)):
+            if not name.endswith(".json"):
+                continue
+            snapshot_id = name[:-5]
+            try:
+                ts = datetime.strptime(snapshot_id, "%Y%m%dT%H%M%S%fZ").replace(tzinfo=timezone.utc).timestamp()
+            except ValueError:
+                continue
+            out.append({"id": snapshot_id, "ts": ts})
+        return out
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            start = time.time()
+            changed, removed = self.store.take_snapshot_dirty()
+            try:
+                records = dict(self._current)
+                written = 0
+                for uid, rec in changed.items():
+                    digest = self._put_object(rec)
+                    if records.get(uid) != digest:
+                        written += 1
+                    records[uid] = digest
+                for uid in removed:
+                    records.pop(uid, None)
+
+                if records == self._current and self.list_snapshots():
+                    return {"ok": True, "skipped": True, "changed": 0}
+
+                ts = time.time()
+                snapshot_id = _stamp(ts)
+                manifest = {
+                    "id": snapshot_id,
+                    "created_at": datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+                    "records": records,
+                    "changed": written,
+                    "removed": len(removed),
+                }
+                path = os.path.join(self.manifests_dir, f"{snapshot_id}.json")
+                with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, separators=(",", ":"))
+                os.replace(f"{path}.tmp", path)
+            except Exception:
+                # Nothing was committed; keep these users for the next snapshot
+                self.store.requeue_snapshot_dirty(list(changed) + removed)
+                raise
+            self._current = records
+            self.prune()
+
+            return {
+                "ok": True,
+                "id": snapshot_id,
+                "users": len(records),
+                "changed": written,
+                "removed": len(removed),
+                "duration": round(time.time() - start, 3),
+            }
+
+    def prune(self) -> int:
+        snapshots = self.list_snapshots()
+        if len(snapshots) <= self.keep:
+            return 0
+        for snap in snapshots[:-self.keep]:
+            os.remove(os.path.join(self.manifests_dir, f"{snap['id']}.json"))
+
+        live = set()
+        for snap in snapshots[-self.keep:]:
+            live.update(self._read_manifest(snap["id"])["records"].values())
+        removed = 0
+        for sub in os.listdir(self.objects_dir):
+            sub_dir = os.path.join(self.objects_dir, sub)
+            for name in os.listdir(sub_dir):
+                if name.endswith(".json.gz") and name[:-8] not in live:
+                    os.remove(os.path.join(sub_dir, name))
+                    removed += 1
+        return removed
+
+    def find_snapshot(self, at: Any = None) -> Optional[str]:
+        target = _parse_at(at)
+        chosen = None
+        for snap in self.list_snapshots():
+            if snap["ts"] <= target:
+                chosen = snap["id"]
+        return chosen
+
+    def restore(self, at: Any = None, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Restore one user, or the whole store, to the latest snapshot taken
+        at or before ``at`` (ISO string or epoch; defaults to now)."""
+        # Held throughout so prune() cannot delete objects being read
+        with self._lock:
+            snapshot_id = self.find_snapshot(at)
+            if snapshot_id is None:
+                return {"ok": False, "error": "No snapshot at or before requested time"}
+            records = self._read_manifest(snapshot_id)["records"]
+
+            if user_id is not None:
+                if user_id not in records:
+                    return {"ok": False, "error": f"User {user_id} not in snapshot {snapshot_id}"}
+                self.store.restore_records({user_id: self._get_object(records[user_id])})
+                restored = 1
+            else:
+                data = {uid: self._get_object(digest) for uid, digest in records.items()}
+                self.store.restore_records(data, replace_all=True)
+                restored = len(data)
+
+        print(f"[SNAPSHOT] Restored {restored} user(s) from {snapshot_id}")
+        return {"ok": True, "snapshot_id": snapshot_id, "restored": restored, "user_id": user_id}
+
+    # Background scheduling
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                result = self.snapshot()
+                if not result.get("skipped"):
+                    print(f"[SNAPSHOT] {result['id']}: {result['changed']} changed, {result['users']} users ({result['duration']}s)")
+            except Exception as e:
+                print(f"[SNAPSHOT] Error: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MemoryStore snapshots (run with the server stopped)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("snapshot")
+    sub.add_parser("list")
+    p_restore = sub.add_parser("restore")
+    p_restore.add_argument("--at", help="ISO timestamp; latest snapshot at or before it is used")
+    p_restore.add_argument("--user", help="Restore only this user_id")
+    args = parser.parse_args()
+
+    snapshotter = MemorySnapshotter(MemoryStore())
+    if args.cmd == "snapshot":
+        print(snapshotter.snapshot())
+    elif args.cmd == "list":
+        for snap in snapshotter.list_snapshots():
+            print(snap["id"])
+    else:
+        print(snapshotter.restore(at=args.at, user_id=args.user))
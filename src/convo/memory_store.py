@@ -1,10 +1,21 @@
-import os, json, threading, secrets
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+import os, sys, json, time, threading, secrets
+from datetime import datetime, timedelta, timezone
+from bisect import bisect_right, insort
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .search_index import SearchIndex
 
 def _now_iso() -> str:
     return datetime.utcnow().isoformat(timespec="seconds") + "Z"
 
+def _parse_iso(value: Any) -> Optional[float]:
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
 def _ensure_dir(path: str) -> None:
     dir_path = os.path.dirname(path)
     if dir_path and not os.path.exists(dir_path):
@@ -18,9 +29,261 @@ def _atomic_write(path: str, data: str):
         os.fsync(f.fileno())
     os.replace(tmp, path)
 
+def _iso_to_epoch(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        try:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return dt.timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+def _epoch_to_iso(ts: float) -> str:
+    return datetime.utcfromtimestamp(ts).isoformat(timespec="seconds") + "Z"
+
+# Role codes are shared by every history buffer, so each entry holds a small int
+_ROLE_CODES: Dict[str, int] = {}
+_ROLE_NAMES: List[str] = []
+
+def _role_code(role: str) -> int:
+    code = _ROLE_CODES.get(role)
+    if code is None:
+        code = len(_ROLE_NAMES)
+        _ROLE_NAMES.append(sys.intern(role))
+        _ROLE_CODES[_ROLE_NAMES[code]] = code
+    return code
+
+def _role_name(code: int) -> str:
+    return _ROLE_NAMES[code]
+
+for _r in ("user", "bot", "assistant"):
+    _role_code(_r)
+
+# HistoryRing Object
+class HistoryRing:
+    """Fixed-capacity ring buffer of (role_code, ts_epoch, text, meta) tuples."""
+
+    __slots__ = ("_buf", "_start", "_size")
+
+    def __init__(self, capacity: int = 50):
+        self._buf: List[Optional[Tuple[int, float, str, Optional[Dict[str, Any]]]]] = [None] * max(1, int(capacity))
+        self._start = 0
+        self._size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buf)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def append(self, role: str, text: str, ts: Optional[float] = None, meta: Optional[Dict[str, Any]] = None):
+        """Append an entry; returns the evicted oldest entry when the buffer is full."""
+        cap = len(self._buf)
+        entry = (_role_code(role), time.time() if ts is None else ts, text, meta)
+        if self._size < cap:
+            self._buf[(self._start + self._size) % cap] = entry
+            self._size += 1
+            return None
+        evicted = self._buf[self._start]
+        self._buf[self._start] = entry
+        self._start = (self._start + 1) % cap
+        return evicted
+
+    def clear(self) -> None:
+        self._buf = [None] * len(self._buf)
+        self._start = 0
+        self._size = 0
+
+    def truncate(self, keep_last: int) -> None:
+        keep_last = max(0, keep_last)
+        if keep_last >= self._size:
+            return
+        kept = list(self.raw(keep_last)) if keep_last else []
+        self.clear()
+        for role, ts, text, meta in kept:
+            self.append(_role_name(role), text, ts, meta)
+
+    def raw(self, n: Optional[int] = None) -> Iterator[Tuple[int, float, str, Optional[Dict[str, Any]]]]:
+        cap = len(self._buf)
+        count = self._size if n is None else max(0, min(n, self._size))
+        first = self._start + self._size - count
+        for i in range(first, first + count):
+            yield self._buf[i % cap]
+
+    def raw_reversed(self) -> Iterator[Tuple[int, float, str, Optional[Dict[str, Any]]]]:
+        cap = len(self._buf)
+        for i in range(self._start + self._size - 1, self._start - 1, -1):
+            yield self._buf[i % cap]
+
+    def iter_entries(self, n: Optional[int] = None) -> Iterator[Tuple[str, float, str]]:
+        for role, ts, text, _ in self.raw(n):
+            yield _role_name(role), ts, text
+
+    def to_list(self, n: Optional[int] = None) -> List[Dict[str, Any]]:
+        out = []
+        for role, ts, text, meta in self.raw(n):
+            entry = {"role": _role_name(role), "text": text, "ts": _epoch_to_iso(ts)}
+            if meta:
+                entry["meta"] = dict(meta)
+            out.append(entry)
+        return out
+
+    def extend_dicts(self, items: Iterable[Any]) -> None:
+        for h in items or []:
+            if isinstance(h, dict) and "role" in h and "text" in h:
+                self.append(h["role"], h["text"], _iso_to_epoch(h.get("ts")), h.get("meta"))
+
+# Admin state name -> flag that marks a user as being in that state
+STATE_FLAGS: Dict[str, str] = {
+    "pending": "sop_pending",
+    "resolved": "sop_resolved",
+    "blocked": "spam_blocked",
+    "spam": "spam_user",
+}
+_FLAG_STATES: Dict[str, str] = {flag: state for state, flag in STATE_FLAGS.items()}
+
+# Plain flags holding an ISO expiry that became TTL flags (legacy -> TTL key)
+_LEGACY_TTL_FLAGS: Dict[str, str] = {
+    "spam_blocked_until": "spam_blocked",
+}
+
+# TimerWheel Object
+class _TimerWheel:
+    """Hashed timer wheel for TTL flags. Entries land in the slot of their
+    expiry tick; a sweep walks only the ticks elapsed since the last sweep."""
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self._slots: List[Dict[Tuple[str, str], float]] = [{} for _ in range(slots)]
+        self._cursor = int(time.time() // tick)
+
+    def schedule(self, uid: str, key: str, expires_at: float) -> None:
+        slot = int(expires_at // self.tick) % len(self._slots)
+        self._slots[slot][(uid, key)] = expires_at
+
+    def advance(self, now: float) -> List[Tuple[str, str, float]]:
+        target = int(now // self.tick)
+        if target < self._cursor:
+            return []
+        due: List[Tuple[str, str, float]] = []
+        # The cursor tick is walked again: entries due later in it were kept last time
+        steps = min(target - self._cursor + 1, len(self._slots))
+        for t in range(self._cursor, self._cursor + steps):
+            bucket = self._slots[t % len(self._slots)]
+            for ident, expires_at in list(bucket.items()):
+                if expires_at <= now:
+                    del bucket[ident]
+                    due.append((ident[0], ident[1], expires_at))
+        self._cursor = target
+        return due
+
+# Striped reader/writer locks
+class _StripeLock:
+    """Reentrant reader/writer lock. A thread holding the write side may also
+    take the read side; readers never upgrade."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            while self._writer is not None:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth -= 1
+                return
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            while self._writer is not None or self._readers > 0:
+                self._cond.wait()
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if self._write_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+class _ReadGuard:
+    __slots__ = ("_stripe",)
+
+    def __init__(self, stripe: _StripeLock):
+        self._stripe = stripe
+
+    def __enter__(self):
+        self._stripe.acquire_read()
+        return self
+
+    def __exit__(self, *exc):
+        self._stripe.release_read()
+        return False
+
+class _WriteGuard:
+    """Write side of a user stripe. When the thread leaves its outermost
+    write section, pending changes are persisted with no stripe held."""
+
+    __slots__ = ("_store", "_stripe")
+
+    def __init__(self, store: "MemoryStore", stripe: _StripeLock):
+        self._store = store
+        self._stripe = stripe
+
+    def __enter__(self):
+        self._stripe.acquire_write()
+        local = self._store._local
+        local.depth = getattr(local, "depth", 0) + 1
+        return self
+
+    def __exit__(self, *exc):
+        local = self._store._local
+        local.depth -= 1
+        self._stripe.release_write()
+        if local.depth == 0 and getattr(local, "save_requested", False):
+            local.save_requested = False
+            self._store._persist()
+        return False
+
 # UserRecord Object
 class UserRecord:
-    def __init__(self, user_id: str):
+    __slots__ = (
+        "user_id", "session_token",
+        "name", "gender", "is_company", "product", "serial", "address",
+        "summary_context", "history", "last_answer", "last_step",
+        "flags", "ttl_flags", "slots",
+        "created_at", "updated_at",
+    )
+
+    def __init__(self, user_id: str, max_history: int = 50):
         self.user_id = user_id
         self.session_token: str = secrets.token_hex(8)
         self.name: Optional[str] = None
@@ -30,11 +293,14 @@ class UserRecord:
         self.serial: Optional[str] = None
         self.address: Optional[str] = None
         self.summary_context: List[str] = []
-        self.history: List[Dict[str, Any]] = []
+        self.history = HistoryRing(max_history)
         self.last_answer: Optional[str] = None
+        self.last_step: Optional[str] = None
         self.flags: Dict[str, Any] = {
             "last_activity": _now_iso(),
         }
+        # key -> (value, expires_at_epoch); kept off the hot save path
+        self.ttl_flags: Dict[str, Tuple[Any, float]] = {}
         self.slots: Dict[str, Any] = {}
         self.created_at = _now_iso()
         self.updated_at = self.created_at
@@ -47,17 +313,40 @@ class UserRecord:
         self.touch()
 
     def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
+        data = {}
+        for key in self.__slots__:
+            val = getattr(self, key)
+            if key == "history":
+                val = val.to_list()
+            elif key in ("flags", "slots"):
+                val = dict(val)
+            elif key == "summary_context":
+                val = list(val)
+            elif key == "ttl_flags":
+                now = time.time()
+                val = {k: {"value": v, "expires_at": e} for k, (v, e) in val.items() if e > now}
+                if not val:
+                    continue
+            elif key == "last_step" and val is None:
+                continue
+            data[key] = val
+        return data
 
 # MemoryStore Class
 class MemoryStore:
-    def __init__(self, path: str = "data/storage/memory.json", autosave: bool = True, max_history: int = 50, debug: bool = False):
+    LOCK_STRIPES = 64
+
+    def __init__(self, path: str = "data/storage/memory.json", autosave: bool = True, max_history: int = 50, debug: bool = False, ttl_sweep_interval: float = 5.0):
         self.path = os.path.abspath(path)
         self.autosave = autosave
         self.max_history = max_history
         self.debug = debug
         self._lock = threading.RLock()
-        self._user_locks: Dict[str, threading.RLock] = {}
+        self._stripes = [_StripeLock() for _ in range(self.LOCK_STRIPES)]
+        self._local = threading.local()
+        self._io_lock = threading.Lock()
+        self._save_dirty: set = set()
+        self._fragments: Dict[str, str] = {}
 
         if not os.path.exists(self.path):
             with open(self.path, "w", encoding="utf-8") as f:
@@ -67,8 +356,24 @@ class MemoryStore:
             print(f"[MemoryStore] Using path: {self.path}")
 
         self._records: Dict[str, UserRecord] = {}
+        self._index = SearchIndex()
+        self._wheel = _TimerWheel()
+        self.ttl_sweep_interval = ttl_sweep_interval
+        self._last_sweep = time.time()
+        self._user_ids: List[str] = []
+        self._message_count = 0
+        self._last_updated: Optional[str] = None
+        self._state_members: Dict[str, set] = {state: set() for state in STATE_FLAGS}
+        self._snapshot_dirty: set = set()
         self._load()
 
+        # Expired TTL flags are dropped in the background, not only on access
+        self._sweeper_stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        if self.ttl_sweep_interval > 0:
+            self._sweeper = threading.Thread(target=self._run_sweeper, name="memory-ttl-sweep", daemon=True)
+            self._sweeper.start()
+
     # Core I/O
     def _load(self):
         if not os.path.exists(self.path):
@@ -86,22 +391,14 @@ class MemoryStore:
 
             for uid, v in data.items():
                 try:
-                    rec = UserRecord(uid)
-                    if isinstance(v, dict):
-                        CLEAN_KEYS = {
-                            "user_id", "session_token",
-                            "name", "gender", "product", "serial", "address",
-                            "summary_context", "history", "last_answer",
-                            "flags", "slots",
-                            "created_at", "updated_at",
-                        }
-                        for key, val in v.items():
-                            if key in CLEAN_KEYS:
-                                setattr(rec, key, val)
-                    self._records[uid] = rec
+                    self._records[uid] = self._record_from_dict(uid, v)
                 except Exception as e:
                     print(f"[MemoryStore] Skip corrupted record for {uid}: {e}")
 
+            self._rebuild_index()
+            self._rebuild_stats()
+            self._fragments = {uid: self._dumps(rec.to_dict()) for uid, rec in self._records.items()}
+
         except Exception as e:
             print(f"[MemoryStore] Failed to load: {e}. Resetting {self.path} to empty {{}}.")
             self._records = {}
@@ -110,39 +407,204 @@ class MemoryStore:
             except Exception as ew:
                 print(f"[MemoryStore] Failed to reset file: {ew}")
 
+    def _record_from_dict(self, uid: str, v: Any) -> UserRecord:
+        rec = UserRecord(uid, self.max_history)
+        if isinstance(v, dict):
+            CLEAN_KEYS = {
+                "user_id", "session_token",
+                "name", "gender", "product", "serial", "address",
+                "summary_context", "last_answer", "last_step",
+                "flags", "slots",
+                "created_at", "updated_at",
+            }
+            for key, val in v.items():
+                if key in CLEAN_KEYS:
+                    setattr(rec, key, val)
+            rec.history.extend_dicts(v.get("history"))
+            now = time.time()
+            for key, item in (v.get("ttl_flags") or {}).items():
+                expires_at = float(item.get("expires_at", 0))
+                if expires_at > now:
+                    rec.ttl_flags[key] = (item.get("value"), expires_at)
+                    self._wheel.schedule(uid, key, expires_at)
+            if isinstance(rec.flags, dict):
+                for legacy, key in _LEGACY_TTL_FLAGS.items():
+                    expires_at = _parse_iso(rec.flags.pop(legacy, None))
+                    if expires_at is not None and expires_at > now and key not in rec.ttl_flags:
+                        rec.ttl_flags[key] = (True, expires_at)
+                        self._wheel.schedule(uid, key, expires_at)
+        return rec
+
     def set_debug(self, flag: bool):
         self.debug = bool(flag)
 
+    # Running counters, maintained on mutation so stats() never scans records
+    def _rebuild_stats(self):
+        with self._lock:
+            self._user_ids = sorted(self._records)
+            self._message_count = sum(len(r.history) for r in self._records.values())
+            self._last_updated = max((r.updated_at for r in self._records.values()), default=None)
+            for members in self._state_members.values():
+                members.clear()
+            for rec in self._records.values():
+                self._refresh_states(rec)
+
+    # Shared structures (_records, _user_ids, counters, state and dirty sets)
+    # change only under self._lock. Lock order: a user stripe may be held
+    # when taking self._lock, never the other way round.
+    def _refresh_states(self, rec: UserRecord):
+        now = time.time()
+        for state, flag in STATE_FLAGS.items():
+            item = rec.ttl_flags.get(flag)
+            ttl_active = item is not None and bool(item[0]) and item[1] > now
+            self._track_state(rec.user_id, flag, bool(rec.flags.get(flag)) or ttl_active)
+
+    def _track_state(self, uid: str, key: str, active: bool):
+        state = _FLAG_STATES.get(key)
+        if state is None:
+            return
+        with self._lock:
+            if active:
+                self._state_members[state].add(uid)
+            else:
+                self._state_members[state].discard(uid)
+
+    def _touch(self, rec: UserRecord):
+        rec.touch()
+        with self._lock:
+            self._last_updated = rec.updated_at
+            self._snapshot_dirty.add(rec.user_id)
+            self._save_dirty.add(rec.user_id)
+
+    def _count_messages(self, delta: int):
+        with self._lock:
+            self._message_count += delta
+
+    def _forget_user(self, uid: str, rec: UserRecord):
+        with self._lock:
+            self._snapshot_dirty.add(uid)
+            self._save_dirty.add(uid)
+            self._message_count -= len(rec.history)
+            i = bisect_right(self._user_ids, uid) - 1
+            if i >= 0 and self._user_ids[i] == uid:
+                del self._user_ids[i]
+            for members in self._state_members.values():
+                members.discard(uid)
+
     def stats(self) -> Dict[str, Any]:
+        self._maybe_sweep()
         return {
             "total_users": len(self._records),
-            "total_messages": sum(len(r.history) for r in self._records.values()),
-            "last_updated": max((r.updated_at for r in self._records.values()), default="N/A"),
+            "total_messages": self._message_count,
+            "last_updated": self._last_updated or "N/A",
+            "states": {state: len(members) for state, members in self._state_members.items()},
+        }
+
+    def list_users(self, cursor: Optional[str] = None, limit: int = 100, state: Optional[str] = None) -> Dict[str, Any]:
+        """Page through user ids in sorted order; pass back ``next_cursor``
+        to get the following page. ``state`` filters by STATE_FLAGS name."""
+        with self._lock:
+            if state is not None:
+                ids = sorted(self._state_members.get(state, ()))
+            else:
+                ids = self._user_ids
+            start = bisect_right(ids, cursor) if cursor else 0
+            page = ids[start:start + limit]
+            has_more = start + limit < len(ids)
+        return {
+            "user_ids": page,
+            "next_cursor": page[-1] if page and has_more else None,
         }
 
+    @staticmethod
+    def _dumps(view: Dict[str, Any]) -> str:
+        return json.dumps(view, ensure_ascii=False)
+
     def _save(self):
-        try:
-            _ensure_dir(self.path)
-            data = {uid: r.to_dict() for uid, r in self._records.items()}
-            _atomic_write(self.path, json.dumps(data, ensure_ascii=False, indent=2))
-        except Exception as e:
-            print(f"[MemoryStore] Failed to save: {e}")
+        """Request persistence. Inside a user write section the write is
+        deferred until the thread leaves its outermost section."""
+        if getattr(self._local, "depth", 0) > 0:
+            self._local.save_requested = True
+            return
+        self._persist()
+
+    def _persist(self):
+        with self._io_lock:
+            with self._lock:
+                dirty, self._save_dirty = self._save_dirty, set()
+            if not dirty:
+                return
+
+            # Snapshot each dirty record under its own stripe, one at a time
+            views: Dict[str, Optional[Dict[str, Any]]] = {}
+            for uid in dirty:
+                with self._read_lock(uid):
+                    rec = self._records.get(uid)
+                    views[uid] = rec.to_dict() if rec is not None else None
+
+            # Serialize and write with no user lock held; unchanged users
+            # reuse their cached JSON fragment
+            try:
+                for uid, view in views.items():
+                    if view is None:
+                        self._fragments.pop(uid, None)
+                    else:
+                        self._fragments[uid] = self._dumps(view)
+                body = ",\n".join(f"{json.dumps(uid, ensure_ascii=False)}: {frag}" for uid, frag in self._fragments.items())
+                _ensure_dir(self.path)
+                _atomic_write(self.path, "{" + body + "}")
+            except Exception as e:
+                with self._lock:
+                    self._save_dirty |= dirty
+                print(f"[MemoryStore] Failed to save: {e}")
 
     def _get_or_create(self, uid: str) -> UserRecord:
         with self._lock:
             if uid not in self._records:
-                self._records[uid] = UserRecord(uid)
+                self._records[uid] = UserRecord(uid, self.max_history)
+                insort(self._user_ids, uid)
             return self._records[uid]
         
-    def _get_user_lock(self, uid: str) -> threading.RLock:
-        if uid not in self._user_locks:
-            self._user_locks[uid] = threading.RLock()
+    def _stripe(self, uid: str) -> _StripeLock:
+        return self._stripes[hash(uid) % len(self._stripes)]
+
+    def _get_user_lock(self, uid: str) -> _WriteGuard:
         if self.debug:
             print(f"[MemoryStore] Lock acquired for user: {uid}")
-        return self._user_locks[uid]
+        return _WriteGuard(self, self._stripe(uid))
+
+    def _read_lock(self, uid: str) -> _ReadGuard:
+        return _ReadGuard(self._stripe(uid))
+
+    # Search index maintenance
+    def _index_record(self, rec: UserRecord):
+        self._index.add_text(rec.user_id, rec.product)
+        for s in rec.summary_context:
+            self._index.add_text(rec.user_id, s)
+        for _, _, text, _ in rec.history.raw():
+            self._index.add_text(rec.user_id, text)
+
+    def _reindex_user(self, rec: UserRecord):
+        self._index.remove_user(rec.user_id)
+        self._index_record(rec)
+
+    def _rebuild_index(self):
+        self._index.clear()
+        for rec in self._records.values():
+            self._index_record(rec)
+
+    def _push_history(self, rec: UserRecord, role: str, text: str, ts: float, meta: Optional[Dict[str, Any]] = None):
+        evicted = rec.history.append(role, text, ts, meta)
+        self._index.add_text(rec.user_id, text)
+        if evicted is not None:
+            self._index.remove_text(rec.user_id, evicted[2])
+        else:
+            self._count_messages(1)
 
     def get(self, uid: str) -> Dict[str, Any]:
-        return self._get_or_create(uid).to_dict()
+        rec = self._get_or_create(uid)
+        with self._read_lock(uid):
+            return rec.to_dict()
 
     def update(self, uid: str, patch: Dict[str, Any]) -> Dict[str, Any]:
         rec = self._get_or_create(uid)
@@ -155,16 +617,19 @@ class MemoryStore:
                 if k == "history":
                     for h in v or []:
                         if isinstance(h, dict) and "role" in h and "text" in h:
-                            entry = {
-                                "role": h["role"],
-                                "text": h["text"],
-                                "ts": h.get("ts") or _now_iso(),
-                            }
-                            rec.history.append(entry)
-                    rec.history = rec.history[-self.max_history:]
+                            self._push_history(rec, h["role"], h["text"], _iso_to_epoch(h.get("ts")), h.get("meta"))
+                elif k == "product":
+                    self._index.replace_text(uid, rec.product, v)
+                    rec.product = v
+                elif k == "summary_context":
+                    rec.summary_context = list(v or [])
+                    self._reindex_user(rec)
+                elif k == "flags":
+                    rec.flags = dict(v or {})
+                    self._refresh_states(rec)
                 elif hasattr(rec, k):
                     setattr(rec, k, v)
-            rec.touch()
+            self._touch(rec)
             if self.autosave:
                 self._save()
             return rec.to_dict()
@@ -195,75 +660,79 @@ class MemoryStore:
                     print(f"❌ Backup failed: {e}")
                 
                 rec.regenerate_token()
-                del self._records[uid]
+                with self._lock:
+                    del self._records[uid]
+                self._index.remove_user(uid)
+                self._forget_user(uid, rec)
                 self._save()
 
     def reset_all(self):
         with self._lock:
+            self._snapshot_dirty.update(self._records)
+            self._save_dirty.update(self._records)
             self._records.clear()
-            self._save()
+            self._index.clear()
+            self._rebuild_stats()
+        self._save()
 
     # Section 2 — History Management
     def append_history(self, uid: str, role: str, text: str, meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         rec = self._get_or_create(uid)
-        entry = {
-            "role": role,
-            "text": (text or "").strip(),
-            "ts": _now_iso(),
-        }
-        if meta:
-            entry["meta"] = dict(meta)
+        clean = (text or "").strip()
 
         with self._get_user_lock(uid):
-            rec.history.append(entry)
-            rec.history = rec.history[-self.max_history:]
+            self._push_history(rec, role, clean, time.time(), dict(meta) if meta else None)
 
             if role == "user":
                 rec.last_answer = (text or "").strip()
 
-            rec.touch()
+            self._touch(rec)
             if self.autosave:
                 self._save()
             return rec.to_dict()
 
     def get_history(self, uid: str) -> List[Dict[str, str]]:
-        return list(self._get_or_create(uid).history)
+        rec = self._get_or_create(uid)
+        with self._read_lock(uid):
+            return rec.history.to_list()
 
     def get_chat_context(self, uid: str, n: int = 30) -> str:
         rec = self._get_or_create(uid)
-        if not rec.history:
-            return "(belum ada percakapan)"
-        logs = rec.history[-n:]
-        return "\n".join(
-            f"[{h.get('ts')}] {h.get('role','user').capitalize()}: {h.get('text','').strip()}"
-            for h in logs
-        )
+        with self._read_lock(uid):
+            if not rec.history:
+                return "(belum ada percakapan)"
+            return "\n".join(
+                f"[{_epoch_to_iso(ts)}] {role.capitalize()}: {text.strip()}"
+                for role, ts, text in rec.history.iter_entries(n)
+            )
 
     def truncate_history(self, uid: str, keep_last: int = 5) -> Dict[str, Any]:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
-            rec.history = rec.history[-keep_last:]
-            rec.touch()
+            before = len(rec.history)
+            rec.history.truncate(keep_last)
+            self._count_messages(len(rec.history) - before)
+            self._reindex_user(rec)
+            self._touch(rec)
             self._save()
             return rec.to_dict()
 
     def export_chat_history(self, uid: str, n: int = 50) -> List[Dict[str, Any]]:
         rec = self._get_or_create(uid)
-        logs = rec.history[-n:]
-        return [
-            {
-                "timestamp": h.get("ts"),
-                "role": h.get("role"),
-                "text": h.get("text"),
-                "user_id": uid,
-                "session_id": rec.created_at,
-            }
-            for h in logs
-        ]
+        with self._read_lock(uid):
+            return [
+                {
+                    "timestamp": _epoch_to_iso(ts),
+                    "role": role,
+                    "text": text,
+                    "user_id": uid,
+                    "session_id": rec.created_at,
+                }
+                for role, ts, text in rec.history.iter_entries(n)
+            ]
     
     def flush_history(self, uid: str):
-        with self._lock:
-            self._save()
+        self._save()
 
     # Section 3 — Context / Summary
     def add_context_entry(self, uid: str, text: str, max_items: int = 15) -> Dict[str, Any]:
@@ -274,23 +743,48 @@ class MemoryStore:
         with self._get_user_lock(uid):
             if s not in rec.summary_context:
                 rec.summary_context.append(s)
-            rec.summary_context = rec.summary_context[-max_items:]
-            rec.touch()
+                self._index.add_text(uid, s)
+            if len(rec.summary_context) > max_items:
+                for old in rec.summary_context[:-max_items]:
+                    self._index.remove_text(uid, old)
+                rec.summary_context = rec.summary_context[-max_items:]
+            self._touch(rec)
             if self.autosave:
                 self._save()
-            self.ensure_product_from_text(uid, s)
+        # Outside the stripe: ensure_product_from_text takes its own locks
+        self.ensure_product_from_text(uid, s)
+        with self._read_lock(uid):
             return rec.to_dict()
 
     # Section 4 — Identity / Flags / State
-    def set_flag(self, uid: str, key: str, value: Any) -> Dict[str, Any]:
+    def set_flag(self, uid: str, key: str, value: Any, ttl: Optional[float] = None) -> Dict[str, Any]:
+        """Set a flag. With ``ttl`` (seconds) the flag expires lazily on read
+        and is dropped by the periodic timer-wheel sweep."""
         rec = self._get_or_create(uid)
+        if ttl is not None:
+            expires_at = time.time() + ttl
+            with self._get_user_lock(uid):
+                rec.ttl_flags[key] = (value, expires_at)
+                rec.flags.pop(key, None)
+                with self._lock:
+                    self._wheel.schedule(uid, key, expires_at)
+                self._track_state(uid, key, bool(value))
+                self._touch(rec)
+                if self.autosave:
+                    self._save()
+                if self.debug:
+                    print(f"[MemoryStore] set_flag → {uid} | {key} = {value} (ttl={ttl}s)")
+                return rec.to_dict()
+
         with self._get_user_lock(uid):
+            rec.ttl_flags.pop(key, None)
             rec.flags[key] = value
+            self._track_state(uid, key, bool(value))
 
             if self.debug:
                 print(f"[MemoryStore] set_flag → {uid} | {key} = {value}")
 
-            rec.touch()
+            self._touch(rec)
             if self.autosave:
                 self._save()
             return rec.to_dict()
@@ -298,21 +792,81 @@ class MemoryStore:
     def clear_flag(self, uid: str, key: str) -> Dict[str, Any]:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
-            if key in rec.flags:
-                del rec.flags[key]
-            rec.touch()
+            rec.ttl_flags.pop(key, None)
+            self._track_state(uid, key, False)
+            if key not in rec.flags:
+                return rec.to_dict()
+            del rec.flags[key]
+            self._touch(rec)
             if self.autosave:
                 self._save()
             return rec.to_dict()
 
     def get_flag(self, uid: str, key: str, default: Any = None) -> Any:
-        return self._get_or_create(uid).flags.get(key, default)
+        rec = self._get_or_create(uid)
+        with self._read_lock(uid):
+            item = rec.ttl_flags.get(key)
+            if item is None:
+                return rec.flags.get(key, default)
+            if item[1] > time.time():
+                return item[0]
+        # Expired: purging mutates the record, so it needs the write lock
+        with self._get_user_lock(uid):
+            item = rec.ttl_flags.get(key)
+            if item is not None and item[1] <= time.time():
+                rec.ttl_flags.pop(key, None)
+                self._track_state(uid, key, False)
+        return default
+
+    def flag_ttl(self, uid: str, key: str) -> Optional[float]:
+        """Seconds left before a TTL flag expires, or None if it is not set."""
+        rec = self._get_or_create(uid)
+        with self._read_lock(uid):
+            item = rec.ttl_flags.get(key)
+        if item is None:
+            return None
+        remaining = item[1] - time.time()
+        return remaining if remaining > 0 else None
+
+    def sweep_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            self._last_sweep = now
+            due = self._wheel.advance(now)
+        removed = 0
+        for uid, key, expires_at in due:
+            rec = self._records.get(uid)
+            if rec is None:
+                continue
+            with self._get_user_lock(uid):
+                item = rec.ttl_flags.get(key)
+                if item is None or item[1] > now:
+                    continue
+                rec.ttl_flags.pop(key, None)
+                self._track_state(uid, key, False)
+            removed += 1
+        return removed
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep >= self.ttl_sweep_interval:
+            self.sweep_expired()
+
+    def _run_sweeper(self):
+        while not self._sweeper_stop.wait(self.ttl_sweep_interval):
+            try:
+                self.sweep_expired()
+            except Exception as e:
+                print(f"[MemoryStore] TTL sweep failed: {e}")
+
+    def close(self):
+        """Stop the background TTL sweeper."""
+        self._sweeper_stop.set()
 
     def set_name(self, uid: str, name: str) -> Dict[str, Any]:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
             rec.name = name.strip().title()
-            rec.touch()
+            self._touch(rec)
             self._save()
             return rec.to_dict()
 
@@ -320,15 +874,16 @@ class MemoryStore:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
             rec.gender = gender.lower()
-            rec.touch()
+            self._touch(rec)
             self._save()
             return rec.to_dict()
 
     def set_product(self, uid: str, product: str) -> Dict[str, Any]:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
+            self._index.replace_text(uid, rec.product, product.strip())
             rec.product = product.strip()
-            rec.touch()
+            self._touch(rec)
             self._save()
             return rec.to_dict()
 
@@ -336,31 +891,34 @@ class MemoryStore:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
             rec.last_step = step
-            rec.touch()
+            self._touch(rec)
             self._save()
             return rec.to_dict()
 
     def get_identity(self, uid: str) -> Dict[str, Any]:
         rec = self._get_or_create(uid)
-        return {
-            "name": rec.name,
-            "gender": rec.gender,
-            "product": rec.product,
-            "address": rec.address,
-        }
+        with self._read_lock(uid):
+            return {
+                "name": rec.name,
+                "gender": rec.gender,
+                "product": rec.product,
+                "address": rec.address,
+            }
 
     # Section 5 — Slots
     def get_slots(self, uid: str) -> Dict[str, Any]:
         return self._get_or_create(uid).slots
 
     def get_slot(self, uid: str, key: str, default: Any = None) -> Any:
-        return self._get_or_create(uid).slots.get(key, default)
+        rec = self._get_or_create(uid)
+        with self._read_lock(uid):
+            return rec.slots.get(key, default)
 
     def set_slot(self, uid: str, key: str, value: Any) -> Dict[str, Any]:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
             rec.slots[key] = value
-            rec.touch()
+            self._touch(rec)
             self._save()
             return rec.to_dict()
 
@@ -368,7 +926,7 @@ class MemoryStore:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
             rec.slots.update(new_slots)
-            rec.touch()
+            self._touch(rec)
             self._save()
             return rec.to_dict()
 
@@ -376,7 +934,7 @@ class MemoryStore:
         rec = self._get_or_create(uid)
         with self._get_user_lock(uid):
             rec.slots.clear()
-            rec.touch()
+            self._touch(rec)
             self._save()
             return rec.to_dict()
 
@@ -408,6 +966,7 @@ class MemoryStore:
 
         with self._get_user_lock(uid):
             if found_product:
+                self._index.replace_text(uid, rec.product, found_product)
                 rec.product = found_product
             if found_serials:
                 if rec.serial:
@@ -416,18 +975,18 @@ class MemoryStore:
                     rec.serial = ", ".join(sorted(merged))
                 else:
                     rec.serial = ", ".join(found_serials)
-            rec.touch()
+            self._touch(rec)
             if self.autosave:
                 self._save()
 
     # Section 6 — Retrieve Last Bot Message
     def get_last_bot_message(self, uid: str) -> Optional[str]:
         rec = self._get_or_create(uid)
-        if not rec.history:
-            return None
-        for h in reversed(rec.history):
-            if h.get("role") == "assistant" and h.get("text"):
-                return h.get("text")
+        assistant = _role_code("assistant")
+        with self._read_lock(uid):
+            for role, _, text, _ in rec.history.raw_reversed():
+                if role == assistant and text:
+                    return text
         return None
     
     def get_last_user_answer(self, uid: str) -> Optional[str]:
@@ -440,21 +999,100 @@ class MemoryStore:
         with self._get_user_lock(uid):
             old_token = rec.session_token
             rec.session_token = secrets.token_hex(8)
-            rec.touch()
+            self._touch(rec)
             if self.autosave:
                 self._save()
             print(f"[MemoryStore] Session token refreshed for {uid}: {old_token} → {rec.session_token}")
             return rec.session_token
 
-    # Section 7 — Search
+    # Section 7 — Snapshot support
+    def mark_snapshot_dirty(self, since: Optional[str] = None, known: Optional[Iterable[str]] = None):
+        """Queue users for the next snapshot after a restart: everyone when
+        ``since`` is None, otherwise users updated after ``since`` plus ids
+        that differ from ``known`` (the latest snapshot's user ids)."""
+        with self._lock:
+            if since is None:
+                self._snapshot_dirty.update(self._records)
+                return
+            cutoff = _parse_iso(since)
+            for uid, rec in self._records.items():
+                updated = _parse_iso(rec.updated_at)
+                if cutoff is None or updated is None or updated > cutoff:
+                    self._snapshot_dirty.add(uid)
+            if known is not None:
+                known = set(known)
+                self._snapshot_dirty.update(known.symmetric_difference(self._records))
+
+    def requeue_snapshot_dirty(self, uids: Iterable[str]):
+        """Put back ids drained by take_snapshot_dirty when the snapshot failed."""
+        with self._lock:
+            self._snapshot_dirty.update(uids)
+
+    def take_snapshot_dirty(self) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """Drain the set of users changed since the last call. Returns dict
+        views of the changed records that still exist and the removed ids."""
+        with self._lock:
+            dirty, self._snapshot_dirty = self._snapshot_dirty, set()
+        changed: Dict[str, Dict[str, Any]] = {}
+        removed: List[str] = []
+        for uid in dirty:
+            rec = self._records.get(uid)
+            if rec is None:
+                removed.append(uid)
+                continue
+            with self._read_lock(uid):
+                changed[uid] = rec.to_dict()
+        return changed, removed
+
+    def restore_records(self, records: Dict[str, Dict[str, Any]], replace_all: bool = False):
+        """Overwrite records from snapshot data. Existing UserRecord objects
+        are updated in place and only the restored users are reindexed."""
+        # Sort out new vs existing users under self._lock, but overwrite
+        # existing records only after releasing it (stripe before _lock)
+        added: List[UserRecord] = []
+        existing: List[Tuple[UserRecord, UserRecord]] = []
+        with self._lock:
+            if replace_all:
+                for uid in [uid for uid in self._records if uid not in records]:
+                    rec = self._records.pop(uid)
+                    self._index.remove_user(uid)
+                    self._forget_user(uid, rec)
+            for uid, v in records.items():
+                restored = self._record_from_dict(uid, v)
+                rec = self._records.get(uid)
+                if rec is None:
+                    self._records[uid] = restored
+                    insort(self._user_ids, uid)
+                    self._message_count += len(restored.history)
+                    added.append(restored)
+                else:
+                    existing.append((rec, restored))
+
+        for rec, restored in existing:
+            with self._get_user_lock(rec.user_id):
+                self._count_messages(len(restored.history) - len(rec.history))
+                for slot in UserRecord.__slots__:
+                    setattr(rec, slot, getattr(restored, slot))
+                self._reindex_user(rec)
+                self._refresh_states(rec)
+        for rec in added:
+            with self._get_user_lock(rec.user_id):
+                self._reindex_user(rec)
+                self._refresh_states(rec)
+        with self._lock:
+            self._snapshot_dirty.update(records)
+            self._save_dirty.update(records)
+        self._save()
+
+    # Section 8 — Search
+    def query(self, q: str, mode: str = "and", prefix: bool = False, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """Token query over product, summary_context and history text.
+
+        Terms are whitespace separated; a trailing ``*`` on a term (or
+        ``prefix=True``) matches by token prefix. Returns a page of user ids.
+        """
+        return self._index.query((q or "").split(), mode=mode, prefix=prefix, offset=offset, limit=limit)
+
     def search(self, keyword: str) -> List[Dict[str, Any]]:
-        q = keyword.lower().strip()
-        results = []
-        for rec in self._records.values():
-            if any([
-                q in (rec.product or "").lower(),
-                any(q in s.lower() for s in rec.summary_context),
-                any(q in (h.get("text", "").lower()) for h in rec.history),
-            ]):
-                results.append(rec.to_dict())
-        return results
\ No newline at end of file
+        page = self.query(keyword, prefix=True, limit=0)
+        return [self._records[uid].to_dict() for uid in page["user_ids"] if uid in self._records]
@@ -0,0 +1,126 @@
+import os, json, gzip, hashlib, threading
+from typing import Any, Dict, List, Optional, Set
+
+PROMPT_STORE_DIR = os.path.join("data", "storage", "prompts")
+
+class PromptStore:
+    """Content-addressed store for static prompt text.
+
+    Each distinct text is written once as ``objects/<aa>/<sha256>.txt.gz``;
+    LLM log records refer to it by digest instead of repeating it. Only
+    PromptTemplate texts are meant to go in here, never per-call text.
+    """
+
+    MAX_MEMO = 1024
+
+    def __init__(self, root: str = PROMPT_STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self._lock = threading.Lock()
+        self._known: Set[str] = set()
+        self._digests: Dict[str, str] = {}
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.txt.gz")
+
+    @staticmethod
+    def digest_of(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def put(self, text: str) -> str:
+        digest = self._digests.get(text)
+        if digest is not None:
+            return digest
+        digest = self.digest_of(text)
+        with self._lock:
+            if digest not in self._known:
+                if len(self._known) >= self.MAX_MEMO:
+                    # Only saves an exists() check; start over rather than grow
+                    self._known.clear()
+                path = self._object_path(digest)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp = f"{path}.tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(gzip.compress(text.encode("utf-8"), compresslevel=6))
+                    os.replace(tmp, path)
+                self._known.add(digest)
+            # Static texts are few; bound the memo in case a caller passes dynamic ones
+            if len(self._digests) < self.MAX_MEMO:
+                self._digests[text] = digest
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        try:
+            with open(self._object_path(digest), "rb") as f:
+                return gzip.decompress(f.read()).decode("utf-8")
+        except OSError:
+            return None
+
+class PromptTemplate:
+    """Static prompt text with ``str.format`` placeholders for the per-call parts.
+
+    The digest is computed at import and the text is written to the store
+    by ``register_templates()`` at startup, so logging a call does no I/O.
+    """
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        self.digest = PromptStore.digest_of(text)
+        _TEMPLATES.append(self)
+
+    def render(self, **variables: Any) -> str:
+        return self.text.format(**variables)
+
+def reconstruct(record: Dict[str, Any], store: Optional["PromptStore"] = None) -> Dict[str, Any]:
+    """Return a copy of an LLM log record with full ``system`` and ``prompt`` text
+    rebuilt from ``system_ref`` + ``system_vars`` / ``prompt_ref`` + ``prompt_vars``."""
+    store = store or get_prompt_store()
+    out = dict(record)
+    if "system" not in out and out.get("system_ref"):
+        system = store.get(out["system_ref"])
+        if system is not None and out.get("system_vars"):
+            try:
+                system = system.format(**out["system_vars"])
+            except (KeyError, IndexError, ValueError) as e:
+                system = None
+                out["reconstruct_error"] = f"Template variables do not match: {e}"
+        out["system"] = system
+    if "prompt" not in out and out.get("prompt_ref"):
+        template = store.get(out["prompt_ref"])
+        if template is None:
+            out["prompt"] = None
+        else:
+            try:
+                out["prompt"] = template.format(**(out.get("prompt_vars") or {}))
+            except (KeyError, IndexError, ValueError) as e:
+                out["prompt"] = None
+                out["reconstruct_error"] = f"Template variables do not match: {e}"
+    return out
+
+_TEMPLATES: List[PromptTemplate] = []
+
+def register_templates(store: Optional[PromptStore] = None) -> int:
+    """Write every PromptTemplate defined so far to the store (once per text)."""
+    store = store or get_prompt_store()
+    for template in _TEMPLATES:
+        store.put(template.text)
+    return len(_TEMPLATES)
+
+_PROMPT_STORE_SINGLETON: Optional[PromptStore] = None
+
+def get_prompt_store() -> PromptStore:
+    global _PROMPT_STORE_SINGLETON
+    if _PROMPT_STORE_SINGLETON is None:
+        _PROMPT_STORE_SINGLETON = PromptStore()
+    return _PROMPT_STORE_SINGLETON
+
+if __name__ == "__main__":
+    import sys
+    from .llm_logger import iter_llm_records
+
+    # python -m src.convo.prompt_store data/storage/logs/llm-YYYY-MM-DD.jsonl[.gz]
+    for path in sys.argv[1:]:
+        for record in iter_llm_records(path):
+            print(json.dumps(reconstruct(record), ensure_ascii=False))
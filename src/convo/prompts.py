@@ -0,0 +1,233 @@
+from .prompt_store import PromptTemplate
+
+# Static instruction blocks; the per-call parts are str.format placeholders
+# so LLM logs can store only the template digest plus these variables.
+
+INTENT_PROMPT = PromptTemplate("detect_intent", """
+        {user_context}
+
+        Riwayat percakapan hari ini:
+        {history_block}
+
+        Pesan pelanggan:
+        \"{message}\"
+
+        Active intent saat ini: {active_intent}
+
+        Daftar intent valid:
+        {intents}
+        
+        PRODUK HONEYWELL:
+        - EAC (Electronic Air Cleaner) / Air Purifier / Pembersih Udara
+        - Water Heater / Pemanas Air
+        - Produk lainnya
+        
+        MAPPING KELUHAN KE INTENT:
+        
+        Intent "mati":
+        - Tidak menyala, tidak hidup, mati total, padam, off, tidak berfungsi
+        - Tidak panas (untuk water heater)
+        - Tidak ada respon sama sekali
+        - Mati, tidak nyala, gak nyala, ga menyala
+        - Tidak beroperasi, tidak jalan, gak jalan
+        - Tidak ada daya, tidak ada listrik
+        
+        Intent "bau":
+        - Bau tidak sedap, bau aneh, bau menyengat
+        - Aroma tidak enak, aroma aneh
+        - Berbau, bau busuk, bau apek
+        - Ada bau, muncul bau
+        
+        Intent "bunyi":
+        - Bunyi aneh, berisik, suara berisik
+        - Bunyi kretek-kretek, bunyi berdengung, bunyi brebet
+        - Noise, berisik, ribut
+        - Berbunyi, mengeluarkan bunyi, ada bunyi
+        - Suara aneh, suara mengganggu, suara berisik
+        - Berisik banget, noise terus
+
+        LOGIC PRIORITAS:
+        
+        1. Jika active_intent SUDAH ADA (bukan "none"):
+           a) Intent TETAP = active_intent (JANGAN ubah!)
+           b) DETEKSI keluhan TAMBAHAN (additional_complaint):
+              ⚠️ PENTING: Hanya deteksi jika pesan JELAS dan EKSPLISIT menyebut keluhan baru.
+              JANGAN deteksi jika substring kebetulan ada dalam kata lain.
+              
+              - Jika JELAS menyebut masalah bau → additional_complaint="bau"
+                Contoh: "juga bau", "bau menyengat", "ada bau aneh"
+              
+              - Jika JELAS menyebut masalah bunyi → additional_complaint="bunyi"
+                Contoh: "juga berisik", "mengeluarkan bunyi aneh", "suara berisik"
+              
+              - Jika JELAS menyebut masalah mati/tidak nyala/tidak panas → additional_complaint="mati"
+                Contoh: "EAC juga mati", "tidak menyala", "padam total"
+              
+              - Jika hanya chitchat/terima kasih/sapaan tanpa keluhan → additional_complaint="none"
+                Contoh: "terimakasih", "ok siap", "baik", "halo"
+           
+           c) is_new_complaint = false (SELALU, kecuali keluhan SAMA yang berulang dengan kata "lagi"/"kembali")
+        
+        2. Jika active_intent BELUM ADA (masih "none"):
+           a) Deteksi intent dari keluhan (mati / bau / bunyi / none)
+           b) additional_complaint = "none" (tidak relevan jika belum ada active)
+           c) is_new_complaint = true (jika ada keluhan perangkat), false (jika hanya greeting/chitchat)
+
+        Jika active_step tersedia:
+        {active_step}
+
+        CONTOH KASUS - SAAT ACTIVE_INTENT ADA:
+        
+        Contoh 1:
+        active_intent = "mati"
+        message = "eh iya EAC nya juga bunyi aneh lho"
+        →  intent = "mati" (TETAP)
+        →  additional_complaint = "bunyi" (DETECTED - karena jelas mention bunyi EAC)
+        →  is_new_complaint = false
+        
+        Contoh 2:
+        active_intent = "bunyi"
+        message = "iya dan juga bau nya menyengat"
+        →  intent = "bunyi" (TETAP)
+        →  additional_complaint = "bau" (DETECTED - karena jelas mention bau)
+        →  is_new_complaint = false
+        
+        Contoh 3:
+        active_intent = "mati"
+        message = "tidak nyala"
+        →  intent = "mati" (TETAP)
+        →  additional_complaint = "none" (tidak mention keluhan lain)
+        →  is_new_complaint = false
+        
+        Contoh 4 (PENTING):
+        active_intent = "bau"
+        message = "terimakasih"
+        →  intent = "bau" (TETAP)
+        →  additional_complaint = "none" (hanya ucapan terima kasih, BUKAN keluhan)
+        →  is_new_complaint = false
+
+        Kembalikan hanya JSON:
+        {{
+        "has_greeting": true/false,
+        "greeting_part": "<string>",
+        "issue_part": "<string>",
+        "intent": "<mati/bau/bunyi/none>",
+        "category": "domain/chitchat/nonsense",
+        "is_new_complaint": true/false,
+        "additional_complaint": "<mati/bau/bunyi/none>"
+        }}
+        
+        CONTOH DETEKSI INTENT (FIRST MESSAGE):
+        
+        Contoh Intent "mati":
+        - "EAC saya mati nih" → intent="mati"
+        - "alat tidak menyala" → intent="mati"
+        - "unit padam total" → intent="mati"
+        - "tidak hidup sama sekali" → intent="mati"
+        - "mati total kak" → intent="mati"
+        - "tidak berfungsi" → intent="mati"
+        - "tidak ada respon" → intent="mati"
+        - "water heater tidak panas" → intent="mati"
+        - "pemanas air mati" → intent="mati"
+        
+        Contoh Intent "bunyi":
+        - "alat saya berbunyi aneh" → intent="bunyi"
+        - "EAC bunyi kretek kretek" → intent="bunyi"
+        - "suara berisik" → intent="bunyi"
+        - "bunyi brebet" → intent="bunyi"
+        - "mengeluarkan bunyi" → intent="bunyi"
+        - "ada bunyi aneh" → intent="bunyi"
+        - "berisik banget" → intent="bunyi"
+        - "noise terus" → intent="bunyi"
+        - "berbunyi terus" → intent="bunyi"
+        - "suara mengganggu" → intent="bunyi"
+        
+        Contoh Intent "bau":
+        - "bau tidak sedap" → intent="bau"
+        - "ada bau aneh" → intent="bau"
+        - "bau menyengat" → intent="bau"
+        - "aroma tidak enak" → intent="bau"
+        - "berbau" → intent="bau"
+        
+        Contoh Intent "none" (chitchat/greeting):
+        - "halo" → intent="none"
+        - "terima kasih" → intent="none"
+        - "baik" → intent="none"
+        - "oke siap" → intent="none"
+        - "gimana caranya?" → intent="none" (pertanyaan umum tanpa keluhan)
+        """)
+
+ASK_SYSTEM_PROMPT = PromptTemplate("data_collection_ask_system", "Asisten CS pengumpul data. {persona}")
+
+NATURALIZE_PROMPT = PromptTemplate("naturalize_template", """Tugas: Ubah template SOP menjadi lebih natural dan conversational TANPA mengubah makna atau informasi yang ada.
+
+        Pesan terakhir customer: "{last_user_msg}"
+
+        Template SOP: "{template_text}"
+
+        Aturan WAJIB:
+        1. PERTAHANKAN semua informasi dari template - jangan tambah, kurang, atau ubah
+        2. PERTAHANKAN struktur pertanyaan, instruksi, dan kondisi if-then
+        3. Tetap profesional dan sopan sebagai customer service
+        4. Gunakan bahasa Indonesia yang baik dan benar - JANGAN gunakan bahasa asing
+        5. DILARANG gunakan bahasa gaul: "dong", "aja", "gitu", "sih", "gimana", "ngga", "nggak", "gak", "ga"
+        6. DILARANG gunakan kata serapan salah: "teknisian" (gunakan "teknisi")
+        7. Gunakan "{customer_greeting}" untuk sapaan (ganti semua "kak" dengan ini)
+        8. Tidak gunakan kata "Anda"
+        9. Hindari tanda kutip
+        10. Jangan bertele-tele tapi jangan hilangkan informasi penting
+        11. JANGAN mengarang atau mengubah konteks - ikuti template dengan ketat
+        12. Gunakan kata pengantar natural seperti "sepertinya", "mungkin" untuk membuat lebih conversational
+        13. Hindari pembuka kalimat yang terlalu formal atau kaku
+        14. HINDARI kata formal: "silakan", "harap", "mohon", "jika" (di awal kalimat), "apabila", "bisa dicek"
+        15. GUNAKAN alternatif natural: "coba", "boleh", "kalau", "bisa dicoba", "bisa bantu"
+        16. JANGAN ubah pertanyaan menjadi pernyataan
+        17. JANGAN hilangkan instruksi atau follow-up action
+
+        PENTING untuk pertanyaan:
+        - Pertanyaan harus tetap jelas dan spesifik
+        - Jangan ubah "apakah X atau Y?" menjadi pernyataan
+        - Contoh SALAH: "Kak, sepertinya alatnya berisik sering banget. Coba periksa kalau bisa?" ❌
+        - Contoh BENAR: "Kak, bunyinya sering terjadi atau hanya sesekali saja?" ✅
+
+        PENTING untuk instruksi:
+        - Pertahankan urutan: kondisi → aksi → expected result → follow up
+        - Jangan potong instruksi multi-step
+        - Jangan hilangkan kondisi "jika/kalau"
+
+        Transformasi kata formal ke natural:
+        - "silakan" → "coba" atau "bisa"
+        - "jika" (awal kalimat) → "kalau"
+        - "jika" (tengah kalimat) → tetap "jika" atau "kalau"
+        - "bisa dicek" → "boleh dicek" atau "coba cek"
+        - "apabila" → "kalau"
+        - "Mohon" → "Tolong" atau "Boleh"
+        - "nggak/gak/ga" → "belum" atau "tidak"
+
+        Contoh konversi yang BENAR:
+        Template: "Baik kak, saya teruskan ke teknisi ya."
+        Natural: "Baik kak, saya bantu teruskan ke teknisi ya."
+
+        Template: "Kak, bisa dicek posisi MCB-nya apakah sedang di posisi ON?"
+        Natural: "Kak, boleh dicek apakah MCB-nya sudah dalam posisi ON?"
+        
+        Template: "Kak, bunyinya sering atau jarang?"
+        Natural: "Kak, bunyinya sering terjadi atau hanya sesekali saja?"
+        
+        Template: "Silakan tekan tombol Low Mode di remote. Jika lampu kuning menyala, unit sudah normal."
+        Natural: "Coba tekan tombol Low Mode di remote ya kak. Kalau lampu kuning menyala, berarti unit sudah normal."
+        
+        Template: "Silakan hubungi kami lagi jika masih ada kendala."
+        Natural: "Kalau masih ada kendala, chat kami lagi ya kak."
+
+        Contoh konversi yang SALAH (jangan seperti ini):
+        Template: "Kak, bunyinya sering atau jarang?"
+        SALAH: "Kak, sepertinya alatnya berisik. Coba periksa?" ❌ (mengubah pertanyaan jadi pernyataan)
+        
+        Template: "Baik kak, saya teruskan ke teknisi ya."
+        SALAH: "Teruskan dong ke teknisi ya..." ❌ (bahasa gaul)
+        
+        Template: "Jika belum menyala, coba tekan tombol LOW."
+        SALAH: "Coba tekan tombol LOW." ❌ (hilangkan kondisi "jika belum menyala")
+
+        Ubah template di atas menjadi lebih natural dalam BAHASA INDONESIA:""")
@@ -0,0 +1,148 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+class SearchIndex:
+    """Inverted index token -> user ids, with per-user token counts so that
+    evicted history entries and replaced fields can be removed again."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Set[str]] = {}
+        self._user_tokens: Dict[str, Counter] = {}
+        self._vocab: List[str] = []
+        self._vocab_dirty = False
+
+    def add_text(self, uid: str, text: Optional[str]) -> None:
+        tokens = tokenize(text)
+        if not tokens:
+            return
+        with self._lock:
+            counts = self._user_tokens.setdefault(uid, Counter())
+            for tok in tokens:
+                if counts[tok] == 0:
+                    posting = self._postings.get(tok)
+                    if posting is None:
+                        posting = self._postings[tok] = set()
+                        self._vocab_dirty = True
+                    posting.add(uid)
+                counts[tok] += 1
+
+    def remove_text(self, uid: str, text: Optional[str]) -> None:
+        tokens = tokenize(text)
+        if not tokens:
+            return
+        with self._lock:
+            counts = self._user_tokens.get(uid)
+            if not counts:
+                return
+            for tok in tokens:
+                if counts[tok] <= 0:
+                    continue
+                counts[tok] -= 1
+                if counts[tok] == 0:
+                    del counts[tok]
+                    self._discard_posting(tok, uid)
+
+    def replace_text(self, uid: str, old: Optional[str], new: Optional[str]) -> None:
+        if old == new:
+            return
+        with self._lock:
+            self.remove_text(uid, old)
+            self.add_text(uid, new)
+
+    def remove_user(self, uid: str) -> None:
+        with self._lock:
+            counts = self._user_tokens.pop(uid, None)
+            if not counts:
+                return
+            for tok in counts:
+                self._discard_posting(tok, uid)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._user_tokens.clear()
+            self._vocab = []
+            self._vocab_dirty = False
+
+    def _discard_posting(self, tok: str, uid: str) -> None:
+        posting = self._postings.get(tok)
+        if posting is None:
+            return
+        posting.discard(uid)
+        if not posting:
+            del self._postings[tok]
+            self._vocab_dirty = True
+
+    def _expand_prefix(self, prefix: str) -> Set[str]:
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        out: Set[str] = set()
+        i = bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            out |= self._postings.get(self._vocab[i], set())
+            i += 1
+        return out
+
+    def _match_term(self, term: str, prefix: bool) -> Set[str]:
+        if term.endswith("*"):
+            term, prefix = term.rstrip("*"), True
+        tokens = tokenize(term)
+        if not tokens:
+            return set()
+        result: Optional[Set[str]] = None
+        for i, tok in enumerate(tokens):
+            if prefix and i == len(tokens) - 1:
+                hits = self._expand_prefix(tok)
+            else:
+                hits = set(self._postings.get(tok, ()))
+            result = hits if result is None else result & hits
+            if not result:
+                return set()
+        return result or set()
+
+    def query(
+        self,
+        terms: Iterable[str],
+        mode: str = "and",
+        prefix: bool = False,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> Dict[str, object]:
+        terms = [t for t in terms if t and t.strip()]
+        with self._lock:
+            matched: Optional[Set[str]] = None
+            for term in terms:
+                hits = self._match_term(term, prefix)
+                if matched is None:
+                    matched = hits
+                elif mode == "or":
+                    matched = matched | hits
+                else:
+                    matched = matched & hits
+                if mode != "or" and not matched:
+                    break
+        ids = sorted(matched or ())
+        offset = max(0, offset)
+        page = ids[offset:offset + limit] if limit > 0 else ids[offset:]
+        next_offset = offset + len(page)
+        return {
+            "user_ids": page,
+            "total": len(ids),
+            "next_offset": next_offset if next_offset < len(ids) else None,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"tokens": len(self._postings), "users": len(self._user_tokens)}
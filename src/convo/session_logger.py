@@ -1,7 +1,9 @@
-import os,json, socket, threading, hashlib
+import os,json, socket, threading, hashlib, random, fnmatch
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
+from .log_writer import BatchedLogWriter
+
 def _sha8(s: str) -> str:
     if not s:
         return ""
@@ -18,11 +20,151 @@ def _today_path(prefix: str = "wa") -> str:
     day = datetime.utcnow().strftime("%Y-%m-%d")
     return os.path.join("data/storage/logs", f"{prefix}-{day}.jsonl")
 
+LEVELS = {"debug": 10, "info": 20, "warn": 30, "error": 40, "off": 100}
+
+# Heuristic probes are debug, branch outcomes info (the default), guard hits warn
+DEFAULT_STAGE_LEVELS = {
+    "smart_wait_*": "debug",
+    "buffer_*": "debug",
+    "skip_*": "debug",
+    "tier1_*": "debug",
+    "tier2_*": "debug",
+    "tier3_*": "debug",
+    "spam_level": "debug",
+    "lock_intent_check": "debug",
+    "clarify_count*": "debug",
+    "intensity_detected": "debug",
+    "bunyi_intensity_skip": "debug",
+    "combined_context": "debug",
+    "session_detection": "debug",
+    "spam_blocked": "warn",
+    "spam_*_limit": "warn",
+    "*_violation": "warn",
+    "*_fallback": "warn",
+    "parse_contradiction_override": "warn",
+    "*error*": "error",
+    "*fail*": "error",
+}
+
+class StageLogPolicy:
+    """Per-stage verbosity and sampling for ``log_stage`` records.
+
+    A stage's level comes from the exact name or the longest matching glob in
+    ``stage_levels``; it is written when that level reaches ``level``, and
+    then kept with probability ``sample_rates[stage]`` (same lookup, default
+    1.0). Decisions are cached per stage name so the hot path is one dict hit.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join("data", "storage", "log_levels.json")
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Optional[float]] = {}
+        self.counts = {"written": 0, "suppressed": 0, "sampled_out": 0}
+        self.level = os.getenv("LOG_STAGE_LEVEL", "info").lower()
+        self.stage_levels: Dict[str, str] = dict(DEFAULT_STAGE_LEVELS)
+        self.sample_rates: Dict[str, float] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self._apply(saved.get("level"), saved.get("stages"), saved.get("sample_rates"))
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _lookup(stage: str, table: Dict[str, Any]) -> Any:
+        if stage in table:
+            return table[stage]
+        best = None
+        for pattern in table:
+            if fnmatch.fnmatchcase(stage, pattern) and (best is None or len(pattern) > len(best)):
+                best = pattern
+        return table[best] if best is not None else None
+
+    def _decide(self, stage: str) -> Optional[float]:
+        stage_level = self._lookup(stage, self.stage_levels) or "info"
+        if LEVELS.get(stage_level, 20) < LEVELS.get(self.level, 20):
+            return None
+        rate = self._lookup(stage, self.sample_rates)
+        return 1.0 if rate is None else float(rate)
+
+    def admit(self, stage: str) -> Optional[float]:
+        """Sample rate the record is written at, or None to drop it."""
+        try:
+            rate = self._cache[stage]
+        except KeyError:
+            rate = self._cache[stage] = self._decide(stage)
+        if rate is None:
+            self.counts["suppressed"] += 1
+            return None
+        if rate < 1.0 and random.random() >= rate:
+            self.counts["sampled_out"] += 1
+            return None
+        self.counts["written"] += 1
+        return rate
+
+    def _apply(self, level, stages, sample_rates):
+        # Validate everything first so a bad entry leaves the policy untouched
+        for name, value in [(None, level)] + list((stages or {}).items()):
+            if value is not None and str(value).lower() not in LEVELS:
+                raise ValueError(f"Unknown level {value!r}{f' for {name}' if name else ''} (use one of {', '.join(LEVELS)})")
+        for pattern, rate in (sample_rates or {}).items():
+            if rate is not None and not 0.0 <= float(rate) <= 1.0:
+                raise ValueError(f"Sample rate for {pattern} must be between 0 and 1")
+
+        if level is not None:
+            self.level = str(level).lower()
+        for pattern, stage_level in (stages or {}).items():
+            if stage_level is None:
+                self.stage_levels.pop(pattern, None)
+            else:
+                self.stage_levels[pattern] = str(stage_level).lower()
+        for pattern, rate in (sample_rates or {}).items():
+            if rate is None:
+                self.sample_rates.pop(pattern, None)
+            else:
+                self.sample_rates[pattern] = float(rate)
+        self._cache = {}
+
+    def configure(self, level: Optional[str] = None, stages: Optional[Dict[str, Optional[str]]] = None,
+                  sample_rates: Optional[Dict[str, Optional[float]]] = None, reset: bool = False) -> Dict[str, Any]:
+        """Update the policy at runtime; a ``None`` value removes that override."""
+        with self._lock:
+            if reset:
+                self.level = os.getenv("LOG_STAGE_LEVEL", "info").lower()
+                self.stage_levels = dict(DEFAULT_STAGE_LEVELS)
+                self.sample_rates = {}
+                self._cache = {}
+            self._apply(level, stages, sample_rates)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"level": self.level, "stages": self.stage_levels, "sample_rates": self.sample_rates}, f, indent=1)
+            os.replace(f"{self.path}.tmp", self.path)
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "level": self.level,
+            "stages": dict(self.stage_levels),
+            "sample_rates": dict(self.sample_rates),
+            "decisions": {stage: rate for stage, rate in self._cache.items()},
+            "counts": dict(self.counts),
+        }
+
+_STAGE_POLICY: Optional[StageLogPolicy] = None
+
+def get_stage_policy() -> StageLogPolicy:
+    global _STAGE_POLICY
+    if _STAGE_POLICY is None:
+        _STAGE_POLICY = StageLogPolicy()
+    return _STAGE_POLICY
+
 class SessionLogger:
     def __init__(self, file_prefix: str = "wa"):
         self.file_prefix = file_prefix
-        self._lock = threading.Lock()
         self.host = socket.gethostname()
+        # Records are serialized and appended by a background writer; 20MB files rotate to -archived-
+        self._writer = BatchedLogWriter(file_prefix, lambda: _today_path(self.file_prefix), max_bytes=20_000_000)
+        self.stage_policy = get_stage_policy()
 
     def _ts(self) -> str:
         return datetime.utcnow().isoformat(timespec="seconds") + "Z"
@@ -30,14 +172,13 @@ class SessionLogger:
     def _write(self, obj: Dict[str, Any]) -> None:
         obj.setdefault("ts", self._ts())
         obj.setdefault("host", self.host)
-        path = _today_path(self.file_prefix)
-        line = json.dumps(obj, ensure_ascii=False)
-        with self._lock:
-            if os.path.exists(path) and os.path.getsize(path) > 20_000_000:  # 20MB limit
-                old = path.replace(".jsonl", f"-archived-{datetime.utcnow().isoformat(timespec='seconds')}.jsonl")
-                os.rename(path, old)
-            with open(path, "a", encoding="utf-8") as f:
-                f.write(line + "\n")
+        self._writer.write(obj)
+
+    def flush(self) -> None:
+        self._writer.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._writer.stats()
 
     def log_in(self, *, jid: str, text: str, chat: str = "dm", raw: Optional[Dict[str, Any]] = None) -> None:
         self._write({"dir": "in", "chat": chat, "jid": jid, "text": text, "raw": raw})
@@ -86,10 +227,18 @@ class SessionLogger:
                   info: Optional[Dict[str, Any]] = None,
                   prompt: Optional[str] = None,
                   response: Optional[str] = None,
-                  chat: str = "dm") -> None:
+                  chat: str = "dm",
+                  sample_rate: Optional[float] = None) -> None:
+        # Callers that already consulted the policy (short_log) pass the rate through
+        if sample_rate is None:
+            sample_rate = self.stage_policy.admit(stage)
+            if sample_rate is None:
+                return
         entry = {
             "dir": "stage", "chat": chat, "jid": jid, "stage": stage,
         }
+        if sample_rate < 1.0:
+            entry["sample_rate"] = sample_rate
         if info:
             entry["info"] = info
 
@@ -1,16 +1,54 @@
 import os
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timezone
 from .ollama_client import OllamaClient
+from .chat_logger import get_chat_logger
+from .summary_store import SummaryStore, SummaryCache
 from src.sync.conversation_sync import ConversationSync
 
+SUMMARY_SYSTEM = "Kamu adalah asisten yang meringkas percakapan customer service untuk produk Electronic Air Cleaner Honeywell."
+
+SUMMARY_FORMAT = """RINGKASAN PERCAKAPAN
+Pelanggan: [nama atau "Belum disebutkan"]
+Topik: [intent/masalah utama]
+
+KRONOLOGI:
+- [step by step singkat]
+
+INFORMASI PENTING:
+- Produk: [tipe produk jika disebutkan]
+- Masalah: [deskripsi masalah]
+- Solusi yang dicoba: [langkah troubleshooting yang sudah dilakukan]
+
+DATA PELANGGAN:
+- Nama: [...]
+- Produk: [...]
+- Alamat: [...]
+
+STATUS & TINDAKAN SELANJUTNYA:
+- Status: [open/pending/resolved]
+- Tindakan: [apa yang perlu dilakukan admin/teknisi]
+"""
+
+# Rough token estimate for the chunker; ~4 characters per token for Indonesian chat text
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
 class ConversationSummarizer:
     def __init__(self):
         self.ollama = OllamaClient()
         self.node_server_url = os.getenv("NODE_SERVER_URL", "https://unproportionably-subsacral-kecia.ngrok-free.dev")
         self.sync_service = ConversationSync()
+        self.summaries = SummaryStore()
+        self.cache = SummaryCache()
+        # Conversations longer than chunk_tokens are summarized map-reduce style
+        self.chunk_tokens = int(os.getenv("SUMMARY_CHUNK_TOKENS", "1500"))
+        self.map_concurrency = max(1, int(os.getenv("SUMMARY_MAP_CONCURRENCY", "3")))
     
     def fetch_conversation_from_node(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
         try:
@@ -30,26 +68,13 @@ class ConversationSummarizer:
             print(f"[SUMMARIZER] Error fetching from node: {e}")
             return None
     
-    def fetch_conversation_from_logs(self, user_id: str, date: Optional[str] = None) -> List[Dict[str, Any]]:
-        if date is None:
-            date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        
-        log_path = os.path.join("data", "storage", "logs", f"chat-{date}.jsonl")
-        messages = []
-        
-        if not os.path.exists(log_path):
-            return messages
-        
-        with open(log_path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    record = json.loads(line.strip())
-                    if record.get("user_id") == user_id:
-                        messages.append(record)
-                except Exception:
-                    continue
-        
-        return messages
+    def fetch_conversation_from_logs(
+        self,
+        user_id: str,
+        date: Optional[str] = None,
+        end_date: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        return list(get_chat_logger().iter_user_records(user_id, start_date=date, end_date=end_date))
     
     def prepare_conversation_text(self, messages: List[Dict[str, Any]]) -> str:
         conversation_lines = []
@@ -74,8 +99,73 @@ class ConversationSummarizer:
         
         return "\n".join(conversation_lines)
     
+    def chunk_conversation_text(self, conversation_text: str, max_tokens: Optional[int] = None) -> List[str]:
+        """Split on turn (line) boundaries into chunks of at most ``max_tokens``.
+        A single turn longer than the budget is cut into pieces on its own."""
+        max_tokens = max_tokens or self.chunk_tokens
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        chunks: List[str] = []
+        current: List[str] = []
+        size = 0
+        for line in conversation_text.split("\n"):
+            pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or [""]
+            for piece in pieces:
+                if current and size + len(piece) + 1 > max_chars:
+                    chunks.append("\n".join(current))
+                    current, size = [], 0
+                current.append(piece)
+                size += len(piece) + 1
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
+    
+    def _map_chunk(self, index: int, total: int, chunk: str) -> str:
+        prompt = f"""Bagian {index} dari {total} sebuah percakapan:
+{chunk}
+
+Catat poin penting bagian ini dalam bentuk poin singkat: nama pelanggan, produk, masalah, langkah troubleshooting yang dicoba, data pelanggan (nama/produk/alamat), dan status terakhir. Jangan menambah informasi yang tidak ada."""
+        try:
+            return self.ollama.generate(SUMMARY_SYSTEM, prompt, temperature=0.2).strip()
+        except Exception as e:
+            print(f"[SUMMARIZER] LLM map error on chunk {index}/{total}: {e}")
+            return ""
+    
+    def _map_chunks(self, chunks: List[str]) -> List[str]:
+        total = len(chunks)
+        with ThreadPoolExecutor(max_workers=min(self.map_concurrency, total)) as pool:
+            partials = list(pool.map(lambda args: self._map_chunk(args[0] + 1, total, args[1]), enumerate(chunks)))
+        return [f"[Bagian {i + 1}]\n{p}" for i, p in enumerate(partials) if p]
+    
+    def condense_conversation_text(self, conversation_text: str) -> str:
+        """Map step: turn a conversation longer than the chunk budget into
+        ordered partial notes, re-mapping until they fit one prompt. If the
+        map calls fail or stop shrinking, the most recent turns that fit are kept."""
+        text = conversation_text
+        while estimate_tokens(text) > self.chunk_tokens:
+            chunks = self.chunk_conversation_text(text)
+            print(f"[SUMMARIZER] Map-reduce: {len(chunks)} chunks (~{estimate_tokens(text)} tokens)")
+            partials = self._map_chunks(chunks)
+            if not partials:
+                print("[SUMMARIZER] All map calls failed; truncating to the latest turns")
+                return self._truncate_to_budget(text)
+            condensed = "\n\n".join(partials)
+            if len(condensed) >= len(text):
+                # The model is not shrinking the input; stop instead of looping
+                print("[SUMMARIZER] Map step is not shrinking the text; truncating to the latest turns")
+                return self._truncate_to_budget(condensed)
+            text = condensed
+        return text
+
+    def _truncate_to_budget(self, text: str) -> str:
+        """Keep the last chunk that fits the budget, cut on a turn boundary."""
+        chunks = self.chunk_conversation_text(text)
+        if len(chunks) <= 1:
+            return text
+        return "[...]\n" + chunks[-1]
+    
     def summarize_with_llm(self, conversation_text: str) -> str:
-        system = "Kamu adalah asisten yang meringkas percakapan customer service untuk produk Electronic Air Cleaner Honeywell."
+        if estimate_tokens(conversation_text) > self.chunk_tokens:
+            return self._reduce_with_llm(self.condense_conversation_text(conversation_text))
         
         prompt = f"""Percakapan:
 {conversation_text}
@@ -91,35 +181,76 @@ Buatkan ringkasan yang mencakup:
 
 Format dalam bahasa Indonesia, ringkas tapi lengkap. Gunakan struktur:
 
-RINGKASAN PERCAKAPAN
-Pelanggan: [nama atau "Belum disebutkan"]
-Topik: [intent/masalah utama]
-
-KRONOLOGI:
-- [step by step singkat]
+{SUMMARY_FORMAT}"""
+        
+        try:
+            response = self.ollama.generate(SUMMARY_SYSTEM, prompt, temperature=0.2)
+            return response.strip()
+        except Exception as e:
+            print(f"[SUMMARIZER] LLM error: {e}")
+            return f"Error generating summary: {str(e)}"
+    
+    def _reduce_with_llm(self, partial_notes: str) -> str:
+        prompt = f"""Catatan per bagian dari satu percakapan (urut dari awal ke akhir):
+{partial_notes}
 
-INFORMASI PENTING:
-- Produk: [tipe produk jika disebutkan]
-- Masalah: [deskripsi masalah]
-- Solusi yang dicoba: [langkah troubleshooting yang sudah dilakukan]
+Gabungkan semua catatan menjadi satu ringkasan percakapan utuh. Kronologi harus urut, data pelanggan dan status diambil dari informasi terakhir.
 
-DATA PELANGGAN:
-- Nama: [...]
-- Produk: [...]
-- Alamat: [...]
+Format dalam bahasa Indonesia, ringkas tapi lengkap. Gunakan struktur:
 
-STATUS & TINDAKAN SELANJUTNYA:
-- Status: [open/pending/resolved]
-- Tindakan: [apa yang perlu dilakukan admin/teknisi]
-"""
+{SUMMARY_FORMAT}"""
         
         try:
-            response = self.ollama.generate(system, prompt, temperature=0.2)
+            response = self.ollama.generate(SUMMARY_SYSTEM, prompt, temperature=0.2)
             return response.strip()
         except Exception as e:
-            print(f"[SUMMARIZER] LLM error: {e}")
+            print(f"[SUMMARIZER] LLM reduce error: {e}")
             return f"Error generating summary: {str(e)}"
     
+    def merge_summary_with_llm(self, previous_summary: str, new_conversation_text: str) -> str:
+        prompt = f"""Ringkasan sebelumnya:
+{previous_summary}
+
+Pesan baru setelah ringkasan di atas:
+{new_conversation_text}
+
+Perbarui ringkasan sebelumnya dengan pesan baru. Pertahankan informasi lama yang masih berlaku, tambahkan kronologi baru di akhir KRONOLOGI, perbarui data pelanggan dan status jika berubah.
+
+Format dalam bahasa Indonesia, ringkas tapi lengkap. Gunakan struktur:
+
+{SUMMARY_FORMAT}"""
+        
+        try:
+            response = self.ollama.generate(SUMMARY_SYSTEM, prompt, temperature=0.2)
+            return response.strip()
+        except Exception as e:
+            print(f"[SUMMARIZER] LLM merge error: {e}")
+            return ""
+    
+    @staticmethod
+    def _watermark(messages: List[Dict[str, Any]], source: str) -> Dict[str, Any]:
+        last = messages[-1]
+        return {
+            "messageId": last.get("messageId"),
+            "timestamp": last.get("timestamp"),
+            "count": len(messages),
+            "source": source,
+        }
+    
+    @staticmethod
+    def _messages_after(messages: List[Dict[str, Any]], watermark: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Messages newer than the watermark, or None if it cannot be located."""
+        message_id = watermark.get("messageId")
+        if message_id is not None:
+            for i in range(len(messages) - 1, -1, -1):
+                if messages[i].get("messageId") == message_id:
+                    return messages[i + 1:]
+            return None
+        ts = watermark.get("timestamp")
+        if ts is not None:
+            return [m for m in messages if m.get("timestamp") is not None and str(m["timestamp"]) > str(ts)]
+        return None
+    
     def send_summary_to_node(self, session_id: str, summary: str) -> bool:
         try:
             endpoint = f"{self.node_server_url}/api/receive-summary"
@@ -144,7 +275,9 @@ STATUS & TINDAKAN SELANJUTNYA:
         messages: Optional[List[Dict[str, Any]]] = None,
         use_local_logs: bool = False,
         send_to_node: bool = False,
-        auto_update: bool = True
+        auto_update: bool = True,
+        incremental: bool = True,
+        force: bool = False
     ) -> Dict[str, Any]:
         
         if messages is None:
@@ -163,14 +296,57 @@ STATUS & TINDAKAN SELANJUTNYA:
                 "session_id": session_id
             }
         
-        conversation_text = self.prepare_conversation_text(messages)
-        summary = self.summarize_with_llm(conversation_text)
+        source = "local_logs" if use_local_logs else ("sync_db" if auto_update else "node_server")
+        
+        content_hash = self.cache.content_hash(messages)
+        cached = None if force else self.cache.get(content_hash)
+        
+        stored = self.summaries.get(session_id) if incremental and not force else None
+        new_messages = None
+        if stored and stored.get("watermark", {}).get("source") == source:
+            new_messages = self._messages_after(messages, stored["watermark"])
+        
+        if cached:
+            mode = "cached"
+            summary = cached["summary"]
+        elif new_messages is not None and not new_messages:
+            mode = "unchanged"
+            summary = stored["summary"]
+        elif new_messages:
+            mode = "incremental"
+            print(f"[SUMMARIZER] Merging {len(new_messages)} new messages into summary for {session_id}")
+            new_text = self.condense_conversation_text(self.prepare_conversation_text(new_messages))
+            summary = self.merge_summary_with_llm(stored["summary"], new_text)
+            if not summary:
+                print(f"[SUMMARIZER] Merge failed for {session_id}; falling back to a full summary")
+                mode = "full"
+                summary = self.summarize_with_llm(self.prepare_conversation_text(messages))
+        else:
+            mode = "full"
+            conversation_text = self.prepare_conversation_text(messages)
+            summary = self.summarize_with_llm(conversation_text)
+        
+        if not summary or summary.startswith("Error generating summary"):
+            # Never hand an empty or error text to Node; keep the last good summary
+            return {
+                "success": False,
+                "error": summary or "Failed to generate summary",
+                "session_id": session_id,
+                "summary": stored["summary"] if stored else None,
+                "message_count": len(messages),
+                "metadata": {"source": source, "mode": mode, "stale": bool(stored)}
+            }
+        
+        if mode not in ("unchanged", "cached"):
+            self.summaries.put(session_id, summary, self._watermark(messages, source), mode)
+            self.cache.put(content_hash, summary, session_id, len(messages))
+        elif mode == "cached" and (not stored or stored.get("summary") != summary):
+            # Same content summarized elsewhere (or under a different source); adopt it as this session's base
+            self.summaries.put(session_id, summary, self._watermark(messages, source), mode)
         
         if send_to_node:
             self.send_summary_to_node(session_id, summary)
         
-        source = "local_logs" if use_local_logs else ("sync_db" if auto_update else "node_server")
-        
         return {
             "success": True,
             "session_id": session_id,
@@ -178,6 +354,10 @@ STATUS & TINDAKAN SELANJUTNYA:
             "message_count": len(messages),
             "metadata": {
                 "generated_at": datetime.now(timezone.utc).isoformat(),
-                "source": source
+                "source": source,
+                "mode": mode,
+                "new_message_count": len(messages) if mode == "full" else len(new_messages or []),
+                "content_hash": content_hash,
+                "cache": "hit" if cached else ("bypass" if force else "miss")
             }
         }
@@ -0,0 +1,167 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .session_logger import get_wa_logger
+from .summarizer import ConversationSummarizer
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _to_utc_iso(since: Any) -> str:
+    """Epoch (s/ms) or ISO timestamp -> UTC ISO string, the format lastSyncAt is stored in."""
+    if isinstance(since, (int, float)) or str(since).strip().isdigit():
+        ts = float(since)
+        dt = datetime.fromtimestamp(ts / 1000.0 if ts > 1e11 else ts, tz=timezone.utc)
+    else:
+        dt = datetime.fromisoformat(str(since).strip().replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+class SummaryJobManager:
+    """Background summarization jobs.
+
+    Work runs on a small dedicated pool (``SUMMARY_JOB_CONCURRENCY``) instead
+    of the HTTP request threads. Summaries have lower priority than live
+    chat: each unit waits (up to ``SUMMARY_JOB_YIELD_MAX`` seconds) while any
+    ``/chat`` request is in flight before calling the LLM.
+    """
+
+    def __init__(self, summarizer: ConversationSummarizer, concurrency: Optional[int] = None, keep: int = 200):
+        self.summarizer = summarizer
+        self.db = summarizer.sync_service.db
+        self.concurrency = concurrency or max(1, int(os.getenv("SUMMARY_JOB_CONCURRENCY", "2")))
+        self.yield_max = float(os.getenv("SUMMARY_JOB_YIELD_MAX", "30"))
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="summary-job")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._live = 0
+        self._idle = threading.Condition(self._lock)
+
+    # Live-chat priority
+    @contextmanager
+    def live_request(self):
+        with self._lock:
+            self._live += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._live -= 1
+                if self._live == 0:
+                    self._idle.notify_all()
+
+    def _wait_for_idle(self):
+        deadline = time.time() + self.yield_max
+        with self._lock:
+            while self._live > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                self._idle.wait(remaining)
+
+    # Jobs
+    def _new_job(self, kind: str, session_ids: List[str], options: Dict[str, Any]) -> Dict[str, Any]:
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "type": kind,
+            "status": "queued" if session_ids else "done",
+            "options": options,
+            "progress": {"total": len(session_ids), "done": 0, "failed": 0},
+            "results": {},
+            "created_at": _now_iso(),
+            "started_at": None,
+            "finished_at": None if session_ids else _now_iso(),
+        }
+        with self._lock:
+            self._jobs[job["job_id"]] = job
+            while len(self._jobs) > self.keep:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest["status"] in ("queued", "running"):
+                    break
+                self._jobs.pop(oldest_id)
+        for session_id in session_ids:
+            self._pool.submit(self._run_unit, job, session_id)
+        return self.get(job["job_id"])
+
+    def _run_unit(self, job: Dict[str, Any], session_id: str):
+        with self._lock:
+            if job["status"] == "queued":
+                job["status"] = "running"
+                job["started_at"] = _now_iso()
+        self._wait_for_idle()
+
+        options = job["options"]
+        try:
+            if options.get("use_local_logs") or job["type"] == "single":
+                messages = None
+            else:
+                # Batch members were picked from the synced DB, so summarize the
+                # stored copy instead of refetching each one from the gateway
+                messages = self.db.get_messages(session_id)
+            result = self.summarizer.summarize(
+                session_id=session_id,
+                messages=messages,
+                use_local_logs=options.get("use_local_logs", False),
+                send_to_node=options.get("callback", False),
+                auto_update=True,
+                incremental=options.get("incremental", True),
+                force=options.get("force", False),
+            )
+        except Exception as e:
+            get_wa_logger().log_automation(event="summary_job_failed", jid=session_id,
+                                           detail={"job_id": job["job_id"], "error": str(e)})
+            result = {"success": False, "session_id": session_id, "error": str(e)}
+
+        with self._lock:
+            job["results"][session_id] = result
+            key = "done" if result.get("success") else "failed"
+            job["progress"][key] += 1
+            progress = job["progress"]
+            if progress["done"] + progress["failed"] >= progress["total"]:
+                job["status"] = "done" if progress["done"] else "failed"
+                job["finished_at"] = _now_iso()
+
+    def submit(self, session_id: str, use_local_logs: bool = False, callback: bool = False,
+               incremental: bool = True, force: bool = False) -> Dict[str, Any]:
+        return self._new_job("single", [session_id], {
+            "use_local_logs": use_local_logs,
+            "callback": callback,
+            "incremental": incremental,
+            "force": force,
+        })
+
+    def submit_batch(self, since: str, callback: bool = False, incremental: bool = True,
+                     force: bool = False) -> Dict[str, Any]:
+        since = _to_utc_iso(since)
+        session_ids = self.db.get_phone_numbers_changed_since(since)
+        get_wa_logger().log_automation(event="summary_batch_submitted",
+                                       detail={"since": since, "conversations": len(session_ids)})
+        return self._new_job("batch", session_ids, {
+            "since": since,
+            "callback": callback,
+            "incremental": incremental,
+            "force": force,
+        })
+
+    def get(self, job_id: str, include_results: bool = True) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            out = dict(job, progress=dict(job["progress"]))
+            out["results"] = dict(job["results"]) if include_results else None
+            return out
+
+    def list_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            ids = list(self._jobs)[-limit:]
+        return [self.get(job_id, include_results=False) for job_id in reversed(ids)]
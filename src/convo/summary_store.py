@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+class SummaryStore:
+    """Persisted rolling summaries keyed by session id.
+
+    Each entry keeps the summary text plus a watermark describing the last
+    message it covers (``messageId``, ``timestamp``, ``count``), so the next
+    request only has to summarize what came after it.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join("data", "storage", "summaries.json")
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._data: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"[SUMMARY] Corrupt summary store {self.path}: {e}; starting empty")
+            return {}
+
+    def _write(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._data.get(session_id)
+            return dict(entry) if entry else None
+
+    def put(self, session_id: str, summary: str, watermark: Dict[str, Any], mode: str) -> Dict[str, Any]:
+        with self._lock:
+            previous = self._data.get(session_id) or {}
+            entry = {
+                "summary": summary,
+                "watermark": watermark,
+                "mode": mode,
+                "revisions": previous.get("revisions", 0) + 1,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._data[session_id] = entry
+            self._write()
+            return dict(entry)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if self._data.pop(session_id, None) is None:
+                return False
+            self._write()
+            return True
+
+class SummaryCache:
+    """Bounded LRU of summaries keyed by a hash of the normalized message list.
+
+    Persisted to JSON together with hit/miss/eviction counters; the least
+    recently used entry is evicted once ``max_entries`` is exceeded. Hits only
+    update recency in memory; it is written with the next put/evict or flush().
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None):
+        self.path = path or os.path.join("data", "storage", "summary_cache.json")
+        self.max_entries = max_entries or int(os.getenv("SUMMARY_CACHE_SIZE", "500"))
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            print(f"[SUMMARY] Corrupt summary cache {self.path}: {e}; starting empty")
+            return
+        self._entries = OrderedDict(data.get("entries", []))
+        self._stats.update(data.get("stats", {}))
+
+    def _write(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"stats": self._stats, "entries": list(self._entries.items())}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def flush(self):
+        """Persist recency and counters changed by get() since the last write."""
+        with self._lock:
+            if self._dirty:
+                self._write()
+
+    @staticmethod
+    def content_hash(messages: List[Dict[str, Any]]) -> str:
+        h = hashlib.sha256()
+        for msg in messages:
+            key = msg.get("messageId")
+            if key is None:
+                key = f"{msg.get('timestamp')}|{msg.get('direction')}"
+            text = msg.get("text")
+            if text is None:
+                text = msg.get("message") if msg.get("direction") == "incoming" else msg.get("response")
+            h.update(json.dumps([str(key), (text or "").strip()], ensure_ascii=False).encode("utf-8"))
+            h.update(b"\n")
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            self._dirty = True
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            entry["hits"] = entry.get("hits", 0) + 1
+            return dict(entry)
+
+    def put(self, key: str, summary: str, session_id: str, message_count: int):
+        with self._lock:
+            self._entries[key] = {
+                "summary": summary,
+                "session_id": session_id,
+                "message_count": message_count,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "hits": 0,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._write()
+
+    def evict(self, session_id: Optional[str] = None) -> int:
+        """Drop every entry (or only those of ``session_id``)."""
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if session_id is None or e.get("session_id") == session_id]
+            for k in keys:
+                del self._entries[k]
+            self._stats["evictions"] += len(keys)
+            self._write()
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+            }
@@ -1,8 +1,10 @@
 import os
+import copy
 import json
+import shutil
 import threading
 from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator, Tuple
 
 class ConversationDB:
     def __init__(self, db_path: Optional[str] = None):
@@ -10,28 +12,50 @@ class ConversationDB:
             db_path = os.path.join("data", "storage", "conversations.json")
         
         self.db_path = db_path
-        self._lock = threading.Lock()
+        self._lock = threading.RLock()
+        # Parsed copy of the file, revalidated against (mtime_ns, size)
+        self._cache: Optional[Dict[str, Any]] = None
+        self._cache_sig: Optional[tuple] = None
+        self.version = 0
         self._ensure_db_exists()
     
+    @staticmethod
+    def _initial_data() -> Dict[str, Any]:
+        return {
+            "version": "1.0",
+            "lastFullSync": None,
+            "conversations": {},
+            "stats": {
+                "totalConversations": 0,
+                "totalMessages": 0,
+                "lastSyncDuration": 0
+            }
+        }
+
     def _ensure_db_exists(self):
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
         if not os.path.exists(self.db_path):
-            initial_data = {
-                "version": "1.0",
-                "lastFullSync": None,
-                "conversations": {},
-                "stats": {
-                    "totalConversations": 0,
-                    "totalMessages": 0,
-                    "lastSyncDuration": 0
-                }
-            }
+            initial_data = self._initial_data()
             with open(self.db_path, "w", encoding="utf-8") as f:
                 json.dump(initial_data, f, indent=2, ensure_ascii=False)
     
+    def _file_sig(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _set_cache(self, data: Optional[Dict[str, Any]]):
+        self._cache = data
+        self._cache_sig = self._file_sig() if data is not None else None
+        self.version += 1
+
     def _read_db(self) -> Dict[str, Any]:
         with self._lock:
+            if self._cache is not None and self._cache_sig == self._file_sig():
+                return self._cache
             try:
                 with open(self.db_path, "r", encoding="utf-8") as f:
                     content = f.read()
@@ -41,27 +65,19 @@ class ConversationDB:
                         print(f"[DB] ❌ Invalid structure in {self.db_path}")
                         raise ValueError("Invalid database structure")
                     
+                    self._set_cache(data)
                     return data
             except (json.JSONDecodeError, ValueError) as e:
                 print(f"[DB] ❌ Error in {self.db_path}: {e}")
                 backup_path = f"{self.db_path}.corrupted.backup"
-                import shutil
                 shutil.copy(self.db_path, backup_path)
                 print(f"[DB] 📦 Corrupt file backed up to {backup_path}")
                 print(f"[DB] 🔄 Reinitializing database...")
                 
-                initial_data = {
-                    "version": "1.0",
-                    "lastFullSync": None,
-                    "conversations": {},
-                    "stats": {
-                        "totalConversations": 0,
-                        "totalMessages": 0,
-                        "lastSyncDuration": 0
-                    }
-                }
+                initial_data = self._initial_data()
                 with open(self.db_path, "w", encoding="utf-8") as f:
                     json.dump(initial_data, f, indent=2, ensure_ascii=False)
+                self._set_cache(initial_data)
                 return initial_data
     
     def _write_db(self, data: Dict[str, Any]):
@@ -74,17 +90,21 @@ class ConversationDB:
                 with open(temp_path, "r", encoding="utf-8") as f:
                     json.load(f)
                 
-                import shutil
                 shutil.move(temp_path, self.db_path)
+                self._set_cache(data)
             except Exception as e:
                 print(f"[DB] ❌ Error writing database: {e}")
+                # data may already have been mutated in place; reload from disk next time
+                self._set_cache(None)
                 if os.path.exists(temp_path):
                     os.remove(temp_path)
                 raise
     
     def get_conversation(self, phone_number: str) -> Optional[Dict[str, Any]]:
-        data = self._read_db()
-        return data["conversations"].get(phone_number)
+        # Copy under the lock: the cached dict is mutated in place by writers
+        with self._lock:
+            conversation = self._read_db()["conversations"].get(phone_number)
+            return copy.deepcopy(conversation) if conversation is not None else None
     
     def save_conversation(
         self, 
@@ -92,8 +112,21 @@ class ConversationDB:
         metadata: Dict[str, Any],
         messages: List[Dict[str, Any]]
     ):
-        data = self._read_db()
-        
+        with self._lock:
+            data = self._read_db()
+            self._apply_save(data, phone_number, metadata, messages)
+            self._recount(data)
+            self._write_db(data)
+
+    @staticmethod
+    def _recount(data: Dict[str, Any]):
+        data["stats"]["totalConversations"] = len(data["conversations"])
+        data["stats"]["totalMessages"] = sum(
+            len(conv["messages"]) 
+            for conv in data["conversations"].values()
+        )
+
+    def _apply_save(self, data: Dict[str, Any], phone_number: str, metadata: Dict[str, Any], messages: List[Dict[str, Any]]):
         now = datetime.now(timezone.utc).isoformat()
         
         existing = data["conversations"].get(phone_number)
@@ -116,6 +149,7 @@ class ConversationDB:
                 msg["syncedAt"] = now
         
         data["conversations"][phone_number] = {
+            **({"syncCursor": existing["syncCursor"]} if existing and "syncCursor" in existing else {}),
             "phoneNumber": phone_number,
             "metadata": {
                 **metadata,
@@ -125,20 +159,17 @@ class ConversationDB:
             },
             "messages": all_messages
         }
-        
-        data["stats"]["totalConversations"] = len(data["conversations"])
-        data["stats"]["totalMessages"] = sum(
-            len(conv["messages"]) 
-            for conv in data["conversations"].values()
-        )
-        
-        self._write_db(data)
     
     def update_messages(self, phone_number: str, new_messages: List[Dict[str, Any]]):
-        data = self._read_db()
-        
+        with self._lock:
+            data = self._read_db()
+            if self._apply_update(data, phone_number, new_messages):
+                self._recount(data)
+                self._write_db(data)
+
+    def _apply_update(self, data: Dict[str, Any], phone_number: str, new_messages: List[Dict[str, Any]]) -> bool:
         if phone_number not in data["conversations"]:
-            return
+            return False
         
         conversation = data["conversations"][phone_number]
         existing_messages = conversation.get("messages", [])
@@ -150,7 +181,7 @@ class ConversationDB:
         ]
         
         if not messages_to_add:
-            return
+            return False
         
         now = datetime.now(timezone.utc).isoformat()
         for msg in messages_to_add:
@@ -162,39 +193,140 @@ class ConversationDB:
         conversation["messages"] = all_messages
         conversation["metadata"]["messageCount"] = len(all_messages)
         conversation["metadata"]["lastSyncAt"] = now
-        
-        data["stats"]["totalMessages"] = sum(
-            len(conv["messages"]) 
-            for conv in data["conversations"].values()
-        )
-        
-        self._write_db(data)
+        return True
+
+    def apply_sync_batch(self, items: List[Dict[str, Any]]):
+        """Apply a whole sync cycle with one read and one write.
+
+        Each item has ``phone``, ``messages``, optional ``metadata`` (used when
+        the conversation is new) and optional ``cursor``.
+        """
+        if not items:
+            return
+        with self._lock:
+            data = self._read_db()
+            for item in items:
+                phone_number = item["phone"]
+                if phone_number in data["conversations"]:
+                    self._apply_update(data, phone_number, item.get("messages") or [])
+                else:
+                    self._apply_save(data, phone_number, item.get("metadata") or {}, item.get("messages") or [])
+                if item.get("cursor") is not None:
+                    self._apply_cursor(data, phone_number, item["cursor"])
+            self._recount(data)
+            self._write_db(data)
     
     def get_all_phone_numbers(self) -> List[str]:
-        data = self._read_db()
-        return list(data["conversations"].keys())
+        with self._lock:
+            data = self._read_db()
+            return list(data["conversations"].keys())
     
+    def get_phone_numbers_changed_since(self, since: str) -> List[str]:
+        with self._lock:
+            conversations = self._read_db()["conversations"]
+            return [
+                phone for phone, conv in conversations.items()
+                if (conv.get("metadata", {}).get("lastSyncAt") or "") >= since
+            ]
+
     def get_last_sync_time(self) -> Optional[str]:
-        data = self._read_db()
-        return data.get("lastFullSync")
+        with self._lock:
+            return self._read_db().get("lastFullSync")
     
+    def has_conversation(self, phone_number: str) -> bool:
+        with self._lock:
+            return phone_number in self._read_db()["conversations"]
+
+    def get_sync_cursor(self, phone_number: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            conversation = self._read_db()["conversations"].get(phone_number)
+            return dict(conversation["syncCursor"]) if conversation and conversation.get("syncCursor") else None
+
+    def set_sync_cursor(self, phone_number: str, cursor: Dict[str, Any]):
+        with self._lock:
+            data = self._read_db()
+            if self._apply_cursor(data, phone_number, cursor):
+                self._write_db(data)
+
+    @staticmethod
+    def _apply_cursor(data: Dict[str, Any], phone_number: str, cursor: Dict[str, Any]) -> bool:
+        conversation = data["conversations"].get(phone_number)
+        if conversation is None:
+            return False
+        conversation["syncCursor"] = {
+            "remoteLastTimestamp": cursor.get("remoteLastTimestamp"),
+            "lastMessageId": cursor.get("lastMessageId"),
+            "lastMessageTs": cursor.get("lastMessageTs"),
+            "updatedAt": datetime.now(timezone.utc).isoformat(),
+        }
+        return True
+
     def set_last_sync_time(self, timestamp: str):
-        data = self._read_db()
-        data["lastFullSync"] = timestamp
-        self._write_db(data)
+        with self._lock:
+            data = self._read_db()
+            data["lastFullSync"] = timestamp
+            self._write_db(data)
     
     def get_total_message_count(self) -> int:
-        data = self._read_db()
-        return data["stats"]["totalMessages"]
+        with self._lock:
+            return self._read_db()["stats"]["totalMessages"]
     
     def update_sync_stats(self, duration: float):
-        data = self._read_db()
-        data["stats"]["lastSyncDuration"] = duration
-        data["lastFullSync"] = datetime.now(timezone.utc).isoformat()
-        self._write_db(data)
+        with self._lock:
+            data = self._read_db()
+            data["stats"]["lastSyncDuration"] = duration
+            data["lastFullSync"] = datetime.now(timezone.utc).isoformat()
+            self._write_db(data)
     
     def get_messages(self, phone_number: str) -> List[Dict[str, Any]]:
-        conversation = self.get_conversation(phone_number)
-        if not conversation:
-            return []
-        return conversation.get("messages", [])
+        with self._lock:
+            conversation = self._read_db()["conversations"].get(phone_number)
+            if not conversation:
+                return []
+            return copy.deepcopy(conversation.get("messages", []))
+
+    def iter_messages_synced_after(self, synced_after: Optional[str] = None,
+                                   batch_size: int = 1000) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield ``(phone, message)`` for messages synced after ``synced_after``,
+        oldest first."""
+        with self._lock:
+            data = self._read_db()
+            rows = [
+                (msg.get("syncedAt") or "", phone, copy.deepcopy(msg))
+                for phone, conv in data["conversations"].items()
+                for msg in conv.get("messages", [])
+                if synced_after is None or (msg.get("syncedAt") or "") > synced_after
+            ]
+        rows.sort(key=lambda r: r[0])
+        for _, phone, msg in rows:
+            yield phone, msg
+
+    def get_conversation_count(self) -> int:
+        with self._lock:
+            return len(self._read_db()["conversations"])
+
+    def backup(self, dest_path: str):
+        with self._lock:
+            shutil.copyfile(self.db_path, dest_path)
+
+    def close(self):
+        """Nothing to release; kept for parity with SQLiteConversationDB."""
+
+    def reset(self) -> int:
+        with self._lock:
+            count = self.get_conversation_count()
+            self._write_db(self._initial_data())
+            return count
+
+def create_conversation_db(backend: Optional[str] = None):
+    """Return the configured ConversationDB implementation.
+
+    CONVERSATION_DB_BACKEND=sqlite (default) uses data/storage/conversations.db
+    and imports an existing conversations.json once; ``json`` keeps the
+    single-file JSON store.
+    """
+    backend = (backend or os.getenv("CONVERSATION_DB_BACKEND", "sqlite")).lower()
+    if backend == "json":
+        return ConversationDB()
+    from src.storage.sqlite_conversation_db import SQLiteConversationDB
+    return SQLiteConversationDB()
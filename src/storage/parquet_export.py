@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+COLUMNS = [
+    "phone", "phone_hash", "message_id", "timestamp", "day", "from_me", "text",
+    "text_len", "synced_at", "exported_at", "gap_seconds", "turn_latency_seconds", "is_turn_start",
+]
+
+def _to_datetime(value: Any) -> Optional[datetime]:
+    """Message timestamps arrive as ISO strings or epoch seconds/milliseconds."""
+    if value is None or value == "":
+        return None
+    try:
+        if isinstance(value, (int, float)) or str(value).isdigit():
+            ts = float(value)
+            if ts > 1e11:
+                ts /= 1000.0
+            return datetime.fromtimestamp(ts, timezone.utc)
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+class ParquetExporter:
+    """Incremental export of ConversationDB messages to partitioned Parquet.
+
+    Files land in ``<root>/day=YYYY-MM-DD/bucket=NN/part-<stamp>.parquet``
+    (bucket = phone hash mod ``buckets``). Each run exports messages synced
+    after the previous run's watermark minus ``lookback`` seconds, so rows
+    committed late with an older ``syncedAt`` are still picked up; messages
+    already exported inside that window are skipped by id. New part files
+    are added, existing partitions are never rewritten. ``_state.json`` keeps
+    the watermark, the ids exported inside the window, and each phone's last
+    message for turn-latency features.
+    """
+
+    def __init__(self, db, root: Optional[str] = None, buckets: Optional[int] = None,
+                 chunk_size: int = 5000, lookback: Optional[float] = None):
+        self.db = db
+        self.root = root or os.getenv("PARQUET_EXPORT_DIR", os.path.join("data", "exports", "messages"))
+        self.buckets = buckets or int(os.getenv("PARQUET_EXPORT_BUCKETS", "16"))
+        self.chunk_size = chunk_size
+        self.lookback = lookback if lookback is not None else float(os.getenv("PARQUET_EXPORT_LOOKBACK", "300"))
+        self.state_path = os.path.join(self.root, "_state.json")
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    # State
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"watermark": None, "recent": {}, "last": {}, "files": 0, "rows": 0}
+
+    def _save_state(self, state: Dict[str, Any]):
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp, self.state_path)
+
+    def _discard_pending(self, state: Dict[str, Any]):
+        """Remove part files of a run that crashed before saving its state;
+        its rows are still past the watermark and get exported again."""
+        stamp = state.pop("pending", None)
+        if not stamp:
+            return
+        prefix = f"part-{stamp}-"
+        removed = 0
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.startswith(prefix):
+                    os.remove(os.path.join(dirpath, name))
+                    removed += 1
+        print(f"[EXPORT] Discarded {removed} part file(s) from interrupted run {stamp}")
+        self._save_state(state)
+
+    def _since(self, watermark: Optional[str]) -> Optional[str]:
+        dt = _to_datetime(watermark)
+        if dt is None or self.lookback <= 0:
+            return watermark
+        return (dt - timedelta(seconds=self.lookback)).isoformat()
+
+    def _phone_hash(self, phone: str) -> Tuple[str, int]:
+        digest = hashlib.sha1(phone.encode("utf-8")).hexdigest()
+        return digest[:16], int(digest[:8], 16) % self.buckets
+
+    # Rows
+    def _rows(self, chunk: List[Tuple[str, Dict[str, Any]]], last: Dict[str, List[Any]], exported_at: datetime) -> List[Dict[str, Any]]:
+        by_phone: Dict[str, List[Tuple[Optional[datetime], Dict[str, Any]]]] = {}
+        for phone, msg in chunk:
+            by_phone.setdefault(phone, []).append((_to_datetime(msg.get("timestamp")), msg))
+
+        rows = []
+        for phone, items in by_phone.items():
+            items.sort(key=lambda item: item[0] or datetime.min.replace(tzinfo=timezone.utc))
+            phone_hash, _ = self._phone_hash(phone)
+            prev = last.get(phone)
+            prev_ts = _to_datetime(prev[0]) if prev else None
+            prev_from_me = prev[1] if prev else None
+            for ts, msg in items:
+                from_me = bool(msg.get("isFromMe", msg.get("direction") == "outgoing"))
+                gap = (ts - prev_ts).total_seconds() if ts and prev_ts else None
+                if gap is not None and gap < 0:
+                    # Late arrival older than what we already exported
+                    gap = None
+                turn_start = prev_from_me is None or from_me != prev_from_me
+                text = msg.get("text") or ""
+                rows.append({
+                    "phone": phone,
+                    "phone_hash": phone_hash,
+                    "message_id": str(msg.get("messageId")),
+                    "timestamp": ts,
+                    "day": ts.strftime("%Y-%m-%d") if ts else "unknown",
+                    "from_me": from_me,
+                    "text": text,
+                    "text_len": len(text),
+                    "synced_at": _to_datetime(msg.get("syncedAt")),
+                    "exported_at": exported_at,
+                    "gap_seconds": gap,
+                    "turn_latency_seconds": gap if turn_start else None,
+                    "is_turn_start": turn_start,
+                })
+                if ts and (prev_ts is None or ts >= prev_ts):
+                    prev_ts, prev_from_me = ts, from_me
+                    last[phone] = [ts.isoformat(), from_me]
+        return rows
+
+    def _write_chunk(self, rows: List[Dict[str, Any]], stamp: str, seq: int) -> int:
+        df = pd.DataFrame(rows, columns=COLUMNS)
+        df["bucket"] = [self._phone_hash(p)[1] for p in df["phone"]]
+        files = 0
+        for (day, bucket), part in df.groupby(["day", "bucket"], sort=False):
+            part_dir = os.path.join(self.root, f"day={day}", f"bucket={bucket:02d}")
+            os.makedirs(part_dir, exist_ok=True)
+            path = os.path.join(part_dir, f"part-{stamp}-{seq:04d}.parquet")
+            part.drop(columns=["day", "bucket"]).to_parquet(f"{path}.tmp", index=False, compression="zstd")
+            os.replace(f"{path}.tmp", path)
+            files += 1
+        return files
+
+    def export(self) -> Dict[str, Any]:
+        """Export messages synced since the last run. Safe to call after every sync."""
+        with self._lock:
+            start = time.time()
+            state = self._load_state()
+            self._discard_pending(state)
+            watermark = state.get("watermark")
+            last = state.setdefault("last", {})
+            # "phone/messageId" -> syncedAt for rows exported inside the lookback window
+            recent: Dict[str, str] = state.setdefault("recent", {})
+            exported_at = datetime.now(timezone.utc)
+            stamp = exported_at.strftime("%Y%m%dT%H%M%S%fZ")
+
+            rows_total = files = seq = 0
+            chunk: List[Tuple[str, Dict[str, Any]]] = []
+            new_watermark = watermark
+            for phone, msg in self.db.iter_messages_synced_after(self._since(watermark)):
+                key = f"{phone}/{msg.get('messageId')}"
+                if key in recent:
+                    continue
+                synced = msg.get("syncedAt")
+                if rows_total == 0 and not chunk:
+                    # Mark the run before its first part file lands
+                    state["pending"] = stamp
+                    self._save_state(state)
+                chunk.append((phone, msg))
+                recent[key] = synced or ""
+                if synced and (new_watermark is None or synced > new_watermark):
+                    new_watermark = synced
+                if len(chunk) >= self.chunk_size:
+                    files += self._write_chunk(self._rows(chunk, last, exported_at), stamp, seq)
+                    rows_total += len(chunk)
+                    seq += 1
+                    chunk = []
+            if chunk:
+                files += self._write_chunk(self._rows(chunk, last, exported_at), stamp, seq)
+                rows_total += len(chunk)
+
+            if rows_total:
+                since = self._since(new_watermark)
+                state["recent"] = {k: v for k, v in recent.items() if since is None or v > since}
+                state.pop("pending", None)
+                state["watermark"] = new_watermark
+                state["files"] = state.get("files", 0) + files
+                state["rows"] = state.get("rows", 0) + rows_total
+                state["updated_at"] = exported_at.isoformat()
+                self._save_state(state)
+
+            return {
+                "ok": True,
+                "rows": rows_total,
+                "files": files,
+                "watermark": state.get("watermark"),
+                "duration": round(time.time() - start, 3),
+            }
+
+if __name__ == "__main__":
+    from src.storage.conversation_db import create_conversation_db
+
+    print(ParquetExporter(create_conversation_db()).export())
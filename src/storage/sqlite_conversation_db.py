@@ -0,0 +1,467 @@
+import os
+import json
+import sqlite3
+import threading
+import weakref
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    phone TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    first_seen_at TEXT,
+    last_sync_at TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    timestamp TEXT,
+    ts_epoch REAL,
+    synced_at TEXT,
+    body TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_phone_msgid ON messages(phone, message_id);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_phone_ts ON messages(phone, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_synced_at ON messages(synced_at);
+
+CREATE TABLE IF NOT EXISTS sync_cursors (
+    phone TEXT PRIMARY KEY,
+    remote_last_timestamp TEXT,
+    last_message_id TEXT,
+    last_message_ts TEXT,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_conversations INTEGER NOT NULL DEFAULT 0,
+    total_messages INTEGER NOT NULL DEFAULT 0,
+    last_sync_duration REAL NOT NULL DEFAULT 0,
+    last_full_sync TEXT,
+    json_imported INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO stats (id) VALUES (1);
+
+CREATE TRIGGER IF NOT EXISTS trg_messages_insert AFTER INSERT ON messages BEGIN
+    UPDATE conversations SET message_count = message_count + 1 WHERE phone = NEW.phone;
+    UPDATE stats SET total_messages = total_messages + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_messages_delete AFTER DELETE ON messages BEGIN
+    UPDATE conversations SET message_count = message_count - 1 WHERE phone = OLD.phone;
+    UPDATE stats SET total_messages = total_messages - 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_conversations_insert AFTER INSERT ON conversations BEGIN
+    UPDATE stats SET total_conversations = total_conversations + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_conversations_delete AFTER DELETE ON conversations BEGIN
+    DELETE FROM messages WHERE phone = OLD.phone;
+    DELETE FROM sync_cursors WHERE phone = OLD.phone;
+    UPDATE stats SET total_conversations = total_conversations - 1 WHERE id = 1;
+END;
+"""
+
+def _ts_epoch(value: Any) -> Optional[float]:
+    """Sortable epoch seconds for ISO strings or epoch seconds/milliseconds."""
+    if value is None or value == "":
+        return None
+    try:
+        if isinstance(value, (int, float)) or str(value).isdigit():
+            ts = float(value)
+            return ts / 1000.0 if ts > 1e11 else ts
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+    except (ValueError, OverflowError):
+        return None
+
+class _ThreadConn:
+    """Holder kept in thread-local storage; dropped when its thread exits."""
+
+    __slots__ = ("conn", "generation", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection, generation: int):
+        self.conn = conn
+        self.generation = generation
+
+class SQLiteConversationDB:
+    """SQLite implementation of the ConversationDB interface.
+
+    Messages are rows keyed by (phone, messageId); inserts are
+    ``INSERT OR IGNORE`` batches in one transaction and the counters in
+    ``stats`` / ``conversations.message_count`` are kept by triggers.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, import_json_path: Optional[str] = None):
+        if db_path is None:
+            db_path = os.path.join("data", "storage", "conversations.db")
+
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        # Open thread-local connections, so close() can release them all
+        self._conns: set = set()
+        self._conns_lock = threading.Lock()
+        self._generation = 0
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+
+        with self._lock:
+            conn = self._conn()
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+
+        if import_json_path is None:
+            import_json_path = os.path.join(os.path.dirname(self.db_path), "conversations.json")
+        self._import_json_once(import_json_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        holder = getattr(self._local, "holder", None)
+        if holder is None or holder.generation != self._generation:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._conns_lock:
+                self._conns.add(conn)
+                holder = _ThreadConn(conn, self._generation)
+            # Thread-local storage is dropped when the thread exits (pool
+            # workers, socket.io reconnect threads); close its connection then
+            weakref.finalize(holder, self._release, conn)
+            self._local.holder = holder
+        return holder.conn
+
+    def _release(self, conn: sqlite3.Connection):
+        with self._conns_lock:
+            self._conns.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        """Close every thread's connection; threads reconnect on next use."""
+        with self._conns_lock:
+            conns, self._conns = self._conns, set()
+            self._generation += 1
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _migrate(self, conn: sqlite3.Connection):
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "ts_epoch" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN ts_epoch REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_phone_epoch ON messages(phone, ts_epoch, id)")
+        # Backfill rows written before ts_epoch existed
+        rows = conn.execute(
+            "SELECT id, timestamp FROM messages WHERE ts_epoch IS NULL AND timestamp IS NOT NULL"
+        ).fetchall()
+        if rows:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "UPDATE messages SET ts_epoch = ? WHERE id = ?",
+                    [(_ts_epoch(r["timestamp"]), r["id"]) for r in rows],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _import_json_once(self, json_path: str):
+        """One-time migration from the JSON database on first start.
+
+        ``stats.json_imported`` is 1 after an import (or when there was
+        nothing to import) and -1 after a failed one, so a broken file is not
+        retried on every start; reset it to 0 to try again.
+        """
+        conn = self._conn()
+        if conn.execute("SELECT json_imported FROM stats WHERE id = 1").fetchone()["json_imported"]:
+            return
+        if not os.path.exists(json_path):
+            conn.execute("UPDATE stats SET json_imported = 1 WHERE id = 1")
+            return
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("Invalid database structure")
+        except Exception as e:
+            print(f"[DB] ⚠️ Skip JSON import from {json_path}: {e}")
+            conn.execute("UPDATE stats SET json_imported = -1 WHERE id = 1")
+            return
+
+        conversations = data.get("conversations") or {}
+        with self._lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for phone, conv in conversations.items():
+                    meta = dict(conv.get("metadata") or {})
+                    self._upsert_conversation(conn, phone, meta, meta.get("lastSyncAt"), meta.get("firstSeenAt"))
+                    self._insert_messages(conn, phone, conv.get("messages") or [], None)
+                stats = data.get("stats") or {}
+                conn.execute(
+                    "UPDATE stats SET last_sync_duration = ?, last_full_sync = ?, json_imported = 1 WHERE id = 1",
+                    (stats.get("lastSyncDuration", 0), data.get("lastFullSync")),
+                )
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                conn.execute("UPDATE stats SET json_imported = -1 WHERE id = 1")
+                print(f"[DB] ⚠️ JSON import from {json_path} failed: {e}")
+                return
+        print(f"[DB] 📥 Imported {len(conversations)} conversations from {json_path}")
+
+    # Writes
+    def _upsert_conversation(self, conn: sqlite3.Connection, phone: str, metadata: Dict[str, Any],
+                             now: Optional[str], first_seen: Optional[str] = None):
+        meta = {k: v for k, v in metadata.items() if k not in ("lastSyncAt", "firstSeenAt", "messageCount")}
+        conn.execute(
+            """
+            INSERT INTO conversations (phone, metadata, first_seen_at, last_sync_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(phone) DO UPDATE SET
+                metadata = excluded.metadata,
+                last_sync_at = excluded.last_sync_at
+            """,
+            (phone, json.dumps(meta, ensure_ascii=False), first_seen or now, now),
+        )
+
+    def _insert_messages(self, conn: sqlite3.Connection, phone: str,
+                         messages: Iterable[Dict[str, Any]], now: Optional[str]) -> int:
+        rows = []
+        for msg in messages:
+            if "messageId" not in msg:
+                continue
+            body = dict(msg)
+            if now and "syncedAt" not in body:
+                body["syncedAt"] = now
+            ts = body.get("timestamp")
+            rows.append((
+                phone,
+                str(body["messageId"]),
+                None if ts is None else str(ts),
+                _ts_epoch(ts),
+                body.get("syncedAt"),
+                json.dumps(body, ensure_ascii=False),
+            ))
+        if not rows:
+            return 0
+        cur = conn.executemany(
+            "INSERT OR IGNORE INTO messages (phone, message_id, timestamp, ts_epoch, synced_at, body) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        return max(cur.rowcount, 0)
+
+    def save_conversation(
+        self,
+        phone_number: str,
+        metadata: Dict[str, Any],
+        messages: List[Dict[str, Any]]
+    ):
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._upsert_conversation(conn, phone_number, metadata, now)
+                self._insert_messages(conn, phone_number, messages, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def update_messages(self, phone_number: str, new_messages: List[Dict[str, Any]]):
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not conn.execute("SELECT 1 FROM conversations WHERE phone = ?", (phone_number,)).fetchone():
+                    conn.execute("ROLLBACK")
+                    return
+                added = self._insert_messages(conn, phone_number, new_messages, now)
+                if added:
+                    conn.execute("UPDATE conversations SET last_sync_at = ? WHERE phone = ?", (now, phone_number))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def has_conversation(self, phone_number: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM conversations WHERE phone = ?", (phone_number,)).fetchone() is not None
+
+    def apply_sync_batch(self, items: List[Dict[str, Any]]):
+        """Apply a whole sync cycle in a single transaction.
+
+        Each item has ``phone``, ``messages``, optional ``metadata`` (used when
+        the conversation is new) and optional ``cursor``.
+        """
+        if not items:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for item in items:
+                    phone_number = item["phone"]
+                    exists = conn.execute("SELECT 1 FROM conversations WHERE phone = ?", (phone_number,)).fetchone()
+                    if not exists:
+                        self._upsert_conversation(conn, phone_number, item.get("metadata") or {}, now)
+                    added = self._insert_messages(conn, phone_number, item.get("messages") or [], now)
+                    if exists and added:
+                        conn.execute("UPDATE conversations SET last_sync_at = ? WHERE phone = ?", (now, phone_number))
+                    if item.get("cursor") is not None:
+                        self._upsert_cursor(conn, phone_number, item["cursor"], now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get_sync_cursor(self, phone_number: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT remote_last_timestamp, last_message_id, last_message_ts, updated_at FROM sync_cursors WHERE phone = ?",
+            (phone_number,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "remoteLastTimestamp": row["remote_last_timestamp"],
+            "lastMessageId": row["last_message_id"],
+            "lastMessageTs": row["last_message_ts"],
+            "updatedAt": row["updated_at"],
+        }
+
+    def set_sync_cursor(self, phone_number: str, cursor: Dict[str, Any]):
+        with self._lock:
+            self._upsert_cursor(self._conn(), phone_number, cursor, datetime.now(timezone.utc).isoformat())
+
+    def _upsert_cursor(self, conn: sqlite3.Connection, phone_number: str, cursor: Dict[str, Any], now: str):
+        conn.execute(
+            """
+            INSERT INTO sync_cursors (phone, remote_last_timestamp, last_message_id, last_message_ts, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(phone) DO UPDATE SET
+                remote_last_timestamp = excluded.remote_last_timestamp,
+                last_message_id = excluded.last_message_id,
+                last_message_ts = excluded.last_message_ts,
+                updated_at = excluded.updated_at
+            """,
+            (
+                phone_number,
+                cursor.get("remoteLastTimestamp"),
+                cursor.get("lastMessageId"),
+                cursor.get("lastMessageTs"),
+                now,
+            ),
+        )
+
+    def set_last_sync_time(self, timestamp: str):
+        with self._lock:
+            self._conn().execute("UPDATE stats SET last_full_sync = ? WHERE id = 1", (timestamp,))
+
+    def update_sync_stats(self, duration: float):
+        with self._lock:
+            self._conn().execute(
+                "UPDATE stats SET last_sync_duration = ?, last_full_sync = ? WHERE id = 1",
+                (duration, datetime.now(timezone.utc).isoformat()),
+            )
+
+    # Reads
+    def get_conversation(self, phone_number: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT metadata, first_seen_at, last_sync_at, message_count FROM conversations WHERE phone = ?",
+            (phone_number,),
+        ).fetchone()
+        if row is None:
+            return None
+        metadata = json.loads(row["metadata"] or "{}")
+        metadata.update({
+            "lastSyncAt": row["last_sync_at"],
+            "firstSeenAt": row["first_seen_at"],
+            "messageCount": row["message_count"],
+        })
+        return {
+            "phoneNumber": phone_number,
+            "metadata": metadata,
+            "messages": self.get_messages(phone_number),
+        }
+
+    def get_messages(self, phone_number: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT body FROM messages WHERE phone = ? ORDER BY ts_epoch, id",
+            (phone_number,),
+        ).fetchall()
+        return [json.loads(r["body"]) for r in rows]
+
+    def iter_messages_synced_after(self, synced_after: Optional[str] = None,
+                                   batch_size: int = 1000) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield ``(phone, message)`` for messages synced after ``synced_after``,
+        oldest first, without loading the table into memory."""
+        cur = self._conn().execute(
+            "SELECT phone, body FROM messages WHERE ? IS NULL OR synced_at > ? ORDER BY synced_at, id",
+            (synced_after, synced_after),
+        )
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield row["phone"], json.loads(row["body"])
+
+    def get_all_phone_numbers(self) -> List[str]:
+        return [r["phone"] for r in self._conn().execute("SELECT phone FROM conversations ORDER BY rowid")]
+
+    def get_phone_numbers_changed_since(self, since: str) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT phone FROM conversations WHERE last_sync_at >= ? ORDER BY last_sync_at",
+            (since,),
+        )
+        return [r["phone"] for r in rows]
+
+    def get_last_sync_time(self) -> Optional[str]:
+        row = self._conn().execute("SELECT last_full_sync FROM stats WHERE id = 1").fetchone()
+        return row["last_full_sync"] if row else None
+
+    def get_total_message_count(self) -> int:
+        row = self._conn().execute("SELECT total_messages FROM stats WHERE id = 1").fetchone()
+        return row["total_messages"] if row else 0
+
+    def get_conversation_count(self) -> int:
+        row = self._conn().execute("SELECT total_conversations FROM stats WHERE id = 1").fetchone()
+        return row["total_conversations"] if row else 0
+
+    # Maintenance
+    def backup(self, dest_path: str):
+        with self._lock:
+            dest = sqlite3.connect(dest_path)
+            try:
+                self._conn().backup(dest)
+            finally:
+                dest.close()
+
+    def reset(self) -> int:
+        with self._lock:
+            conn = self._conn()
+            count = self.get_conversation_count()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM conversations")
+                conn.execute("DELETE FROM sync_cursors")
+                conn.execute("UPDATE stats SET last_sync_duration = 0, last_full_sync = NULL WHERE id = 1")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return count
@@ -1,9 +1,12 @@
 import os
 import time
+import asyncio
+import httpx
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timezone
-from src.storage.conversation_db import ConversationDB
+from src.storage.conversation_db import create_conversation_db
 
 class ConversationSync:
     def __init__(self):
@@ -11,8 +14,13 @@ class ConversationSync:
             "NODE_SERVER_URL", 
             "https://unproportionably-subsacral-kecia.ngrok-free.dev"
         )
-        self.db = ConversationDB()
+        self.db = create_conversation_db()
         self.timeout = 10
+        # Delta sync skips unchanged conversations; a full resync runs at this interval
+        self.full_resync_interval = float(os.getenv("SYNC_FULL_RESYNC_INTERVAL", "3600"))
+        self._last_full_resync = 0.0
+        # Upper bound on in-flight message fetches during sync_all
+        self.concurrency = max(1, int(os.getenv("SYNC_CONCURRENCY", "8")))
     
     def fetch_all_conversations(self) -> Optional[List[Dict[str, Any]]]:
         try:
@@ -36,50 +44,140 @@ class ConversationSync:
             print(f"[SYNC] Error fetching conversations: {e}")
             return None
     
-    def fetch_messages(self, phone_number: str) -> Optional[List[Dict[str, Any]]]:
+    @staticmethod
+    def _message_params(since: Optional[str], after_id: Optional[str]) -> Optional[Dict[str, str]]:
+        params = {}
+        if since:
+            params["since"] = since
+        if after_id:
+            params["afterId"] = after_id
+        return params or None
+
+    @staticmethod
+    def _parse_messages(phone_number: str, response: Any) -> Optional[List[Dict[str, Any]]]:
+        try:
+            data = response.json()
+        except ValueError as json_err:
+            print(f"[SYNC] JSON parsing error for {phone_number}: {json_err}")
+            print(f"[SYNC] Response preview: {response.text[:500]}")
+            return None
+        
+        if data.get("success") and "messages" in data:
+            return data["messages"]
+        
+        return None
+
+    def fetch_messages(
+        self,
+        phone_number: str,
+        since: Optional[str] = None,
+        after_id: Optional[str] = None
+    ) -> Optional[List[Dict[str, Any]]]:
         try:
             url = f"{self.node_server_url}/api/messages/{phone_number}"
-            response = requests.get(url, timeout=self.timeout)
+            response = requests.get(url, params=self._message_params(since, after_id), timeout=self.timeout)
             response.raise_for_status()
-            
-            try:
-                data = response.json()
-            except ValueError as json_err:
-                print(f"[SYNC] JSON parsing error for {phone_number}: {json_err}")
-                print(f"[SYNC] Response preview: {response.text[:500]}")
-                return None
-            
-            if data.get("success") and "messages" in data:
-                return data["messages"]
-            
+            return self._parse_messages(phone_number, response)
+        
+        except Exception as e:
+            print(f"[SYNC] Error fetching messages for {phone_number}: {e}")
             return None
+
+    async def _afetch_messages(
+        self,
+        client: httpx.AsyncClient,
+        phone_number: str,
+        since: Optional[str] = None,
+        after_id: Optional[str] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        try:
+            url = f"{self.node_server_url}/api/messages/{phone_number}"
+            response = await client.get(url, params=self._message_params(since, after_id))
+            response.raise_for_status()
+            return self._parse_messages(phone_number, response)
         
         except Exception as e:
             print(f"[SYNC] Error fetching messages for {phone_number}: {e}")
             return None
     
-    def sync_conversation(self, phone_number: str) -> bool:
+    @staticmethod
+    def _is_newer(ts: Any, since: Any) -> bool:
+        try:
+            return ts >= since
+        except TypeError:
+            return str(ts) >= str(since)
+
+    @staticmethod
+    def _next_cursor(
+        messages: List[Dict[str, Any]],
+        previous: Optional[Dict[str, Any]],
+        remote_last_timestamp: Optional[Any]
+    ) -> Dict[str, Any]:
+        cursor = dict(previous or {})
+        for msg in messages:
+            ts = msg.get("timestamp")
+            if ts is None:
+                continue
+            last = cursor.get("lastMessageTs")
+            if last is None or ConversationSync._is_newer(ts, last):
+                cursor["lastMessageTs"] = ts
+                cursor["lastMessageId"] = msg.get("messageId")
+        if remote_last_timestamp is not None:
+            cursor["remoteLastTimestamp"] = str(remote_last_timestamp)
+        return cursor
+
+    def _build_update(
+        self,
+        phone_number: str,
+        messages: List[Dict[str, Any]],
+        cursor: Optional[Dict[str, Any]],
+        since: Optional[str],
+        remote_last_timestamp: Optional[Any]
+    ) -> Dict[str, Any]:
+        """Turn fetched messages into an ``apply_sync_batch`` item."""
+        if since is not None:
+            # The Node server may ignore the cursor; keep only messages at or after it
+            messages = [m for m in messages if m.get("timestamp") is None or self._is_newer(m["timestamp"], since)]
+        
+        print(f"[SYNC] Fetched {len(messages)} {'new ' if since is not None else ''}messages for {phone_number}")
+        
+        return {
+            "phone": phone_number,
+            "messages": messages,
+            "metadata": {
+                "lastMessage": messages[-1].get("text", "") if messages else "",
+                "lastTimestamp": messages[-1].get("timestamp", "") if messages else "",
+                "messageCount": len(messages)
+            },
+            "cursor": self._next_cursor(messages, cursor, remote_last_timestamp),
+        }
+
+    def sync_conversation(
+        self,
+        phone_number: str,
+        remote_last_timestamp: Optional[Any] = None,
+        full: bool = False
+    ) -> bool:
         try:
-            messages = self.fetch_messages(phone_number)
+            cursor = None if full else self.db.get_sync_cursor(phone_number)
+            since = cursor.get("lastMessageTs") if cursor else None
+
+            messages = self.fetch_messages(
+                phone_number,
+                since=since,
+                after_id=cursor.get("lastMessageId") if cursor else None
+            )
+            if messages is None and since is not None:
+                print(f"[SYNC] Delta fetch failed for {phone_number}, falling back to full fetch")
+                since = None
+                messages = self.fetch_messages(phone_number)
             
             if messages is None:
                 return False
             
-            print(f"[SYNC] Fetched {len(messages)} messages for {phone_number}")
-            
-            existing = self.db.get_conversation(phone_number)
-            
-            if existing:
-                print(f"[SYNC] Updating existing conversation for {phone_number}")
-                self.db.update_messages(phone_number, messages)
-            else:
-                print(f"[SYNC] Creating new conversation for {phone_number}")
-                metadata = {
-                    "lastMessage": messages[-1].get("text", "") if messages else "",
-                    "lastTimestamp": messages[-1].get("timestamp", "") if messages else "",
-                    "messageCount": len(messages)
-                }
-                self.db.save_conversation(phone_number, metadata, messages)
+            self.db.apply_sync_batch([
+                self._build_update(phone_number, messages, cursor, since, remote_last_timestamp)
+            ])
             
             print(f"[SYNC] ✅ Successfully synced {phone_number}")
             return True
@@ -89,44 +187,127 @@ class ConversationSync:
             import traceback
             traceback.print_exc()
             return False
+
+    async def _fetch_one(
+        self,
+        client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        phone_number: str,
+        cursor: Optional[Dict[str, Any]],
+        remote_last_timestamp: Optional[Any]
+    ) -> Optional[Dict[str, Any]]:
+        since = cursor.get("lastMessageTs") if cursor else None
+        async with semaphore:
+            messages = await self._afetch_messages(
+                client,
+                phone_number,
+                since=since,
+                after_id=cursor.get("lastMessageId") if cursor else None
+            )
+            if messages is None and since is not None:
+                print(f"[SYNC] Delta fetch failed for {phone_number}, falling back to full fetch")
+                since = None
+                messages = await self._afetch_messages(client, phone_number)
+        
+        if messages is None:
+            return None
+        return self._build_update(phone_number, messages, cursor, since, remote_last_timestamp)
+
+    async def _fetch_all(self, plan: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            return await asyncio.gather(*(
+                self._fetch_one(client, semaphore, p["phone"], p["cursor"], p["remote_ts"])
+                for p in plan
+            ))
     
-    def sync_all(self) -> Dict[str, Any]:
+    def _run_fetch_all(self, plan: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._fetch_all(plan))
+        # Called from inside an event loop (e.g. an async endpoint): asyncio.run
+        # would raise there, so drive the fetch on a fresh loop in a worker thread
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, self._fetch_all(plan)).result()
+    
+    def sync_all(self, full: bool = False) -> Dict[str, Any]:
         start_time = time.time()
+        phases: Dict[str, float] = {}
         
+        mark = time.perf_counter()
         conversations = self.fetch_all_conversations()
+        phases["list"] = round(time.perf_counter() - mark, 3)
         
         if conversations is None:
             return {
                 "success": False,
                 "error": "Failed to fetch conversations from node server",
                 "synced_count": 0,
-                "duration": time.time() - start_time
+                "duration": time.time() - start_time,
+                "phases": phases
             }
         
-        synced_count = 0
-        failed_count = 0
+        full = full or (start_time - self._last_full_resync >= self.full_resync_interval)
+        
+        skipped_count = 0
         
+        mark = time.perf_counter()
+        plan = []
         for conv in conversations:
             phone_number = conv.get("phoneNumber")
             if not phone_number:
                 continue
             
-            success = self.sync_conversation(phone_number)
-            if success:
-                synced_count += 1
-            else:
-                failed_count += 1
+            remote_ts = conv.get("lastTimestamp")
+            cursor = None if full else self.db.get_sync_cursor(phone_number)
+            if not full and remote_ts is not None:
+                if cursor and cursor.get("remoteLastTimestamp") == str(remote_ts):
+                    skipped_count += 1
+                    continue
+            
+            plan.append({"phone": phone_number, "cursor": cursor, "remote_ts": remote_ts})
+        phases["plan"] = round(time.perf_counter() - mark, 3)
+        
+        mark = time.perf_counter()
+        results = self._run_fetch_all(plan) if plan else []
+        phases["fetch"] = round(time.perf_counter() - mark, 3)
+        
+        items = [item for item in results if item is not None]
+        failed_count = len(results) - len(items)
+        
+        mark = time.perf_counter()
+        try:
+            self.db.apply_sync_batch(items)
+            synced_count = len(items)
+        except Exception as e:
+            print(f"[SYNC] Error applying sync batch: {e}")
+            import traceback
+            traceback.print_exc()
+            synced_count = 0
+            failed_count += len(items)
+        phases["apply"] = round(time.perf_counter() - mark, 3)
+        
+        if full and failed_count == 0:
+            self._last_full_resync = start_time
         
         duration = time.time() - start_time
         
+        mark = time.perf_counter()
         self.db.update_sync_stats(duration)
+        phases["stats"] = round(time.perf_counter() - mark, 3)
         
         return {
             "success": True,
+            "mode": "full" if full else "delta",
             "synced_count": synced_count,
+            "skipped_count": skipped_count,
             "failed_count": failed_count,
             "total_conversations": len(conversations),
+            "concurrency": self.concurrency,
             "duration": round(duration, 2),
+            "phases": phases,
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
     
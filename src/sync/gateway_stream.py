@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import socketio
+
+from src.sync.conversation_sync import ConversationSync
+
+
+def _ts_epoch(value: Any) -> Optional[float]:
+    """Gateway timestamp (epoch s/ms or ISO string) -> epoch seconds, None if unparseable."""
+    if value is None or value == "":
+        return None
+    try:
+        ts = float(value)
+        return ts / 1000.0 if ts > 1e11 else ts
+    except (TypeError, ValueError):
+        pass
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class GatewayStream:
+    """Socket.IO push channel from the Node gateway into ConversationDB.
+
+    The gateway emits ``message`` (``{"phoneNumber", "message"}``) and
+    ``messages`` (``{"phoneNumber", "messages"}``) events. Every applied
+    message advances a push cursor persisted next to the DB; on each
+    (re)connect we emit ``sync:resume`` with it so the gateway can replay
+    what we missed. The per-conversation poll cursor is left alone, so the
+    slower reconciliation poll still fetches anything the push missed.
+
+    The Node gateway in this repo does not emit these events or handle
+    ``sync:resume`` yet; until it does the stream stays idle and polling
+    keeps working as before.
+    """
+
+    def __init__(
+        self,
+        sync_service: ConversationSync,
+        url: Optional[str] = None,
+        cursor_path: Optional[str] = None,
+        on_state_change: Optional[Callable[[bool], None]] = None,
+    ):
+        self.sync_service = sync_service
+        self.db = sync_service.db
+        self.url = url or os.getenv("GATEWAY_SOCKET_URL", sync_service.node_server_url)
+        self.cursor_path = cursor_path or os.path.join("data", "storage", "gateway_cursor.json")
+        self.on_state_change = on_state_change
+
+        self._lock = threading.Lock()
+        # Counters are bumped from the socket.io threads and read by status()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.connected = False
+        self.connected_since: Optional[float] = None
+        self.last_event_at: Optional[float] = None
+        self.events = 0
+        self.messages_applied = 0
+        self.errors = 0
+        self.reconnects = 0
+        self._ever_connected = False
+        self.cursor = self._load_cursor()
+
+        self.client = socketio.Client(
+            reconnection=True,
+            reconnection_attempts=0,
+            reconnection_delay=1,
+            reconnection_delay_max=30,
+            randomization_factor=0.5,
+        )
+        self.client.on("connect", self._on_connect)
+        self.client.on("disconnect", self._on_disconnect)
+        self.client.on("message", self._on_message)
+        self.client.on("messages", self._on_messages)
+
+    # Resume cursor
+    def _load_cursor(self) -> Optional[str]:
+        try:
+            with open(self.cursor_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("since")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_cursor(self):
+        os.makedirs(os.path.dirname(self.cursor_path) or ".", exist_ok=True)
+        tmp = f"{self.cursor_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"since": self.cursor, "updatedAt": datetime.now(timezone.utc).isoformat()}, f)
+        os.replace(tmp, self.cursor_path)
+
+    # Socket.IO handlers
+    def _set_connected(self, connected: bool):
+        self.connected = connected
+        self.connected_since = time.time() if connected else None
+        if self.on_state_change:
+            try:
+                self.on_state_change(connected)
+            except Exception as e:
+                print(f"[STREAM] State callback error: {e}")
+
+    def _on_connect(self):
+        with self._stats_lock:
+            if self._ever_connected:
+                self.reconnects += 1
+            self._ever_connected = True
+        print(f"[STREAM] Connected to {self.url}, resuming from {self.cursor or 'start'}")
+        self._set_connected(True)
+        self.client.emit("sync:resume", {"since": self.cursor})
+
+    def _on_disconnect(self, *args):
+        print("[STREAM] Disconnected; polling takes over until reconnect")
+        self._set_connected(False)
+
+    def _on_message(self, data: Dict[str, Any]):
+        message = (data or {}).get("message")
+        self._apply((data or {}).get("phoneNumber"), [message] if message else [])
+
+    def _on_messages(self, data: Dict[str, Any]):
+        self._apply((data or {}).get("phoneNumber"), (data or {}).get("messages") or [])
+
+    def _apply(self, phone_number: Optional[str], messages: List[Dict[str, Any]]):
+        messages = [m for m in messages if isinstance(m, dict) and m.get("messageId")]
+        if not phone_number or not messages:
+            return
+        try:
+            with self._lock:
+                # Timestamps may be epoch numbers or ISO strings; compare them parsed
+                stamped = [(_ts_epoch(m.get("timestamp")), m.get("timestamp")) for m in messages]
+                stamped = [item for item in stamped if item[0] is not None]
+                latest = max(stamped, default=None, key=lambda item: item[0])
+                self.db.apply_sync_batch([{
+                    "phone": phone_number,
+                    "messages": messages,
+                    "metadata": {
+                        "lastMessage": messages[-1].get("text", ""),
+                        "lastTimestamp": messages[-1].get("timestamp", ""),
+                        "messageCount": len(messages),
+                    },
+                    # No poll cursor: a push may have skipped messages, so only
+                    # the reconciliation poll advances lastMessageTs/remoteLastTimestamp
+                }])
+                with self._stats_lock:
+                    self.events += 1
+                    self.messages_applied += len(messages)
+                    self.last_event_at = time.time()
+                if latest is not None:
+                    current = _ts_epoch(self.cursor)
+                    if current is None or latest[0] > current:
+                        self.cursor = str(latest[1])
+                        self._save_cursor()
+        except Exception as e:
+            with self._stats_lock:
+                self.errors += 1
+            print(f"[STREAM] Error applying {len(messages)} message(s) for {phone_number}: {e}")
+
+    # Lifecycle
+    def _run(self):
+        delay = 1.0
+        while not self._stop.is_set():
+            try:
+                self.client.connect(self.url, transports=["websocket", "polling"], wait_timeout=10)
+                # From here python-socketio handles reconnects itself
+                self.client.wait()
+                return
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                print(f"[STREAM] Connect to {self.url} failed: {e}; retry in {int(delay)}s")
+                if self._stop.wait(delay):
+                    return
+                delay = min(delay * 2, 60.0)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+    def status(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return self._status()
+
+    def _status(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "connected": self.connected,
+            "connected_since": datetime.fromtimestamp(self.connected_since, timezone.utc).isoformat() if self.connected_since else None,
+            "last_event_at": datetime.fromtimestamp(self.last_event_at, timezone.utc).isoformat() if self.last_event_at else None,
+            "cursor": self.cursor,
+            "events": self.events,
+            "messages_applied": self.messages_applied,
+            "reconnects": self.reconnects,
+            "errors": self.errors,
+        }
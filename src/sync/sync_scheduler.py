@@ -0,0 +1,187 @@
+import os
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from src.sync.conversation_sync import ConversationSync
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+class SyncScheduler:
+    """Runs ConversationSync.sync_all in the background.
+
+    Only one sync runs at a time (scheduled or via ``/sync/now``). The interval
+    halves while conversations keep changing and grows by half while idle,
+    within ``[min_interval, max_interval]``. Failures back off exponentially
+    with jitter so a struggling Node server is not hit in lockstep. While the
+    push stream is connected, polling only reconciles every
+    ``reconcile_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        sync_service: ConversationSync,
+        base_interval: Optional[float] = None,
+        min_interval: Optional[float] = None,
+        max_interval: Optional[float] = None,
+        max_backoff: Optional[float] = None,
+        reconcile_interval: Optional[float] = None,
+    ):
+        self.sync_service = sync_service
+        self.base_interval = base_interval or float(os.getenv("SYNC_BASE_INTERVAL", "60"))
+        self.min_interval = min_interval or float(os.getenv("SYNC_MIN_INTERVAL", "15"))
+        self.max_interval = max_interval or float(os.getenv("SYNC_MAX_INTERVAL", "300"))
+        self.max_backoff = max_backoff or float(os.getenv("SYNC_MAX_BACKOFF", "600"))
+        self.reconcile_interval = reconcile_interval or float(os.getenv("SYNC_RECONCILE_INTERVAL", "600"))
+        self.push_connected = False
+
+        self.interval = min(max(self.base_interval, self.min_interval), self.max_interval)
+        self._run_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Called with the result after every successful run, still under the run lock
+        self.after_sync: List[Callable[[Dict[str, Any]], None]] = []
+
+        self.next_run_at = time.time()
+        self.last_run_at: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.running_since: Optional[float] = None
+        self.consecutive_failures = 0
+        self.runs = 0
+        self.failed_runs = 0
+        self.skipped_runs = 0
+
+    def _backoff_delay(self) -> float:
+        delay = min(self.max_backoff, self.interval * (2 ** (self.consecutive_failures - 1)))
+        # Equal jitter: keep at least half the delay, randomize the rest
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _schedule_after(self, result: Optional[Dict[str, Any]]):
+        now = time.time()
+        with self._state_lock:
+            if not result or not result.get("success"):
+                self.consecutive_failures += 1
+                self.failed_runs += 1
+                self.next_run_at = now + self._backoff_delay()
+                return
+
+            self.consecutive_failures = 0
+            self.last_success_at = now
+            # A full resync touches every conversation, so it says nothing about activity
+            if result.get("mode") == "delta":
+                if result.get("synced_count", 0) > 0:
+                    self.interval = max(self.min_interval, self.interval / 2)
+                else:
+                    self.interval = min(self.max_interval, self.interval * 1.5)
+            delay = max(self.interval, self.reconcile_interval) if self.push_connected else self.interval
+            self.next_run_at = now + delay
+
+    def set_push_connected(self, connected: bool):
+        """Called by the push stream; on disconnect poll again soon so nothing
+        sent while the socket was down waits for the reconciliation pass."""
+        with self._state_lock:
+            self.push_connected = connected
+            if not connected:
+                self.next_run_at = min(self.next_run_at, time.time() + self.min_interval)
+        self._wake.set()
+
+    def run_once(self, full: bool = False, trigger: str = "scheduled") -> Dict[str, Any]:
+        if not self._run_lock.acquire(blocking=False):
+            with self._state_lock:
+                self.skipped_runs += 1
+            print(f"[SYNC] Skipping {trigger} sync: another sync is still running")
+            return {"success": False, "skipped": True, "error": "Sync already running"}
+
+        result: Optional[Dict[str, Any]] = None
+        try:
+            start = time.time()
+            with self._state_lock:
+                self.running_since = start
+                self.last_run_at = start
+                self.runs += 1
+            try:
+                result = self.sync_service.sync_all(full=full)
+            except Exception as e:
+                print(f"[SYNC] Error: {e}")
+                result = {"success": False, "error": str(e)}
+            result["trigger"] = trigger
+            with self._state_lock:
+                self.last_duration = round(time.time() - start, 3)
+                self.last_result = result
+                self.running_since = None
+            self._schedule_after(result)
+            if result.get("success"):
+                for hook in self.after_sync:
+                    try:
+                        hook(result)
+                    except Exception as e:
+                        print(f"[SYNC] after_sync hook {getattr(hook, '__name__', hook)} failed: {e}")
+            return result
+        finally:
+            self._run_lock.release()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(max(0.0, self.next_run_at - time.time()))
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            if time.time() < self.next_run_at:
+                # Woken early, or a manual run pushed the schedule back
+                continue
+            result = self.run_once(trigger="scheduled")
+            if result.get("skipped"):
+                with self._state_lock:
+                    self.next_run_at = time.time() + self.min_interval
+            elif result.get("success"):
+                print(f"[SYNC] Complete: {result['synced_count']} synced, {result['skipped_count']} unchanged in {result['duration']}s; next in {int(self.interval)}s")
+            else:
+                print(f"[SYNC] Failed ({self.consecutive_failures} in a row): {result.get('error')}; retry in {int(self.next_run_at - time.time())}s")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def status(self) -> Dict[str, Any]:
+        with self._state_lock:
+            last = self.last_result or {}
+            return {
+                "running": self.running_since is not None,
+                "mode": "reconcile" if self.push_connected else "poll",
+                "running_since": _iso(self.running_since),
+                "interval": round(self.interval, 1),
+                "next_run_at": _iso(self.next_run_at),
+                "next_run_in": round(max(0.0, self.next_run_at - time.time()), 1),
+                "last_run_at": _iso(self.last_run_at),
+                "last_success_at": _iso(self.last_success_at),
+                "last_duration": self.last_duration,
+                "last_result": {
+                    "success": last.get("success"),
+                    "trigger": last.get("trigger"),
+                    "mode": last.get("mode"),
+                    "synced_count": last.get("synced_count"),
+                    "skipped_count": last.get("skipped_count"),
+                    "failed_count": last.get("failed_count"),
+                    "error": last.get("error"),
+                } if last else None,
+                "consecutive_failures": self.consecutive_failures,
+                "runs": self.runs,
+                "failed_runs": self.failed_runs,
+                "skipped_runs": self.skipped_runs,
+            }